@@ -1,12 +1,14 @@
 import docker
 from fastapi import HTTPException
 from dotenv import load_dotenv
-import os, random
+import os, threading
 from datetime import datetime
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 from schemas import UserCreate
+from executors import BLOCKING_WORKERS
+from ports import PortAllocator
 
 load_dotenv()
 
@@ -20,31 +22,112 @@ MAIN_DB_URL = f"postgresql://{MAIN_DB_USER}:{MAIN_DB_PASSWORD}@{MAIN_DB_HOST}/{M
 engine = create_engine(MAIN_DB_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_random_port():
-    return random.randint(1024, 65535)
+POSTGRES_IMAGE = "custom-postgres"
+NETWORK_NAME = "docker_mynetwork"
 
-def create_postgresql_container(user: UserCreate):
-    client = docker.from_env()
-    network_name = "docker_mynetwork"
-    try:
-        network = client.networks.get(network_name)
-    except docker.errors.NotFound:
-        network = client.networks.create(network_name, driver="bridge")
+# Publish each tenant's Postgres on a host port. With 0 the containers are only reachable over
+# NETWORK_NAME by hostname, which needs the backend on that network (TENANT_DB_USE_HOST_PORT=0).
+TENANT_PUBLISH_PORTS = os.getenv("TENANT_PUBLISH_PORTS", "1") == "1"
+# Ports tried before giving up when Docker reports the host port is already taken
+PORT_ALLOCATION_ATTEMPTS = int(os.getenv("PORT_ALLOCATION_ATTEMPTS", "5"))
+
+# Host ports of tenant containers, with the main database as the ledger (loaded at startup)
+port_allocator = PortAllocator(engine=engine)
+
+# One Docker client shared by every caller; its HTTP pool is sized for the blocking executor
+_docker_client = None
+_docker_client_lock = threading.Lock()
+
+def get_docker_client():
+    """Return the process-wide Docker client, creating it on first use."""
+    global _docker_client
+    if _docker_client is None:
+        with _docker_client_lock:
+            if _docker_client is None:
+                _docker_client = docker.from_env(max_pool_size=BLOCKING_WORKERS)
+    return _docker_client
+
+def published_port(container) -> int:
+    """The host port a container publishes 5432 on (its configured binding when stopped), or 5432 when unpublished."""
+    bindings = (container.ports or {}).get("5432/tcp")
+    if not bindings:
+        bindings = (container.attrs.get("HostConfig", {}).get("PortBindings") or {}).get("5432/tcp")
+    return int(bindings[0]["HostPort"]) if bindings else 5432
+
+def _is_port_conflict(error: Exception) -> bool:
+    message = str(error).lower()
+    return "port is already allocated" in message or "address already in use" in message
+
+def run_postgres_container(client, name: str, environment: dict, labels: dict = None, ports: PortAllocator = None):
+    """
+    Start a Postgres container on NETWORK_NAME, publishing it on an allocated host port.
+
+    A port Docker refuses (bound outside the allocator's ledger) is blocked and the next one
+    is tried, up to PORT_ALLOCATION_ATTEMPTS times.
+
+    Returns:
+    - (container, port); port is 5432 when host ports are not published.
+    """
+    ports = ports or port_allocator
+    for _ in range(PORT_ALLOCATION_ATTEMPTS):
+        port = ports.allocate(name) if TENANT_PUBLISH_PORTS else None
+        try:
+            container = client.containers.run(
+                POSTGRES_IMAGE,
+                name=name,
+                environment=environment,
+                ports={"5432/tcp": port} if port else None,
+                network=NETWORK_NAME,
+                labels=labels,
+                detach=True
+            )
+            return container, port or 5432
+        except docker.errors.APIError as e:
+            if port is None or not _is_port_conflict(e):
+                if port is not None:
+                    ports.release(name)
+                raise
+            print(f"Host port {port} is taken outside the allocator; trying another for {name}.")
+            ports.block(port, name)
+            # docker run creates the container before binding the port; remove the husk
+            try:
+                client.containers.get(name).remove(force=True)
+            except docker.errors.NotFound:
+                pass
+    raise RuntimeError(f"No bindable host port for {name} after {PORT_ALLOCATION_ATTEMPTS} attempts")
+
+# Networks already looked up or created, per client: concurrent provisioning must not create a network twice
+_networks = {}
+_networks_lock = threading.Lock()
+
+def ensure_network(client, network_name: str = NETWORK_NAME):
+    """Return the bridge network tenant containers join, creating it if needed."""
+    key = (id(client), network_name)
+    if key not in _networks:
+        with _networks_lock:
+            if key not in _networks:
+                try:
+                    _networks[key] = client.networks.get(network_name)
+                except docker.errors.NotFound:
+                    _networks[key] = client.networks.create(network_name, driver="bridge")
+    return _networks[key]
+
+def create_postgresql_container(user: UserCreate, client=None, ports: PortAllocator = None):
+    client = client or get_docker_client()
+    network_name = NETWORK_NAME
+    network = ensure_network(client, network_name)
 
-    port = get_random_port()
     container_name = f"postgres_{user.username}"
 
-    container = client.containers.run(
-        "custom-postgres",
-        name=container_name,
+    container, port = run_postgres_container(
+        client,
+        container_name,
         environment={
             "POSTGRES_USER": user.username,
             "POSTGRES_PASSWORD": user.password,
             "POSTGRES_DB": user.username
         },
-        ports={f"5432/tcp": port},
-        network=network_name,
-        detach=True
+        ports=ports,
     )
 
     print(f"PostgreSQL container for user '{user.username}' is running with name {container_name} on port {port}.")
@@ -66,6 +149,13 @@ def init_main_db():
                     container_port INTEGER NOT NULL
                 );
             '''))
+            # Columns added for shared-cluster tenancy; rows created before them are container tenants
+            session.execute(text('''
+                ALTER TABLE users
+                    ADD COLUMN IF NOT EXISTS tenancy_mode VARCHAR(20) NOT NULL DEFAULT 'container',
+                    ADD COLUMN IF NOT EXISTS database_name VARCHAR(100),
+                    ADD COLUMN IF NOT EXISTS schema_name VARCHAR(100);
+            '''))
             session.commit()
         print("Users table created or already exists.")
     except SQLAlchemyError as e:
@@ -74,15 +164,18 @@ def init_main_db():
 
 
 
-def save_user_to_db(user: UserCreate, container_id: str, hostname: str, port: int):
-    """Save the user details along with container information to the main database."""
+def save_user_to_db(user: UserCreate, container_id: str, hostname: str, port: int, tenancy_mode: str = "container",
+                    database_name: str = None, schema_name: str = None):
+    """Save the user details along with container (or shared cluster) information to the main database."""
     try:
         with SessionLocal() as session:
             registration_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             session.execute(
                 text('''
-                INSERT INTO users (username, password, registration_time, container_id, container_hostname, container_port)
-                VALUES (:username, :password, :registration_time, :container_id, :container_hostname, :container_port)
+                INSERT INTO users (username, password, registration_time, container_id, container_hostname, container_port,
+                                   tenancy_mode, database_name, schema_name)
+                VALUES (:username, :password, :registration_time, :container_id, :container_hostname, :container_port,
+                        :tenancy_mode, :database_name, :schema_name)
                 '''),
                 {
                     "username": user.username,
@@ -90,7 +183,10 @@ def save_user_to_db(user: UserCreate, container_id: str, hostname: str, port: in
                     "registration_time": registration_time,
                     "container_id": container_id,
                     "container_hostname": hostname,
-                    "container_port": port
+                    "container_port": port,
+                    "tenancy_mode": tenancy_mode,
+                    "database_name": database_name or user.username,
+                    "schema_name": schema_name
                 }
             )
             session.commit()
@@ -98,3 +194,47 @@ def save_user_to_db(user: UserCreate, container_id: str, hostname: str, port: in
     except Exception as e:
         print(f"Failed to save user to database: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to save user to database: {e}")
+
+def get_user_endpoint(username: str):
+    """Read the stored connection details of a user's database from the main database."""
+    with SessionLocal() as session:
+        row = session.execute(
+            text('''
+            SELECT username, password, container_id, container_hostname, container_port,
+                   tenancy_mode, database_name, schema_name
+            FROM users WHERE username = :username
+            '''),
+            {"username": username}
+        ).mappings().first()
+    return dict(row) if row else None
+
+def load_user_endpoints():
+    """Read the stored connection details of every user, keyed by username."""
+    with SessionLocal() as session:
+        rows = session.execute(
+            text('''
+            SELECT username, password, container_id, container_hostname, container_port,
+                   tenancy_mode, database_name, schema_name
+            FROM users
+            ''')
+        ).mappings().all()
+    return {row["username"]: dict(row) for row in rows}
+
+def update_user_port(username: str, port: int):
+    """Record the host port a user's container actually publishes."""
+    with SessionLocal() as session:
+        session.execute(text("UPDATE users SET container_port = :port WHERE username = :username"),
+                        {"port": port, "username": username})
+        session.commit()
+
+def delete_user_from_db(username: str) -> bool:
+    """Delete a user's row from the main database; returns False when the user does not exist."""
+    try:
+        with SessionLocal() as session:
+            result = session.execute(text("DELETE FROM users WHERE username = :username"), {"username": username})
+            session.commit()
+        print(f"User '{username}' deleted.")
+        return result.rowcount > 0
+    except Exception as e:
+        print(f"Failed to delete user from database: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete user from database: {e}")
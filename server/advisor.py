@@ -0,0 +1,298 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.exc import SQLAlchemyError
+
+from catalog import catalog_cache
+from models import quote_identifier, validate_identifier
+from profiler import QueryProfiler, query_profiler
+from query_engine import query_backend, run_query
+
+# Tables smaller than this are left alone: a sequential scan of a few pages beats an index
+ADVISOR_MIN_TABLE_ROWS = int(os.getenv("ADVISOR_MIN_TABLE_ROWS", "1000"))
+# Columns in a recommended index (equality columns first, then at most one range column)
+ADVISOR_MAX_INDEX_COLUMNS = int(os.getenv("ADVISOR_MAX_INDEX_COLUMNS", "3"))
+# statement_timeout for CREATE INDEX CONCURRENTLY, which can take far longer than a query (0: none)
+ADVISOR_INDEX_TIMEOUT_MS = int(os.getenv("ADVISOR_INDEX_TIMEOUT_MS", "0"))
+
+# Sequential and index scans per table of the tenant's schema, since the statistics were last reset
+TABLE_STATS_QUERY = """
+SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), n_live_tup
+FROM pg_catalog.pg_stat_user_tables
+WHERE schemaname = current_schema()
+"""
+
+# Existing indexes with their key columns in order (expression columns are skipped)
+INDEX_QUERY = """
+SELECT t.relname, i.relname, string_agg(a.attname, ',' ORDER BY k.position)
+FROM pg_catalog.pg_index x
+JOIN pg_catalog.pg_class t ON t.oid = x.indrelid
+JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+CROSS JOIN LATERAL unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+JOIN pg_catalog.pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+WHERE n.nspname = current_schema()
+GROUP BY t.relname, i.relname
+"""
+
+_IDENTIFIER = r'(?:"[^"]+"|[A-Za-z_][\w$]*)'
+_TABLE_REFERENCE = re.compile(
+    rf"\b(?:FROM|JOIN|UPDATE|INTO)\s+(?:ONLY\s+)?(?:{_IDENTIFIER}\.)?({_IDENTIFIER})(?:\s+(?:AS\s+)?({_IDENTIFIER}))?",
+    re.IGNORECASE)
+_WHERE_CLAUSE = re.compile(r"\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|\bOFFSET\b|\bRETURNING\b|"
+                           r"\bFOR UPDATE\b|\bUNION\b|\)\s*$|$)", re.IGNORECASE | re.DOTALL)
+# A column compared with a constant (the profiler's fingerprints turn constants into ? and lists into (...))
+_PREDICATE = re.compile(
+    rf"(?:({_IDENTIFIER})\.)?({_IDENTIFIER})\s*(=|<=|>=|<|>|\bIN\b|\bBETWEEN\b)\s*(\?|\(\.\.\.\))", re.IGNORECASE)
+_RESERVED = {"where", "join", "on", "left", "right", "inner", "outer", "full", "cross", "natural", "order", "group",
+             "limit", "offset", "set", "values", "using", "returning", "union", "lateral", "select", "default"}
+
+
+def _name(identifier: str) -> str:
+    """Postgres folds unquoted identifiers to lower case."""
+    return identifier[1:-1] if identifier.startswith('"') else identifier.lower()
+
+
+def extract_predicates(query: str, columns_of: Dict[str, Sequence[str]]) -> List[Tuple[str, List[str], List[str]]]:
+    """
+    Find the columns a statement filters on with constants.
+
+    Parameters:
+    - query: A normalized statement, as recorded by the query profiler.
+    - columns_of: Table name -> column names, to resolve unqualified columns in joins.
+
+    Returns:
+    - (table, equality columns, range columns) per table the WHERE clause filters.
+    """
+    aliases: Dict[str, str] = {}
+    tables: List[str] = []
+    for table, alias in _TABLE_REFERENCE.findall(query):
+        table = _name(table)
+        if table not in columns_of:
+            continue
+        tables.append(table)
+        aliases[table] = table
+        if alias and _name(alias) not in _RESERVED:
+            aliases[_name(alias)] = table
+    where = _WHERE_CLAUSE.search(query)
+    if not tables or where is None:
+        return []
+    found: Dict[str, Tuple[List[str], List[str]]] = {}
+    for qualifier, column, operator, _ in _PREDICATE.findall(where.group(1)):
+        column = _name(column)
+        if qualifier:
+            table = aliases.get(_name(qualifier))
+        else:
+            owners = [table for table in dict.fromkeys(tables) if column in columns_of[table]]
+            table = owners[0] if len(owners) == 1 else None
+        if table is None or column not in columns_of[table]:
+            continue
+        equality, ranges = found.setdefault(table, ([], []))
+        target = equality if operator.upper() in ("=", "IN") else ranges
+        if column not in equality and column not in target:
+            target.append(column)
+    return [(table, equality, ranges) for table, (equality, ranges) in found.items()]
+
+
+def index_name(table: str, columns: Sequence[str]) -> str:
+    """ix_<table>_<columns>, shortened with a hash to Postgres' 63-byte identifier limit."""
+    name = f"ix_{table}_{'_'.join(columns)}"
+    if len(name) > 63:
+        name = f"{name[:54]}_{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}"
+    return name
+
+
+def index_ddl(table: str, columns: Sequence[str], name: Optional[str] = None) -> str:
+    return (f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote_identifier(name or index_name(table, columns))} "
+            f"ON {quote_identifier(table)} ({', '.join(quote_identifier(column) for column in columns)})")
+
+
+def _covered(columns: Sequence[str], existing: Iterable[Sequence[str]]) -> bool:
+    """An index whose leading columns are the candidate's (in any order) already serves it."""
+    wanted = set(columns)
+    return any(set(index[:len(columns)]) == wanted for index in existing)
+
+
+class IndexAdvisor:
+    """
+    Recommend indexes for a tenant from the statements its query profiler recorded.
+
+    Each fingerprint's WHERE clause is reduced to the columns it compares with constants; a
+    candidate index puts its equality columns first and one range column last. Candidates are
+    weighed by the time their statements took, and kept only for tables that are big enough and
+    actually sequentially scanned (pg_stat_user_tables, or a sampled plan), and that no existing
+    index already serves. Join keys, ORDER BY and expression indexes are not considered.
+    """
+
+    def __init__(self, profiler: QueryProfiler = query_profiler, query=run_query, catalog=catalog_cache,
+                 min_table_rows: int = ADVISOR_MIN_TABLE_ROWS, max_columns: int = ADVISOR_MAX_INDEX_COLUMNS):
+        self.profiler = profiler
+        self.query = query
+        self.catalog = catalog
+        self.min_table_rows = min_table_rows
+        self.max_columns = max_columns
+        self.applied = 0
+        self.failed = 0
+
+    async def table_stats(self, username: str) -> Dict[str, Dict[str, int]]:
+        result = await self.query(username, TABLE_STATS_QUERY)
+        return {
+            table: {"seq_scan": int(seq_scan), "seq_tup_read": int(seq_tup_read), "idx_scan": int(idx_scan),
+                    "live_rows": int(live_rows)}
+            for table, seq_scan, seq_tup_read, idx_scan, live_rows in result.records()
+        }
+
+    async def existing_indexes(self, username: str) -> Dict[str, Dict[str, List[str]]]:
+        result = await self.query(username, INDEX_QUERY)
+        indexes: Dict[str, Dict[str, List[str]]] = {}
+        for table, index, columns in result.records():
+            indexes.setdefault(table, {})[index] = columns.split(",") if columns else []
+        return indexes
+
+    async def recommend(self, username: str, top: int = 500) -> Dict[str, Any]:
+        """
+        Recommend indexes for one tenant.
+
+        Parameters:
+        - username: The tenant.
+        - top: How many of the tenant's most expensive statements to analyze.
+
+        Returns:
+        - The recommendations, best first, with the DDL to create each and the evidence behind it.
+        """
+        catalog = await self.catalog.get(username)
+        columns_of = {table: catalog.column_names(table) for table in catalog.table_names()}
+        stats = await self.table_stats(username)
+        existing = await self.existing_indexes(username)
+        statements = self.profiler.top(top, "total_ms", tenant=username)
+
+        candidates: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+        for statement in statements:
+            plan_seq_scans = set((statement.get("plan") or {}).get("seq_scans", ()))
+            for table, equality, ranges in extract_predicates(statement["query"], columns_of):
+                columns = tuple((equality + ranges[:1])[:self.max_columns])
+                if not columns:
+                    continue
+                if any(index and set(index) <= set(equality) for index in existing.get(table, {}).values()):
+                    # Every key column of an existing index (e.g. the id primary key) is pinned by an equality
+                    continue
+                candidate = candidates.setdefault((table, columns), {
+                    "table": table, "columns": list(columns), "total_ms": 0.0, "calls": 0, "fingerprints": [],
+                    "plan_seq_scan": False,
+                })
+                candidate["total_ms"] += statement["total_ms"]
+                candidate["calls"] += statement["calls"]
+                candidate["fingerprints"].append(statement["fingerprint"])
+                candidate["plan_seq_scan"] = candidate["plan_seq_scan"] or table in plan_seq_scans
+
+        recommendations, skipped = [], []
+        for (table, columns), candidate in candidates.items():
+            table_stats = stats.get(table, {})
+            candidate["table_stats"] = table_stats
+            reason = None
+            if _covered(columns, existing.get(table, {}).values()):
+                reason = "served by an existing index"
+            elif table_stats.get("live_rows", 0) < self.min_table_rows:
+                reason = f"table has fewer than {self.min_table_rows} rows"
+            elif not table_stats.get("seq_scan") and not candidate["plan_seq_scan"]:
+                reason = "table is not sequentially scanned"
+            if reason is not None:
+                skipped.append(dict(candidate, reason=reason))
+                continue
+            candidate["index_name"] = index_name(table, columns)
+            candidate["ddl"] = index_ddl(table, columns)
+            recommendations.append(candidate)
+
+        # Candidates whose columns lead a better-scoring recommendation on the same table are served by it
+        recommendations.sort(key=lambda candidate: candidate["total_ms"], reverse=True)
+        kept: List[Dict[str, Any]] = []
+        for candidate in recommendations:
+            chosen = [other["columns"] for other in kept if other["table"] == candidate["table"]]
+            if _covered(candidate["columns"], chosen):
+                skipped.append(dict(candidate, reason="served by a higher-ranked recommendation"))
+                continue
+            kept.append(candidate)
+        for candidate in kept:
+            candidate["total_ms"] = round(candidate["total_ms"], 3)
+
+        heavy_scans = [
+            {"table": table, **table_stats} for table, table_stats in stats.items()
+            if table_stats["live_rows"] >= self.min_table_rows and table_stats["seq_scan"] > table_stats["idx_scan"]
+        ]
+        return {
+            "tenant": username,
+            "profiled_statements": len(statements),
+            "profiler_enabled": self.profiler.enabled,
+            "recommendations": kept,
+            "skipped": skipped,
+            # Tables scanned sequentially more often than through an index, whether or not a statement explains why
+            "sequentially_scanned_tables": sorted(heavy_scans, key=lambda entry: entry["seq_tup_read"], reverse=True),
+        }
+
+    async def create_index(self, username: str, table: str, columns: Sequence[str], backend=None) -> Dict[str, Any]:
+        """
+        Build an index with CREATE INDEX CONCURRENTLY, so the tenant's writes are not blocked meanwhile.
+
+        Parameters:
+        - username: The tenant.
+        - table, columns: The table and the index's key columns, in order.
+        - backend: The query backend; defaults to query_engine.query_backend.
+
+        Returns:
+        - The index name, its DDL and how long the build took.
+        """
+        try:
+            for identifier in (table, *columns):
+                validate_identifier(identifier)
+            if not columns:
+                raise ValueError("An index needs at least one column.")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await self.catalog.validate_columns(username, table, columns)
+        name = index_name(table, columns)
+        ddl = index_ddl(table, columns, name)
+        backend = backend or query_backend
+        start = time.perf_counter()
+        try:
+            if hasattr(backend, "get_engine"):
+                await self._create_concurrently(await backend.get_engine(username), ddl, name)
+            else:
+                # psql -c runs outside a transaction block already
+                await backend.execute(username, ddl)
+        except HTTPException:
+            self.failed += 1
+            raise
+        except SQLAlchemyError as e:
+            self.failed += 1
+            raise HTTPException(status_code=400, detail=str(getattr(e, "orig", None) or e))
+        self.applied += 1
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+        logging.info(f"Created index {name} for tenant {username} in {elapsed_ms} ms")
+        return {"table": table, "columns": list(columns), "index_name": name, "ddl": ddl, "duration_ms": elapsed_ms}
+
+    async def _create_concurrently(self, engine, ddl: str, name: str):
+        async with engine.connect() as conn:
+            # CONCURRENTLY refuses to run inside a transaction block
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            try:
+                await conn.exec_driver_sql(f"SET statement_timeout = {int(ADVISOR_INDEX_TIMEOUT_MS)}")
+                try:
+                    await conn.exec_driver_sql(ddl)
+                except SQLAlchemyError:
+                    # A failed concurrent build leaves an INVALID index behind
+                    await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {quote_identifier(name)}")
+                    raise
+            finally:
+                # The session's statement_timeout was changed; do not hand this connection to a query
+                await conn.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"applied": self.applied, "failed": self.failed, "min_table_rows": self.min_table_rows}
+
+
+index_advisor = IndexAdvisor()
@@ -0,0 +1,191 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+from fastapi import HTTPException
+from sqlalchemy import MetaData
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import CompileError, SQLAlchemyError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from catalog import is_ddl
+from models import CHANGE_TRACKING, change_tracking_statements, create_table, statement_cache, validate_identifier
+from query_engine import QueryResult, is_script, query_backend, run_script
+
+# Largest number of operations accepted in one batch request
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "1000"))
+BATCH_ERROR_MODES = ("rollback", "continue")
+
+_dialect = postgresql.dialect()
+
+
+@dataclass
+class BatchStep:
+    """One planned batch operation: raw SQL text, a cached CRUD statement, or a Table to create."""
+    op: str
+    statement: Any
+    table_name: Optional[str] = None
+    params: Optional[Dict[str, Any]] = None
+    ddl: bool = False
+
+
+def _require(operation, *fields: str):
+    for name in fields:
+        if getattr(operation, name) is None:
+            raise ValueError(f"'{operation.op}' requires '{name}'.")
+
+
+def _plan_operation(operation) -> BatchStep:
+    if operation.op == "sql":
+        _require(operation, "sql")
+        return BatchStep("sql", operation.sql, ddl=is_ddl(operation.sql))
+    _require(operation, "table_name")
+    table_name = operation.table_name
+    if operation.op == "create_table":
+        _require(operation, "columns")
+        table = create_table(MetaData(), validate_identifier(table_name), operation.columns)
+        return BatchStep("create_table", table, table_name, ddl=True)
+    if operation.op == "insert":
+        _require(operation, "item")
+        statement = statement_cache.get("insert", table_name, tuple(sorted(operation.item)))
+        return BatchStep("insert", statement, table_name, dict(operation.item))
+    if operation.op == "update":
+        _require(operation, "item", "item_id")
+        statement = statement_cache.get("update", table_name, tuple(sorted(operation.item)))
+        return BatchStep("update", statement, table_name, dict(operation.item, id=operation.item_id))
+    if operation.op == "delete":
+        _require(operation, "item_id")
+        return BatchStep("delete", statement_cache.get("delete", table_name), table_name, {"id": operation.item_id})
+    raise ValueError(f"Unsupported operation: {operation.op}")
+
+
+def plan_batch(operations: list) -> List[BatchStep]:
+    """
+    Validate batch operations and build their statements before a connection is taken.
+
+    Parameters:
+    - operations: schemas.BatchOperation instances, in execution order.
+
+    Returns:
+    - One BatchStep per operation; a ValueError names the first invalid operation.
+    """
+    if not operations:
+        raise ValueError("A batch needs at least one operation.")
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise ValueError(f"A batch may hold at most {BATCH_MAX_OPERATIONS} operations.")
+    steps = []
+    for index, operation in enumerate(operations):
+        try:
+            steps.append(_plan_operation(operation))
+        except ValueError as e:
+            raise ValueError(f"Operation {index}: {e}")
+    return steps
+
+
+def render_pipeline(steps: List[BatchStep]) -> str:
+    """Render every step as literal SQL, joined into one script sent in a single round trip."""
+    parts = []
+    for position, step in enumerate(steps):
+        try:
+            if step.op == "sql":
+                parts.append(step.statement.strip().rstrip(";"))
+            elif step.op == "create_table":
+                parts.append(str(CreateTable(step.statement, if_not_exists=True).compile(dialect=_dialect)))
+                parts.extend(str(CreateIndex(index, if_not_exists=True).compile(dialect=_dialect))
+                             for index in step.statement.indexes)
+                if CHANGE_TRACKING:
+                    parts.extend(change_tracking_statements(step.table_name))
+            else:
+                statement = step.statement.bindparams(**step.params)
+                parts.append(str(statement.compile(dialect=_dialect, compile_kwargs={"literal_binds": True})))
+        except CompileError as e:
+            raise ValueError(f"Operation {position} cannot be pipelined: {e}")
+    return ";\n".join(parts)
+
+
+def _error_message(error: Exception) -> str:
+    return str(getattr(error, "orig", None) or error)
+
+
+async def _run_step(conn, step: BatchStep) -> Dict[str, Any]:
+    if step.op == "create_table":
+        await conn.run_sync(step.statement.create, checkfirst=True)
+        if CHANGE_TRACKING:
+            for statement in change_tracking_statements(step.table_name):
+                await conn.exec_driver_sql(statement)
+        return {}
+    if step.op == "sql":
+        if is_script(step.statement):
+            await run_script(conn, step.statement)
+            return {}
+        # Raw client SQL keeps ':' and '%' literal, as in the single-statement endpoints
+        result = await conn.exec_driver_sql(step.statement)
+    else:
+        result = await conn.execute(step.statement, step.params)
+    if result.returns_rows:
+        rows = [tuple(row) for row in result.fetchall()]
+        return {"result": QueryResult(columns=list(result.keys()), rows=rows, returns_rows=True).to_response()}
+    return {"rowcount": result.rowcount}
+
+
+async def run_batch(username: str, steps: List[BatchStep], on_error: str = "rollback", pipeline: bool = False,
+                    backend=None) -> Dict[str, Any]:
+    """
+    Run planned steps in order in one transaction on one pooled connection of the tenant.
+
+    Parameters:
+    - username: The tenant whose database runs the batch.
+    - steps: The output of plan_batch.
+    - on_error: "rollback" aborts the batch at the first failure; "continue" wraps every step in a
+      savepoint, rolls back only the failed step and commits the rest.
+    - pipeline: Send the whole batch as one script (one round trip). All-or-nothing, and steps
+      report no rows or row counts.
+
+    Returns:
+    - Per-step results with the number of failed steps. A failure under "rollback" raises a 400
+      whose detail carries the results up to and including the failed step.
+    """
+    backend = backend or query_backend
+    if not hasattr(backend, "get_engine"):
+        raise HTTPException(status_code=400, detail="Batches require QUERY_ENGINE_MODE=pool.")
+    if on_error not in BATCH_ERROR_MODES:
+        raise HTTPException(status_code=400, detail=f"on_error must be one of {', '.join(BATCH_ERROR_MODES)}.")
+    if pipeline and on_error != "rollback":
+        raise HTTPException(status_code=400, detail="Pipelined batches are all-or-nothing; use on_error=rollback.")
+    try:
+        script = render_pipeline(steps) if pipeline else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    engine = await backend.get_engine(username)
+    results = []
+    try:
+        async with engine.begin() as conn:
+            if pipeline:
+                await run_script(conn, script)
+                return {"results": [{"index": index, "op": step.op, "status": "ok"} for index, step in enumerate(steps)],
+                        "errors": 0}
+            for index, step in enumerate(steps):
+                entry = {"index": index, "op": step.op}
+                results.append(entry)
+                try:
+                    if on_error == "continue":
+                        async with conn.begin_nested():
+                            entry.update(await _run_step(conn, step))
+                    else:
+                        entry.update(await _run_step(conn, step))
+                    entry["status"] = "ok"
+                except (SQLAlchemyError, asyncpg.PostgresError) as e:
+                    entry.update(status="error", error=_error_message(e))
+                    if on_error == "rollback":
+                        # Raised inside the transaction block, so everything before it is rolled back too
+                        raise HTTPException(status_code=400, detail={
+                            "message": f"Operation {index} failed; the batch was rolled back.",
+                            "results": results,
+                        })
+    except (SQLAlchemyError, asyncpg.PostgresError) as e:
+        # The pipelined script or the final COMMIT failed
+        raise HTTPException(status_code=400, detail={"message": f"Batch rolled back: {_error_message(e)}",
+                                                     "results": results})
+    return {"results": results, "errors": sum(1 for entry in results if entry["status"] == "error")}
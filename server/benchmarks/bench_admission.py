@@ -0,0 +1,93 @@
+"""
+Noisy-neighbour load test for tenant admission control.
+
+One noisy tenant keeps --noisy-clients heavy requests in flight while --quiet-tenants tenants send
+light requests with think time. All requests share --capacity database/worker slots. Without the
+scheduler everyone queues FIFO behind the noisy tenant; with it the noisy tenant is capped at its
+concurrency and rate limits (and receives 429s) while quiet tenants keep their latency.
+
+Usage:
+    python benchmarks/bench_admission.py [--seconds 3] [--capacity 16] [--noisy-clients 100]
+"""
+import argparse
+import asyncio
+import contextlib
+import time
+
+from common import percentile, print_table
+
+from fastapi import HTTPException
+
+from scheduler import TenantScheduler
+
+
+async def run_mode(args, scheduler):
+    capacity = asyncio.Semaphore(args.capacity)
+    latencies = {"quiet": [], "noisy": []}
+    rejected = {"quiet": 0, "noisy": 0}
+    deadline = time.monotonic() + args.seconds
+
+    async def request(username: str, kind: str, work_s: float):
+        start = time.perf_counter()
+        slot = scheduler.slot(username) if scheduler else contextlib.nullcontext()
+        try:
+            async with slot:
+                async with capacity:
+                    await asyncio.sleep(work_s)
+        except HTTPException:
+            rejected[kind] += 1
+            return False
+        latencies[kind].append(time.perf_counter() - start)
+        return True
+
+    async def noisy_client():
+        while time.monotonic() < deadline:
+            if not await request("noisy", "noisy", args.heavy_ms / 1000):
+                await asyncio.sleep(0.01)
+
+    async def quiet_client(i: int):
+        while time.monotonic() < deadline:
+            await request(f"quiet{i}", "quiet", args.light_ms / 1000)
+            await asyncio.sleep(args.think_ms / 1000)
+
+    await asyncio.gather(*(noisy_client() for _ in range(args.noisy_clients)),
+                         *(quiet_client(i) for i in range(args.quiet_tenants)))
+    quiet = latencies["quiet"]
+    return {
+        "quiet_done": len(quiet),
+        "quiet_p50_ms": round(percentile(quiet, 50) * 1000, 1),
+        "quiet_p99_ms": round(percentile(quiet, 99) * 1000, 1),
+        "noisy_done": len(latencies["noisy"]),
+        "noisy_429": rejected["noisy"],
+        "quiet_429": rejected["quiet"],
+    }
+
+
+async def run(args):
+    scheduler = TenantScheduler(max_concurrency=args.capacity, tenant_concurrency=args.tenant_concurrency,
+                                tenant_queue=args.tenant_queue, rate=args.rate, burst=args.rate * 2)
+    results = {
+        "no admission control": await run_mode(args, None),
+        "tenant scheduler": await run_mode(args, scheduler),
+    }
+    print_table(f"{args.noisy_clients} noisy clients vs {args.quiet_tenants} quiet tenants on {args.capacity} slots", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--capacity", type=int, default=16, help="Shared worker/connection slots")
+    parser.add_argument("--noisy-clients", type=int, default=100)
+    parser.add_argument("--quiet-tenants", type=int, default=8)
+    parser.add_argument("--heavy-ms", type=float, default=50.0)
+    parser.add_argument("--light-ms", type=float, default=5.0)
+    parser.add_argument("--think-ms", type=float, default=20.0)
+    parser.add_argument("--tenant-concurrency", type=int, default=4)
+    parser.add_argument("--tenant-queue", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=100.0, help="Requests per second per tenant")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Show that one tenant's slow query no longer raises latency for other tenants.
+
+A "slow" tenant keeps issuing statements that take --slow-ms while the other tenants
+issue fast statements. The "blocking" variant runs each statement synchronously inside
+the async handler, as db_routes did with psql exec; the "async" variant uses the pooled
+async query engine.
+
+Usage:
+    python benchmarks/bench_async_isolation.py [--tenants 10] [--requests 200] [--slow-ms 200]
+"""
+import argparse
+import asyncio
+
+from common import print_table, run_async_load
+from fakes import FakeAsyncEngine, fake_endpoint
+
+from routing import TenantRoutingCache
+from query_engine import PooledBackend
+
+SLOW_TENANT = "tenant0"
+
+
+def make_backend(blocking: bool, slow_latency: float, fast_latency: float) -> PooledBackend:
+    engines = {}
+
+    def engine_lookup(key, url):
+        if key not in engines:
+            latency = slow_latency if key[0] == f"postgres_{SLOW_TENANT}" else fast_latency
+            engines[key] = FakeAsyncEngine(latency=latency, blocking=blocking)
+        return engines[key]
+
+    return PooledBackend(routes=TenantRoutingCache(loader=fake_endpoint), engine_lookup=engine_lookup)
+
+
+async def measure(backend: PooledBackend, tenants: int, requests: int, concurrency: int):
+    stop = asyncio.Event()
+
+    async def slow_tenant():
+        while not stop.is_set():
+            await backend.execute(SLOW_TENANT, "SELECT pg_sleep(1)")
+            # Cached routing lookups and blocking statements never yield; without this the
+            # blocking variant would starve the event loop and the fast tenants forever
+            await asyncio.sleep(0)
+
+    async def fast_request(i):
+        await backend.execute(f"tenant{1 + i % (tenants - 1)}", "SELECT 1")
+
+    noisy = [asyncio.ensure_future(slow_tenant()) for _ in range(2)]
+    await asyncio.sleep(0)
+    try:
+        return await run_async_load(fast_request, requests, concurrency)
+    finally:
+        stop.set()
+        await asyncio.gather(*noisy)
+
+
+async def run(args):
+    slow, fast = args.slow_ms / 1000, args.fast_ms / 1000
+    quiet_backend = make_backend(False, slow, fast)
+    quiet = await run_async_load(
+        lambda i: quiet_backend.execute(f"tenant{1 + i % (args.tenants - 1)}", "SELECT 1"),
+        args.requests, args.concurrency)
+    return {
+        "no noisy tenant": quiet,
+        "blocking + noisy": await measure(make_backend(True, slow, fast), args.tenants, args.requests, args.concurrency),
+        "async + noisy": await measure(make_backend(False, slow, fast), args.tenants, args.requests, args.concurrency),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--slow-ms", type=float, default=200.0)
+    parser.add_argument("--fast-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_table(f"Fast-tenant latency with one slow tenant ({args.slow_ms} ms statements)", results)
+
+
+if __name__ == "__main__":
+    main()
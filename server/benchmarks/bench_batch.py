@@ -0,0 +1,81 @@
+"""
+Latency of a create-table -> insert -> update workflow, one transaction per operation against batch.run_batch.
+
+"per operation" runs every operation in its own transaction, as separate requests to the
+single-statement endpoints do. The batch variants run them on one connection in one
+transaction; "savepoints" adds SAVEPOINT/RELEASE around every operation (on_error=continue)
+and "pipelined" sends the whole batch as one script. Each statement costs --latency-ms and
+BEGIN and COMMIT cost --latency-ms each; HTTP overhead per request is not included, so the
+saving of real separate requests is larger.
+
+Usage:
+    python benchmarks/bench_batch.py [--inserts 20] [--rounds 50] [--latency-ms 0.5]
+"""
+import argparse
+import asyncio
+import time
+
+from common import percentile, print_table
+from fakes import FakeAsyncEngine, fake_endpoint
+
+from batch import plan_batch, run_batch
+from query_engine import PooledBackend
+from routing import TenantRoutingCache
+from schemas import BatchOperation
+
+TABLE = "bench_batch"
+
+
+def workflow(inserts: int):
+    operations = [BatchOperation(op="create_table", table_name=TABLE, columns={"name": "String", "amount": "Float"})]
+    operations += [BatchOperation(op="insert", table_name=TABLE, item={"id": i, "name": f"row{i}", "amount": float(i)})
+                   for i in range(1, inserts + 1)]
+    operations.append(BatchOperation(op="update", table_name=TABLE, item_id=1, item={"amount": 0.0}))
+    return plan_batch(operations)
+
+
+async def measure(run, rounds: int):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await run()
+        latencies.append(time.perf_counter() - start)
+    return {"p50_ms": round(percentile(latencies, 50) * 1000, 2), "p99_ms": round(percentile(latencies, 99) * 1000, 2)}
+
+
+async def run(args):
+    latency = args.latency_ms / 1000
+    engine = FakeAsyncEngine(latency=latency, transaction_latency=latency)
+    backend = PooledBackend(routes=TenantRoutingCache(loader=fake_endpoint), engine_lookup=lambda key, url: engine)
+    steps = workflow(args.inserts)
+
+    async def per_operation():
+        for step in steps:
+            await run_batch("bench", [step], backend=backend)
+
+    variants = {
+        "per operation": per_operation,
+        "batch": lambda: run_batch("bench", steps, backend=backend),
+        "batch + savepoints": lambda: run_batch("bench", steps, on_error="continue", backend=backend),
+        "pipelined": lambda: run_batch("bench", steps, pipeline=True, backend=backend),
+    }
+    results = {}
+    for name, fn in variants.items():
+        before = engine.statements
+        stats = await measure(fn, args.rounds)
+        stats["statements"] = (engine.statements - before) // args.rounds
+        results[name] = stats
+    print_table(f"Workflow of {len(steps)} operations ({args.rounds} rounds, {args.latency_ms}ms per round trip)", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inserts", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0.5, help="Fake round trip per statement, BEGIN and COMMIT")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Rows/sec of bulk ingestion (executemany / COPY, one commit per chunk) against the per-row insert_item path.
+
+Usage:
+    python benchmarks/bench_bulk_insert.py [--rows 20000] [--latency-ms 0.3] [--row-cost-us 20]
+                                           [--database-url postgresql+asyncpg://user:pw@localhost:5432/db]
+
+Without --database-url the statements run against a fake session that charges one network
+round trip per statement and commit plus a per-row server cost. With --database-url a table
+named bench_bulk is created (and dropped) in that database.
+"""
+import argparse
+import asyncio
+import time
+
+from common import print_table
+from fakes import FakeAsyncEngine, FakeAsyncSession
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import models
+
+TABLE = "bench_bulk"
+
+
+def make_rows(count: int, offset: int = 0):
+    return [{"id": offset + i, "name": f"row{offset + i}", "amount": float(i)} for i in range(1, count + 1)]
+
+
+async def time_rows(label, rows, fn):
+    start = time.perf_counter()
+    await fn()
+    elapsed = time.perf_counter() - start
+    return label, {"rows": rows, "seconds": round(elapsed, 3), "rows_per_sec": round(rows / elapsed, 1)}
+
+
+async def run(args):
+    if args.database_url:
+        engine = create_async_engine(args.database_url)
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+            await conn.execute(text(f"CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY, name VARCHAR, amount FLOAT)"))
+    else:
+        engine = FakeAsyncEngine(latency=args.latency_ms / 1000, row_cost=args.row_cost_us / 1e6)
+        SessionLocal = lambda: FakeAsyncSession(engine)
+
+    per_row_count = min(args.rows, args.per_row_limit)
+    results = {}
+    async with SessionLocal() as session:
+        rows = make_rows(per_row_count)
+
+        async def per_row():
+            for row in rows:
+                await models.insert_item(session, TABLE, dict(row))
+        label, stats = await time_rows("insert_item per row", per_row_count, per_row)
+        results[label] = stats
+
+        columns = ["id", "name", "amount"]
+        small = [tuple(row.values()) for row in make_rows(models.BULK_COPY_THRESHOLD - 1, offset=10 ** 7)]
+        label, stats = await time_rows("bulk executemany", len(small), lambda: models.bulk_insert_items(
+            session, TABLE, columns, small))
+        results[label] = stats
+
+        large = [tuple(row.values()) for row in make_rows(args.rows, offset=2 * 10 ** 7)]
+        label, stats = await time_rows("bulk COPY", len(large), lambda: models.bulk_insert_items(
+            session, TABLE, columns, large))
+        results[label] = stats
+
+        label, stats = await time_rows("bulk COPY upsert", len(large), lambda: models.bulk_insert_items(
+            session, TABLE, columns, large, upsert=True))
+        results[label] = stats
+
+    if args.database_url:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--per-row-limit", type=int, default=2000, help="Cap on rows for the slow per-row path")
+    parser.add_argument("--latency-ms", type=float, default=0.3, help="Fake round trip per statement/commit")
+    parser.add_argument("--row-cost-us", type=float, default=20.0, help="Fake server cost per inserted row")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_table("Bulk ingestion throughput", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Incremental refresh through the change feed against re-pulling a whole table.
+
+An `orders` table of --rows rows, tracked from empty, is first synced by replaying the feed, then
+receives writes in transactions of --batch rows (80% updates, 10% inserts, 10% deletes). For each change volume
+the table is refreshed both ways: a full read (models.full_scan_query) and a feed read from the
+previous watermark (changefeed.ChangeFeed, paged until has_more is false). Both are encoded as
+the columns JSON layout; the table reports time and bytes on the wire.
+
+With --database-url (a Postgres database the benchmark may create tables in) the change log is
+installed with models.change_tracking_statements and everything runs for real; the write cost
+of the triggers is measured too. Without it the tables live in in-memory SQLite, where row-level
+triggers stand in for the statement-level ones and a counter stands in for transaction ids; the
+feed's queries and logic are the same.
+
+Usage:
+    python benchmarks/bench_changefeed.py [--rows 200000] [--batch 100] [--database-url URL]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import print_table
+from fakes import fake_endpoint
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from catalog import CatalogCache, TenantCatalog
+from changefeed import ChangeFeed, HORIZON_QUERY
+from models import CHANGE_FLOOR_TABLE, CHANGE_LOG_TABLE, change_tracking_statements, full_scan_query
+from query_engine import QueryResult
+from serialization import dumps
+
+TENANT = "tenant0"
+COLUMNS = ["customer_id", "status", "total", "id"]
+STATUSES = ["new", "paid", "shipped", "cancelled", "returned"]
+# Share of the table changed before each refresh
+CHANGE_RATIOS = (0.001, 0.01, 0.1)
+
+
+def change_statements(rng: random.Random, changes: int, ids: list):
+    """(sql, parameters) for `changes` row changes: 80% updates, 10% inserts, 10% deletes."""
+    statements = []
+    for i in range(changes):
+        kind = i % 10
+        if kind < 8:
+            statements.append(("UPDATE orders SET status = :status, total = :total WHERE id = :id",
+                               {"status": rng.choice(STATUSES), "total": round(rng.random() * 500, 2),
+                                "id": rng.choice(ids)}))
+        elif kind < 9:
+            statements.append(("INSERT INTO orders (customer_id, status, total) VALUES (:customer_id, 'new', :total)",
+                               {"customer_id": rng.randrange(10000), "total": round(rng.random() * 500, 2)}))
+        else:
+            statements.append(("DELETE FROM orders WHERE id = :id", {"id": ids.pop(rng.randrange(len(ids)))}))
+    return statements
+
+
+def rows(count: int):
+    rng = random.Random(11)
+    return [{"customer_id": rng.randrange(10000), "status": rng.choice(STATUSES), "total": round(rng.random() * 500, 2)}
+            for _ in range(count)]
+
+
+class SqliteTenant:
+    """The tenant's database as in-memory SQLite, with the change log kept by row-level triggers."""
+
+    def __init__(self, args):
+        self.engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        with self.engine.begin() as conn:
+            for statement in (
+                "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, status TEXT, total REAL)",
+                f"CREATE TABLE {CHANGE_LOG_TABLE} (txid INTEGER NOT NULL, table_name TEXT NOT NULL, row_id INTEGER NOT NULL)",
+                f"CREATE INDEX {CHANGE_LOG_TABLE}_table_txid ON {CHANGE_LOG_TABLE} (table_name, txid)",
+                f"CREATE TABLE {CHANGE_FLOOR_TABLE} (table_name TEXT PRIMARY KEY, txid INTEGER, complete BOOLEAN)",
+                "CREATE TABLE _txid (txid INTEGER)",
+                "INSERT INTO _txid VALUES (1)",
+                f"INSERT INTO {CHANGE_FLOOR_TABLE} VALUES ('orders', 1, 1)",
+            ):
+                conn.exec_driver_sql(statement)
+            for event, ids in (("INSERT", ("NEW",)), ("UPDATE", ("NEW", "OLD")), ("DELETE", ("OLD",))):
+                logged = " ".join(f"INSERT INTO {CHANGE_LOG_TABLE} VALUES ((SELECT txid FROM _txid), 'orders', {row}.id);"
+                                  for row in ids)
+                conn.exec_driver_sql(f"CREATE TRIGGER orders_{event.lower()} AFTER {event} ON orders BEGIN {logged} END")
+            conn.execute(text("INSERT INTO orders (customer_id, status, total) VALUES (:customer_id, :status, :total)"),
+                         rows(args.rows))
+
+    def ids(self):
+        with self.engine.connect() as conn:
+            return [row[0] for row in conn.exec_driver_sql("SELECT id FROM orders")]
+
+    def write(self, statements, batch: int):
+        for start in range(0, len(statements), batch):
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql("UPDATE _txid SET txid = txid + 1")
+                for sql, parameters in statements[start:start + batch]:
+                    conn.execute(text(sql), parameters)
+
+    async def query(self, username, sql):
+        with self.engine.connect() as conn:
+            if sql == HORIZON_QUERY.format(floor=CHANGE_FLOOR_TABLE, table="orders", relation="orders"):
+                # No transaction is ever left open here: the horizon is the next transaction id
+                txid = conn.exec_driver_sql("SELECT txid FROM _txid").scalar()
+                floor, complete = conn.exec_driver_sql(f"SELECT txid, complete FROM {CHANGE_FLOOR_TABLE}").one()
+                return QueryResult(rows=[(txid + 1, floor, bool(complete))], returns_rows=True)
+            result = conn.exec_driver_sql(sql)
+            return QueryResult(columns=list(result.keys()), rows=[tuple(row) for row in result], returns_rows=True)
+
+
+class StaticCatalog:
+    async def require_table(self, username, table_name):
+        columns = [{"name": column, "type": "integer", "nullable": True} for column in COLUMNS]
+        return TenantCatalog({"orders": columns, CHANGE_LOG_TABLE: [], CHANGE_FLOOR_TABLE: []})
+
+
+async def full_refresh(query):
+    start = time.perf_counter()
+    result = await query(TENANT, full_scan_query("orders"))
+    body = dumps({"data": result.to_response("columns")})
+    return {"rows": len(result.rows), "ms": round((time.perf_counter() - start) * 1000, 2), "kib": round(len(body) / 1024, 1)}
+
+
+async def delta_refresh(feed: ChangeFeed, watermark: str):
+    start = time.perf_counter()
+    count, size, has_more = 0, 0, True
+    while has_more:
+        result, watermark, has_more = await feed.read(TENANT, "orders", watermark, limit=10000)
+        count += len(result.rows)
+        size += len(dumps({"data": result.to_response("columns"), "watermark": watermark}))
+    return watermark, {"rows": count, "ms": round((time.perf_counter() - start) * 1000, 2), "kib": round(size / 1024, 1)}
+
+
+async def refreshes(args, query, feed, write, ids):
+    rng = random.Random(7)
+    results = {}
+    # The table was tracked from empty, so the consumer's first refresh replays the whole log
+    watermark, _ = await delta_refresh(feed, None)
+    for ratio in CHANGE_RATIOS:
+        changes = max(1, int(args.rows * ratio))
+        await write(change_statements(rng, changes, ids))
+        watermark, delta = await delta_refresh(feed, watermark)
+        full = await full_refresh(query)
+        label = f"{changes} changes ({ratio:.1%})"
+        results[f"{label} full"] = full
+        results[f"{label} feed"] = dict(delta, speedup=round(full["ms"] / delta["ms"], 1) if delta["ms"] else None)
+    return results
+
+
+async def run_sqlite(args):
+    tenant = SqliteTenant(args)
+    feed = ChangeFeed(query=tenant.query, catalog=StaticCatalog())
+
+    async def write(statements):
+        tenant.write(statements, args.batch)
+
+    return await refreshes(args, tenant.query, feed, write, tenant.ids()), None
+
+
+async def run_postgres(args):
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from query_engine import PooledBackend
+    from routing import TenantRoutingCache
+
+    engine = create_async_engine(make_url(args.database_url).set(drivername="postgresql+asyncpg"))
+    backend = PooledBackend(routes=TenantRoutingCache(loader=fake_endpoint), engine_lookup=lambda key, url: engine)
+    create = "CREATE TABLE {} (id SERIAL PRIMARY KEY, customer_id INTEGER, status VARCHAR, total DOUBLE PRECISION)"
+    load = ("INSERT INTO {} (customer_id, status, total) SELECT (random() * 10000)::int, "
+            "(ARRAY['new', 'paid', 'shipped'])[1 + (i % 3)], random() * 500 FROM generate_series(1, {}) AS i")
+    async with engine.begin() as conn:
+        for table in ("orders", "orders_untracked"):
+            await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+            await conn.exec_driver_sql(create.format(table))
+        for statement in change_tracking_statements("orders"):
+            await conn.exec_driver_sql(statement)
+    writes = {}
+    for table in ("orders_untracked", "orders"):
+        start = time.perf_counter()
+        async with engine.begin() as conn:
+            await conn.exec_driver_sql(load.format(table, args.rows))
+        writes[f"load {args.rows} rows into {table}"] = {"ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    async def write(statements):
+        for start in range(0, len(statements), args.batch):
+            async with engine.begin() as conn:
+                for sql, parameters in statements[start:start + args.batch]:
+                    await conn.execute(text(sql), parameters)
+
+    async with engine.connect() as conn:
+        ids = [row[0] for row in await conn.exec_driver_sql("SELECT id FROM orders")]
+    feed = ChangeFeed(query=backend.execute, catalog=CatalogCache(query=backend.execute))
+    try:
+        return await refreshes(args, backend.execute, feed, write, ids), writes
+    finally:
+        async with engine.begin() as conn:
+            await conn.exec_driver_sql("DROP TABLE orders, orders_untracked")
+            await conn.exec_driver_sql(f"DELETE FROM {CHANGE_LOG_TABLE} WHERE table_name = 'orders'")
+            await conn.exec_driver_sql(f"DELETE FROM {CHANGE_FLOOR_TABLE} WHERE table_name = 'orders'")
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=100, help="row changes per transaction")
+    parser.add_argument("--database-url", help="Postgres URL; in-memory SQLite when omitted")
+    args = parser.parse_args()
+
+    results, writes = asyncio.run(run_postgres(args) if args.database_url else run_sqlite(args))
+    engine = "Postgres" if args.database_url else "SQLite"
+    print_table(f"Refreshing {args.rows} rows ({engine})", results)
+    if writes:
+        print_table("Write cost of the change log triggers", writes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Admin fan-out across 10 to 1,000 tenants.
+
+Every tenant is a fake pooled engine answering the row_counts probe after --latency seconds
+per round trip (the fan-out's read-only preamble is one more); --slow-share of the tenants take
+--slow-latency instead, longer than the per-tenant --timeout. For each tenant count the probe
+runs sequentially (one tenant after the other, as when looping over tenants by hand) and at
+each --concurrency, through the real FanOut and PooledBackend. Reported: wall time, the time to
+the first streamed result, timeouts, and the cost of merging and summing the results.
+
+Usage:
+    python benchmarks/bench_fanout.py [--tenants 10 100 1000] [--concurrency 8 32 128] [--latency 0.01]
+"""
+import argparse
+import asyncio
+import time
+import zlib
+
+from common import print_table
+from fakes import FakeAsyncEngine, FakeResult, fake_endpoint
+
+from fanout import PROBES, FanOut, aggregate_rows, merge_results
+from query_engine import PooledBackend, get_tenant_key
+from routing import TenantRoutingCache
+
+TABLES = ["orders", "customers", "invoices", "events"]
+
+
+def responder(tenant: str):
+    rows = [(table, zlib.crc32(f"{tenant}.{table}".encode()) % 100000) for table in TABLES]
+
+    def respond(statement, parameters=None):
+        if statement == PROBES["row_counts"]:
+            return FakeResult(["table_name", "row_estimate"], rows)
+        return FakeResult(["set_config", "set_config"], [("on", "1")])
+    return respond
+
+
+def make_fanout(args, tenants, concurrency):
+    step = int(1 / args.slow_share) if args.slow_share else 0
+    slow = set(tenants[step // 2::step]) if step else set()
+    engines = {}
+    for tenant in tenants:
+        latency = args.slow_latency if tenant in slow else args.latency
+        engines[get_tenant_key(fake_endpoint(tenant))] = FakeAsyncEngine(latency=latency, responder=responder(tenant))
+    backend = PooledBackend(routes=TenantRoutingCache(loader=fake_endpoint), engine_lookup=lambda key, url: engines[key])
+    return FanOut(concurrency=concurrency, tenant_timeout=args.timeout, backend=backend,
+                  load_users=lambda: {tenant: {} for tenant in tenants})
+
+
+async def measure(args, count, concurrency):
+    tenants = [f"tenant{i:04d}" for i in range(count)]
+    fanout = make_fanout(args, tenants, concurrency)
+    start = time.perf_counter()
+    first = None
+    results = []
+    async for result in fanout.iterate(tenants, PROBES["row_counts"]):
+        if first is None:
+            first = time.perf_counter() - start
+        results.append(result)
+    elapsed = time.perf_counter() - start
+    merge_start = time.perf_counter()
+    columns, rows = merge_results(results)
+    aggregate_rows(columns, rows, "sum")
+    merge_ms = (time.perf_counter() - merge_start) * 1000
+    return {
+        "wall_ms": round(elapsed * 1000, 1),
+        "first_result_ms": round(first * 1000, 1),
+        "timeouts": sum(result["status"] == "timeout" for result in results),
+        "merge_sum_ms": round(merge_ms, 2),
+    }
+
+
+async def run(args):
+    for count in args.tenants:
+        results = {}
+        for concurrency in [1] + args.concurrency:
+            label = "sequential" if concurrency == 1 else f"concurrency {concurrency}"
+            results[label] = await measure(args, count, concurrency)
+        sequential = results["sequential"]["wall_ms"]
+        for row in results.values():
+            row["speedup"] = round(sequential / row["wall_ms"], 1)
+        print_table(f"row_counts probe over {count} tenants", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per round trip")
+    parser.add_argument("--slow-share", type=float, default=0.02, help="share of tenants slower than the timeout")
+    parser.add_argument("--slow-latency", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=0.25, help="seconds per tenant")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Idle tenant hibernation against a fake Docker client: running containers before and after a
+sweep, and the wake-up latency a request pays for a hibernated tenant.
+
+"stop" wakes pay a Postgres boot (--boot-s); "pause" wakes only unfreeze the processes.
+
+Usage:
+    python benchmarks/bench_hibernation.py [--tenants 200] [--active 10] [--boot-s 0.5] [--api-ms 2]
+"""
+import argparse
+import asyncio
+import time
+
+from common import print_table, summarize
+from fakes import FakeDockerClient
+
+from database import TenantPoolRegistry
+from hibernation import HibernationScheduler
+
+
+async def run_action(action: str, args):
+    client = FakeDockerClient(api_latency=args.api_ms / 1000, boot_time=args.boot_s)
+    for i in range(args.tenants):
+        client.containers.add(f"postgres_tenant{i}")
+    scheduler = HibernationScheduler(idle_seconds=0.2, check_interval=3600, action=action, wake_timeout=30,
+                                     docker_client=client, pools=TenantPoolRegistry())
+    await scheduler.start()
+    # Wait out the fake boot and the idle threshold, keeping a few tenants active
+    await asyncio.sleep(max(args.boot_s, 0.2) + 0.1)
+    for i in range(args.active):
+        await scheduler.touch(f"tenant{i}")
+
+    running_before = sum(1 for c in client.containers.list())
+    await scheduler.hibernate_idle()
+    running_after = sum(1 for c in client.containers.list())
+
+    async def wake(i):
+        start = time.perf_counter()
+        await scheduler.touch(f"tenant{i}")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(wake(i) for i in range(args.active, args.active + args.wakes)))
+    stats = summarize(list(latencies), time.perf_counter() - start)
+    await scheduler.stop()
+    stats.update({"running_before": running_before, "running_after": running_after})
+    return stats
+
+
+async def run(args):
+    results = {action: await run_action(action, args) for action in ("stop", "pause")}
+    print_table(f"Hibernation of {args.tenants} tenants ({args.active} active), wake-up of {args.wakes}", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--active", type=int, default=10, help="Tenants touched before the sweep")
+    parser.add_argument("--wakes", type=int, default=20, help="Hibernated tenants woken concurrently")
+    parser.add_argument("--boot-s", type=float, default=0.5, help="Fake Postgres boot time after a start")
+    parser.add_argument("--api-ms", type=float, default=2.0, help="Fake Docker API round trip")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Index advisor against a synthetic tenant workload: latency before and after applying its advice.
+
+An `orders` table of --rows rows (created like models.create_table: only an id primary key)
+receives a read mix: by customer_id, by status with a created_at range, and by id. The query
+profiler records the workload, the advisor recommends indexes from it and from the table scan
+statistics, the recommendations are applied, and the same workload is replayed.
+
+With --database-url (a Postgres database the benchmark may create a table in) everything runs
+for real: pg_stat_user_tables, the pooled asyncpg backend and CREATE INDEX CONCURRENTLY.
+Without it the workload runs on in-memory SQLite: the advisor and profiler are the same, the
+scan statistics come from SQLite's EXPLAIN QUERY PLAN and the indexes are built with plain
+CREATE INDEX.
+
+Usage:
+    python benchmarks/bench_index_advisor.py [--rows 200000] [--queries 600] [--database-url URL]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import percentile, print_table
+from fakes import fake_endpoint
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from advisor import INDEX_QUERY, TABLE_STATS_QUERY, IndexAdvisor, index_name
+from catalog import CatalogCache, TenantCatalog
+from profiler import QueryProfiler
+from query_engine import QueryResult
+
+TENANT = "tenant0"
+COLUMNS = ["id", "customer_id", "status", "created_at", "total"]
+STATUSES = ["new", "paid", "shipped", "cancelled", "returned"]
+
+
+def workload(args):
+    """The read mix as (sql, parameters) pairs, 60% by customer, 30% by status and date, 10% by id."""
+    rng = random.Random(7)
+    statements = []
+    for i in range(args.queries):
+        kind = i % 10
+        if kind < 6:
+            statements.append(("SELECT id, status, total FROM orders WHERE customer_id = :customer_id",
+                               {"customer_id": rng.randrange(args.rows // 20)}))
+        elif kind < 9:
+            statements.append(("SELECT id, total FROM orders WHERE status = :status AND created_at > :since LIMIT 50",
+                               {"status": rng.choice(STATUSES), "since": args.rows - rng.randrange(2000)}))
+        else:
+            statements.append(("SELECT * FROM orders WHERE id = :id", {"id": rng.randrange(1, args.rows)}))
+    return statements
+
+
+def rows(args):
+    rng = random.Random(11)
+    return [{"customer_id": rng.randrange(args.rows // 20), "status": rng.choice(STATUSES), "created_at": i,
+             "total": round(rng.random() * 500, 2)} for i in range(args.rows)]
+
+
+def summarize(latencies):
+    return {"p50_ms": round(percentile(latencies, 50) * 1000, 3), "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "total_s": round(sum(latencies), 3)}
+
+
+class SqliteTenant:
+    """The tenant's database as in-memory SQLite, answering the advisor's two catalog queries."""
+
+    def __init__(self, args, profiler: QueryProfiler):
+        self.engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        profiler.attach(self.engine, TENANT)
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, status TEXT, "
+                              "created_at INTEGER, total REAL)"))
+            conn.execute(text("INSERT INTO orders (customer_id, status, created_at, total) "
+                              "VALUES (:customer_id, :status, :created_at, :total)"), rows(args))
+        self.seq_scans = 0
+
+    def run(self, statements):
+        latencies = []
+        with self.engine.connect() as conn:
+            for sql, parameters in statements:
+                start = time.perf_counter()
+                conn.execute(text(sql), parameters).all()
+                latencies.append(time.perf_counter() - start)
+                plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}").execution_options(profile=False), parameters).all()
+                self.seq_scans += any(row[-1].startswith("SCAN orders") for row in plan)
+        return latencies
+
+    async def query(self, username, sql):
+        with self.engine.connect() as conn:
+            if sql == TABLE_STATS_QUERY:
+                live = conn.execute(text("SELECT count(*) FROM orders")).scalar()
+                return QueryResult(rows=[("orders", self.seq_scans, self.seq_scans * live, 0, live)], returns_rows=True)
+            if sql == INDEX_QUERY:
+                indexes = [("orders", "orders_pkey", "id")]
+                for index in conn.execute(text("PRAGMA index_list(orders)")).all():
+                    columns = [info[2] for info in conn.execute(text(f"PRAGMA index_info({index[1]})")).all()]
+                    indexes.append(("orders", index[1], ",".join(columns)))
+                return QueryResult(rows=indexes, returns_rows=True)
+        raise ValueError(sql)
+
+    async def create(self, table, columns):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX {index_name(table, columns)} ON {table} ({', '.join(columns)})"))
+
+
+class StaticCatalog:
+    async def get(self, username):
+        return TenantCatalog({"orders": [{"name": column, "type": "integer", "nullable": True} for column in COLUMNS]})
+
+
+async def run_sqlite(args):
+    profiler = QueryProfiler(enabled=True, slow_ms=float("inf"), explain_sample_rate=0)
+    tenant = SqliteTenant(args, profiler)
+    statements = workload(args)
+    profiler.reset()
+    before = tenant.run(statements)
+    advisor = IndexAdvisor(profiler=profiler, query=tenant.query, catalog=StaticCatalog())
+    advice = await advisor.recommend(TENANT)
+    for recommendation in advice["recommendations"]:
+        await tenant.create(recommendation["table"], recommendation["columns"])
+    after = tenant.run(statements)
+    return advice, before, after
+
+
+async def run_postgres(args):
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from query_engine import PooledBackend
+    from routing import TenantRoutingCache
+
+    profiler = QueryProfiler(enabled=True, slow_ms=float("inf"), explain_sample_rate=0)
+    engine = create_async_engine(make_url(args.database_url).set(drivername="postgresql+asyncpg"))
+    profiler.attach(engine, TENANT)
+    backend = PooledBackend(routes=TenantRoutingCache(loader=fake_endpoint), engine_lookup=lambda key, url: engine)
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("DROP TABLE IF EXISTS orders")
+        await conn.exec_driver_sql("CREATE TABLE orders (id SERIAL PRIMARY KEY, customer_id INTEGER, status VARCHAR, "
+                                   "created_at INTEGER, total DOUBLE PRECISION)")
+        await conn.execute(text("INSERT INTO orders (customer_id, status, created_at, total) "
+                                "VALUES (:customer_id, :status, :created_at, :total)"), rows(args))
+        await conn.exec_driver_sql("ANALYZE orders")
+
+    async def run(statements):
+        latencies = []
+        async with engine.connect() as conn:
+            for sql, parameters in statements:
+                start = time.perf_counter()
+                (await conn.execute(text(sql), parameters)).all()
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    statements = workload(args)
+    profiler.reset()
+    before = await run(statements)
+    advisor = IndexAdvisor(profiler=profiler, query=backend.execute, catalog=CatalogCache(query=backend.execute))
+    # pg_stat_user_tables is updated by the statistics collector with a short delay
+    await asyncio.sleep(1)
+    advice = await advisor.recommend(TENANT)
+    for recommendation in advice["recommendations"]:
+        await advisor.create_index(TENANT, recommendation["table"], recommendation["columns"], backend=backend)
+    after = await run(statements)
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("DROP TABLE orders")
+    await engine.dispose()
+    return advice, before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=600)
+    parser.add_argument("--database-url", help="Postgres URL; in-memory SQLite when omitted")
+    args = parser.parse_args()
+
+    advice, before, after = asyncio.run(run_postgres(args) if args.database_url else run_sqlite(args))
+    print("Recommendations:")
+    for recommendation in advice["recommendations"]:
+        print(f"  {recommendation['ddl']}  ({recommendation['calls']} calls, {recommendation['total_ms']} ms)")
+    for skipped in advice["skipped"]:
+        print(f"  skipped {skipped['table']}({', '.join(skipped['columns'])}): {skipped['reason']}")
+    engine = "Postgres" if args.database_url else "SQLite"
+    print_table(f"{args.queries} queries on {args.rows} rows ({engine})", {
+        "before advice": summarize(before),
+        "after advice": summarize(after),
+    })
+
+
+if __name__ == "__main__":
+    main()
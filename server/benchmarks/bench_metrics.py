@@ -0,0 +1,116 @@
+"""
+Overhead of the metrics instrumentation.
+
+Micro costs of a histogram observation, a stage span and a counter increment, then the same
+tiny FastAPI endpoint served with and without metrics.instrument (plus four stage spans per
+request, like a table read), and the cost of rendering /metrics with --tenants tenant series.
+
+Usage:
+    python benchmarks/bench_metrics.py [--requests 3000] [--iterations 200000] [--tenants 500]
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from common import percentile, print_table
+
+import metrics
+from metrics import Counter, Histogram, MetricsRegistry, span
+
+
+def per_op_ns(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - start) / iterations * 1e9, 1)
+
+
+def micro(args):
+    histogram = Histogram("bench_seconds", "bench", ("stage",))
+    counter = Counter("bench_total", "bench", ("app", "route", "status"))
+
+    def with_span():
+        with span("execute"):
+            pass
+
+    results = {
+        "histogram.observe": {"ns_per_op": per_op_ns(lambda: histogram.observe(0.003, "execute"), args.iterations)},
+        "counter.inc": {"ns_per_op": per_op_ns(lambda: counter.inc("db", "/users/{username}", "200"), args.iterations)},
+        "span": {"ns_per_op": per_op_ns(with_span, args.iterations)},
+    }
+    metrics.METRICS_ENABLED = False
+    results["span (METRICS_ENABLED=0)"] = {"ns_per_op": per_op_ns(with_span, args.iterations)}
+    metrics.METRICS_ENABLED = True
+    print_table("Instrumentation primitives", results)
+
+
+def make_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/users/{username}/tables/{table_name}")
+    async def read(username: str, table_name: str):
+        for stage in ("routing", "checkout", "execute", "encode"):
+            with span(stage):
+                pass
+        return {"data": [{"id": 1}]}
+
+    if instrumented:
+        metrics.instrument(app, "bench")
+    return app
+
+
+async def serve(app: FastAPI, requests: int):
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for i in range(requests):
+            start = time.perf_counter()
+            await client.get(f"/users/tenant{i % 50}/tables/items")
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def requests_overhead(args):
+    results = {}
+    for name, instrumented in (("plain", False), ("instrumented", True)):
+        metrics.METRICS_ENABLED = instrumented
+        app = make_app(instrumented)
+        await serve(app, 200)
+        latencies = await serve(app, args.requests)
+        results[name] = {"p50_us": round(percentile(latencies, 50) * 1e6, 1),
+                         "p99_us": round(percentile(latencies, 99) * 1e6, 1)}
+    metrics.METRICS_ENABLED = True
+    overhead = results["instrumented"]["p50_us"] - results["plain"]["p50_us"]
+    results["instrumented"]["overhead_p50_us"] = round(overhead, 1)
+    print_table(f"{args.requests} requests through the ASGI stack", results)
+
+
+def scrape(args):
+    registry = MetricsRegistry()
+    latency = registry.histogram("tenant_request_duration_seconds", "bench", ("tenant",))
+    for i in range(args.tenants):
+        for _ in range(10):
+            latency.observe(0.004, f"tenant{i}")
+    start = time.perf_counter()
+    body = registry.render()
+    elapsed = time.perf_counter() - start
+    print_table("Rendering /metrics", {
+        f"{args.tenants} tenant series": {"ms": round(elapsed * 1000, 2), "kib": round(len(body) / 1024, 1)},
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--tenants", type=int, default=500)
+    args = parser.parse_args()
+    micro(args)
+    asyncio.run(requests_overhead(args))
+    scrape(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Host port assignment for tenant containers: random ports against ports.PortAllocator.
+
+"random" is the old get_random_port (1024-65535, no collision check): a port already published
+by another tenant, or bound by another process on the host (--host-bound of them), makes
+containers.run fail and the registration with it. The allocator hands out ports from its range
+with a free list and retries past ports bound outside its ledger. Allocation cost is also
+measured with the range nearly full, where probing random ports for a free one degrades.
+
+Usage:
+    python benchmarks/bench_ports.py [--tenants 2000] [--host-bound 200]
+"""
+import argparse
+import random
+import time
+
+import docker
+
+from common import print_table
+from fakes import FakeDockerClient
+
+from adminUtils import run_postgres_container
+from inventory import InventoryReconciler
+from ports import PortAllocator
+from routing import TenantRoutingCache
+
+ENVIRONMENT = {"POSTGRES_PASSWORD": "secret"}
+
+
+def register_random(client, tenants: int):
+    failures = 0
+    for i in range(tenants):
+        try:
+            client.containers.run("postgres", name=f"postgres_tenant{i}", environment=ENVIRONMENT,
+                                  ports={"5432/tcp": random.randint(1024, 65535)})
+        except docker.errors.APIError:
+            failures += 1
+    return failures
+
+
+def register_allocated(client, allocator: PortAllocator, tenants: int):
+    failures = 0
+    for i in range(tenants):
+        try:
+            run_postgres_container(client, f"postgres_tenant{i}", ENVIRONMENT, ports=allocator)
+        except (docker.errors.APIError, RuntimeError):
+            failures += 1
+    return failures
+
+
+def registrations(args):
+    results = {}
+    for name in ("random", "allocator"):
+        client = FakeDockerClient()
+        allocator = PortAllocator(start=20000, end=20000 + args.range_size - 1)
+        # Ports held by other processes on the host, unknown to the allocator's ledger
+        client.containers.taken_ports = set(random.sample(range(1024, 65536), args.host_bound))
+        client.containers.taken_ports |= set(random.sample(range(allocator.start, allocator.end + 1), args.host_bound // 10))
+        start = time.perf_counter()
+        if name == "random":
+            failures = register_random(client, args.tenants)
+        else:
+            failures = register_allocated(client, allocator, args.tenants)
+        results[name] = {
+            "tenants": args.tenants,
+            "failed_registrations": failures,
+            "blocked_ports": len(allocator.stats()["blocked"]) if name == "allocator" else "-",
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+    print_table(f"Registering {args.tenants} tenants ({args.host_bound} host ports bound elsewhere)", results)
+
+
+def allocation_cost(args):
+    size = args.range_size
+    allocator = PortAllocator(start=20000, end=20000 + size - 1)
+    held = set()
+    for i in range(size - 10):
+        held.add(allocator.allocate(f"c{i}"))
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        allocator.allocate("probe")
+        allocator.release("probe")
+    free_list = time.perf_counter() - start
+
+    start = time.perf_counter()
+    probes = 0
+    for _ in range(args.iterations):
+        while True:
+            probes += 1
+            port = random.randint(20000, 20000 + size - 1)
+            if port not in held:
+                break
+    random_probe = time.perf_counter() - start
+    results = {
+        "free list": {"us_per_allocation": round(free_list / args.iterations * 1e6, 2)},
+        "random probing": {"us_per_allocation": round(random_probe / args.iterations * 1e6, 2),
+                           "probes_per_allocation": round(probes / args.iterations, 1)},
+    }
+    print_table(f"Allocation with {size - 10} of {size} ports taken", results)
+
+
+def reconciliation(args):
+    import asyncio
+
+    client = FakeDockerClient()
+    allocator = PortAllocator(start=20000, end=20000 + args.range_size - 1, grace_seconds=0)
+    for i in range(args.tenants):
+        run_postgres_container(client, f"postgres_tenant{i}", ENVIRONMENT, ports=allocator)
+    # Drift: ledger entries whose containers vanished, and users rows pointing at stale ports
+    for i in range(0, args.tenants, 50):
+        del client.containers.by_name[f"postgres_tenant{i}"]
+    users = {f"tenant{i}": {"username": f"tenant{i}", "tenancy_mode": "container", "container_port": 1}
+             for i in range(args.tenants)}
+    reconciler = InventoryReconciler(ports=allocator, routes=TenantRoutingCache(loader=lambda username: None),
+                                     docker_client=client, load_users=lambda: users,
+                                     update_port=lambda username, port: None, publish_ports=True)
+    report = asyncio.run(reconciler.reconcile())
+    print_table(f"Reconciliation of {args.tenants} tenants", {
+        "reconcile": {
+            "ms": report["duration_ms"],
+            "ports_freed": len(report["ports"]["freed"]),
+            "port_fixes": len(report["port_fixes"]),
+            "users_without_container": len(report["users_without_container"]),
+        }
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=2000)
+    parser.add_argument("--host-bound", type=int, default=200, help="Host ports bound outside Docker/the ledger")
+    parser.add_argument("--range-size", type=int, default=10000, help="Ports in the allocator's range")
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+    registrations(args)
+    allocation_cost(args)
+    reconciliation(args)
+
+
+if __name__ == "__main__":
+    main()
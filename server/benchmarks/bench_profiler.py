@@ -0,0 +1,61 @@
+"""
+Cost of the query profiler per recorded statement, and of the admin top-N report.
+
+Statements come from --shapes distinct query shapes spread over --tenants tenants. With inline
+literals every text is new and is normalized; with bind parameters (the cached CRUD statements)
+texts repeat and their fingerprints come from a cache.
+
+Usage:
+    python benchmarks/bench_profiler.py [--statements 100000] [--shapes 200] [--tenants 100]
+"""
+import argparse
+import random
+import time
+
+from common import print_table
+
+from profiler import QueryProfiler, fingerprint
+
+
+def statements(args, literals: bool):
+    """Literal values inline (raw SQL endpoints), or bind parameters (the models.py helpers)."""
+    shapes = [f"SELECT id, name, total FROM orders_{i} WHERE customer_id = {{}} AND status = {{}} ORDER BY id LIMIT 50"
+              for i in range(args.shapes)]
+    workload = []
+    for i in range(args.statements):
+        values = (random.randint(1, 10 ** 6), f"'{random.choice('abc')}'") if literals else ("$1", "$2")
+        workload.append((f"tenant{i % args.tenants}", shapes[i % args.shapes].format(*values)))
+    return workload
+
+
+def record_all(profiler: QueryProfiler, workload) -> float:
+    start = time.perf_counter()
+    for tenant, sql in workload:
+        profiler.record(tenant, sql, 1.5, 10)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--statements", type=int, default=100000)
+    parser.add_argument("--shapes", type=int, default=200)
+    parser.add_argument("--tenants", type=int, default=100)
+    args = parser.parse_args()
+
+    profiler = QueryProfiler(enabled=True, slow_ms=float("inf"), explain_sample_rate=0)
+    fingerprint.cache_clear()
+    inline = record_all(profiler, statements(args, literals=True))
+    bound = record_all(profiler, statements(args, literals=False))
+    start = time.perf_counter()
+    top = profiler.top(20)
+    top_ms = (time.perf_counter() - start) * 1000
+    print_table(f"Profiling {args.statements} statements ({args.shapes} shapes, {args.tenants} tenants)", {
+        "record, inline literals": {"us_per_statement": round(inline / args.statements * 1e6, 2)},
+        "record, bind parameters": {"us_per_statement": round(bound / args.statements * 1e6, 2)},
+        "top 20": {"ms": round(top_ms, 2), "fingerprints": profiler.stats()["fingerprints"]},
+    })
+    print(f"\nhottest: {top[0]['query']} ({top[0]['calls']} calls)")
+
+
+if __name__ == "__main__":
+    main()
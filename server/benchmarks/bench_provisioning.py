@@ -0,0 +1,81 @@
+"""
+Bulk onboarding throughput of the provisioning job queue against a fake Docker client.
+
+Every tenant is a cold start: containers.run takes --start-s and Postgres accepts connections
+--boot-s later (polled with pg_isready and exponential backoff); saving the users row takes
+--save-ms. "workers=1" is the old serial /register loop. With --fail-every N every Nth save
+fails, and the benchmark checks that those tenants' containers were rolled back.
+
+Usage:
+    python benchmarks/bench_provisioning.py [--tenants 100] [--workers 1,4,8,16] [--boot-s 0.5] [--start-s 0.2]
+"""
+import argparse
+import asyncio
+import time
+
+from common import print_table
+from fakes import FakeDockerClient
+
+from container_pool import WarmContainerPool
+from provisioning import ProvisioningQueue
+from routing import TenantRoutingCache
+from schemas import UserCreate
+from tenancy import ContainerTenancy
+
+
+async def run_job(args, workers: int):
+    client = FakeDockerClient(api_latency=args.api_ms / 1000, boot_time=args.boot_s, start_latency=args.start_s)
+    saved = []
+
+    def save_user(user, *placement):
+        time.sleep(args.save_ms / 1000)
+        if args.fail_every and len(saved) % args.fail_every == args.fail_every - 1:
+            saved.append(None)
+            raise RuntimeError("users table unavailable")
+        saved.append(user.username)
+
+    queue = ProvisioningQueue(workers=workers, ready_timeout=60,
+                              tenancy=ContainerTenancy(pool=WarmContainerPool(size=0, docker_client=client)),
+                              routes=TenantRoutingCache(loader=lambda username: None), save_user=save_user)
+    await queue.start()
+    start = time.perf_counter()
+    job = queue.submit([UserCreate(username=f"tenant{i}", password="secret") for i in range(args.tenants)])
+    await job.done.wait()
+    elapsed = time.perf_counter() - start
+    await queue.stop()
+
+    failed = [username for username, entry in job.tenants.items() if entry["status"] == "failed"]
+    leaked = [username for username in failed if f"postgres_{username}" in client.containers.by_name]
+    stats = queue.stats()
+    return {
+        "seconds": round(elapsed, 2),
+        "tenants_per_sec": round(args.tenants / elapsed, 1),
+        "p50_ms": stats["provision_latency_ms"]["p50"],
+        "failed": len(failed),
+        "rolled_back": stats["rolled_back"],
+        "leaked": len(leaked),
+    }
+
+
+async def run(args):
+    results = {}
+    for workers in args.workers:
+        results[f"workers={workers}"] = await run_job(args, workers)
+    print_table(f"Bulk registration of {args.tenants} cold-start tenants", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=100)
+    parser.add_argument("--workers", type=lambda value: [int(n) for n in value.split(",")], default=[1, 4, 8, 16])
+    parser.add_argument("--boot-s", type=float, default=0.5, help="Fake Postgres initdb + boot time")
+    parser.add_argument("--start-s", type=float, default=0.2, help="Fake containers.run latency")
+    parser.add_argument("--api-ms", type=float, default=2.0, help="Fake Docker API round trip")
+    parser.add_argument("--save-ms", type=float, default=5.0, help="Fake users-table insert")
+    parser.add_argument("--fail-every", type=int, default=20, help="Fail every Nth save to exercise rollback (0: never)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare the pooled tenant query engine with the `docker exec psql` fallback.
+
+Usage:
+    python benchmarks/bench_query_engine.py [--requests 500] [--concurrency 8]
+                                            [--database-url postgresql+asyncpg://user:pw@localhost:5432/db]
+
+Without --database-url the pooled path runs against a fake async engine and the
+exec path against a fake container that forks a real process per statement.
+"""
+import argparse
+import asyncio
+
+from common import print_table, run_async_load
+from fakes import FakeAsyncEngine, FakeDockerClient, fake_endpoint
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from routing import TenantRoutingCache
+from query_engine import ExecBackend, PooledBackend
+
+TENANTS = [f"tenant{i}" for i in range(4)]
+
+
+def make_pooled_backend(database_url: str = None, query_latency: float = 0.0) -> PooledBackend:
+    engines = {}
+
+    def engine_lookup(key, url):
+        if key not in engines:
+            if database_url:
+                engines[key] = create_async_engine(database_url, pool_size=5, max_overflow=5)
+            else:
+                engines[key] = FakeAsyncEngine(latency=query_latency)
+        return engines[key]
+
+    return PooledBackend(routes=TenantRoutingCache(loader=fake_endpoint), engine_lookup=engine_lookup)
+
+
+def make_exec_backend(api_latency: float, exec_latency: float) -> ExecBackend:
+    client = FakeDockerClient(api_latency=api_latency, exec_latency=exec_latency)
+    for username in TENANTS:
+        client.containers.add(f"postgres_{username}")
+    # The original code built a fresh client per request; the factory mirrors that call site
+    return ExecBackend(docker_client_factory=lambda: client)
+
+
+async def run(args):
+    pooled = make_pooled_backend(args.database_url, args.query_latency_ms / 1000)
+    exec_backend = make_exec_backend(args.api_latency_ms / 1000,
+                                     (args.exec_latency_ms + args.query_latency_ms) / 1000)
+
+    async def pooled_request(i):
+        await pooled.execute(TENANTS[i % len(TENANTS)], "SELECT 1")
+
+    async def exec_request(i):
+        await exec_backend.execute(TENANTS[i % len(TENANTS)], "SELECT 1")
+
+    return {
+        "pool": await run_async_load(pooled_request, args.requests, args.concurrency),
+        "exec (fallback)": await run_async_load(exec_request, args.requests, args.concurrency),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--database-url", default=None, help="Run the pooled path against a real Postgres")
+    parser.add_argument("--api-latency-ms", type=float, default=2.0, help="Simulated Docker API round trip")
+    parser.add_argument("--exec-latency-ms", type=float, default=20.0, help="Simulated psql startup inside the container")
+    parser.add_argument("--query-latency-ms", type=float, default=0.5, help="Simulated statement time in Postgres")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_table(f"SELECT 1 x {args.requests} requests, concurrency {args.concurrency}", results)
+
+
+if __name__ == "__main__":
+    main()
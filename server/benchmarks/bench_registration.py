@@ -0,0 +1,84 @@
+"""
+Registration latency with and without the warm container pool, against a fake Docker client.
+
+Cold registrations start a container and wait until Postgres accepts connections; warm
+registrations claim a pre-started container from container_pool.WarmContainerPool.
+
+Usage:
+    python benchmarks/bench_registration.py [--burst 10] [--pool-size 10] [--boot-s 1.0] [--start-s 0.3]
+"""
+import argparse
+import asyncio
+import time
+
+from common import print_table, summarize
+from fakes import FakeDockerClient
+
+from adminUtils import create_postgresql_container
+from container_pool import WarmContainerPool
+from executors import run_blocking
+from schemas import UserCreate
+
+
+async def wait_until_ready(container, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = await run_blocking(container.exec_run, ["pg_isready", "-U", "postgres"])
+        if result.exit_code == 0:
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError(container.name)
+
+
+async def burst(register, count: int):
+    async def one(i):
+        start = time.perf_counter()
+        await register(UserCreate(username=f"user{i}", password="secret"))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(i) for i in range(count)))
+    return summarize(list(latencies), time.perf_counter() - start)
+
+
+async def run(args):
+    def make_client():
+        return FakeDockerClient(api_latency=args.api_ms / 1000, boot_time=args.boot_s, start_latency=args.start_s)
+
+    cold_client = make_client()
+
+    async def cold_register(user):
+        container, _, _ = await run_blocking(create_postgresql_container, user, cold_client)
+        await wait_until_ready(container)
+
+    pool = WarmContainerPool(size=args.pool_size, docker_client=make_client(), ready_timeout=60)
+    await pool.start()
+    while pool.depth < args.pool_size:
+        await asyncio.sleep(0.05)
+
+    async def warm_register(user):
+        container, _, _ = await pool.claim(user)
+        await wait_until_ready(container)
+
+    results = {
+        "cold start": await burst(cold_register, args.burst),
+        "warm pool": await burst(warm_register, args.burst),
+    }
+    await pool.stop()
+    print_table(f"Registration burst of {args.burst} (time until the tenant database is usable)", results)
+    print(f"\nwarm pool stats: {pool.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--boot-s", type=float, default=1.0, help="Fake Postgres initdb + boot time")
+    parser.add_argument("--start-s", type=float, default=0.3, help="Fake containers.run latency")
+    parser.add_argument("--api-ms", type=float, default=2.0, help="Fake Docker API round trip")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Tenant routing lookup latency: a main-database read per request versus the routing cache.
+
+The main database is simulated by a loader that sleeps --db-ms per read.
+
+Usage:
+    python benchmarks/bench_routing.py [--requests 5000] [--concurrency 32] [--tenants 100] [--db-ms 1.0]
+"""
+import argparse
+import asyncio
+import time
+
+from common import print_table, run_async_load
+from fakes import fake_endpoint
+
+from executors import run_blocking
+from routing import TenantRoutingCache
+
+
+async def run(args):
+    def loader(username):
+        time.sleep(args.db_ms / 1000)
+        return fake_endpoint(username)
+
+    async def uncached(i):
+        await run_blocking(loader, f"tenant{i % args.tenants}")
+
+    cache = TenantRoutingCache(loader=loader, ttl=300)
+
+    async def cached(i):
+        await cache.get(f"tenant{i % args.tenants}")
+
+    results = {
+        "main db per request": await run_async_load(uncached, args.requests, args.concurrency),
+        "routing cache": await run_async_load(cached, args.requests, args.concurrency),
+    }
+    print_table(f"Routing lookups for {args.tenants} tenants, concurrency {args.concurrency}", results)
+    print(f"\nrouting cache stats: {cache.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--tenants", type=int, default=100)
+    parser.add_argument("--db-ms", type=float, default=1.0, help="Simulated main-database round trip")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Serialization cost per 100k rows for every result format.
+
+Rows mimic a typical tenant table (integer id, text, float, boolean, timestamp, numeric).
+"psql text" is the old exec path: psql formats an ASCII table and the client splits it again.
+Arrow and Parquet rows are skipped when pyarrow is not installed.
+
+Usage:
+    python benchmarks/bench_serialization.py [--rows 100000] [--repeat 3]
+"""
+import argparse
+import datetime
+import decimal
+import json
+import time
+
+from common import print_table
+
+import serialization
+from query_engine import QueryResult
+from serialization import encode_csv, encode_ndjson, encode_rows
+
+COLUMNS = ["id", "name", "score", "active", "created_at", "amount"]
+
+
+def make_rows(count: int):
+    start = datetime.datetime(2024, 1, 1)
+    return [
+        (i, f"user_{i}", i * 0.5, i % 2 == 0, start + datetime.timedelta(seconds=i), decimal.Decimal(i) / 100)
+        for i in range(count)
+    ]
+
+
+def psql_text(columns, rows) -> str:
+    # psql's aligned table output, as returned by `docker exec psql -c`
+    cells = [[str(value) for value in row] for row in rows]
+    widths = [max(len(column), *(len(row[i]) for row in cells)) for i, column in enumerate(columns)]
+    lines = [" | ".join(column.ljust(widths[i]) for i, column in enumerate(columns))]
+    lines.append("-+-".join("-" * width for width in widths))
+    lines.extend(" | ".join(value.ljust(widths[i]) for i, value in enumerate(row)) for row in cells)
+    lines.append(f"({len(rows)} rows)")
+    return "\n".join(lines) + "\n"
+
+
+def stdlib_json(columns, rows) -> bytes:
+    return json.dumps([dict(zip(columns, row)) for row in rows], default=str).encode("utf-8")
+
+
+def formats():
+    encoders = {
+        "psql text + parse": lambda columns, rows: QueryResult(text=psql_text(columns, rows)).records(),
+        "json (stdlib)": stdlib_json,
+        "orjson objects": lambda columns, rows: serialization.dumps(encode_rows(columns, rows, "objects")),
+        "orjson rows": lambda columns, rows: serialization.dumps(encode_rows(columns, rows, "rows")),
+        "orjson columns": lambda columns, rows: serialization.dumps(encode_rows(columns, rows, "columns")),
+        "ndjson": encode_ndjson,
+        "csv": lambda columns, rows: encode_csv(columns, rows, header=True),
+    }
+    if serialization.pa is not None:
+        encoders["arrow ipc"] = serialization.encode_arrow
+        encoders["parquet"] = serialization.encode_parquet
+    return encoders
+
+
+def measure(encode, rows, repeat: int):
+    best = None
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = encode(COLUMNS, rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    size = len(output) if isinstance(output, (bytes, str)) else None
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of N runs")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    results = {}
+    for name, encode in formats().items():
+        seconds, size = measure(encode, rows, args.repeat)
+        results[name] = {
+            "ms_per_100k_rows": round(seconds * 1000 * 100000 / args.rows, 1),
+            "mb": round(size / 2 ** 20, 2) if size is not None else "-",
+        }
+    print_table(f"Serialization of {args.rows} rows x {len(COLUMNS)} columns (best of {args.repeat})", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Statement build time and single-row CRUD latency, legacy string building against models.statement_cache.
+
+"legacy" rebuilds the SQL with ', '.join(...) and wraps it in a new text() on every call, as
+insert_item/update_item/delete_item used to. The build benchmark also times SQLAlchemy's cache
+key generation, which every execute() of a fresh text() construct pays before its compiled-cache
+lookup.
+
+Usage:
+    python benchmarks/bench_statements.py [--columns 8] [--iterations 20000] [--requests 2000] [--latency-ms 0.3]
+                                          [--database-url postgresql+asyncpg://user:pw@localhost:5432/db]
+
+Without --database-url CRUD runs against a fake session charging --latency-ms per statement and
+commit, so the difference is the Python-side cost only. With --database-url a table named
+bench_statements is created (and dropped); the legacy path is run with and without asyncpg's
+prepared statement cache to show the parse/plan cost the cache saves on the server.
+
+With --database-url a last section sizes that cache: single-row inserts cycle through --tables
+tables (bench_statements_0, ...), one SQL text each, on connections whose prepared statement cache
+holds 0 statements, asyncpg's default 100, or TENANT_PREPARED_STATEMENT_CACHE_SIZE when that is set
+to something else. A cache smaller than the working set evicts every statement before it comes
+round again, so it prepares as often as no cache at all.
+"""
+import argparse
+import asyncio
+import time
+
+from common import print_table, run_async_load
+from fakes import FakeAsyncEngine, FakeAsyncSession
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import models
+from query_engine import TENANT_PREPARED_STATEMENT_CACHE_SIZE
+
+TABLE = "bench_statements"
+
+
+def legacy_insert(table_name, item):
+    columns = ', '.join(item.keys())
+    values = ', '.join(f":{key}" for key in item.keys())
+    return text(f"INSERT INTO {table_name} ({columns}) VALUES ({values})")
+
+
+def legacy_update(table_name, item):
+    columns = ', '.join(f"{key} = :{key}" for key in item.keys())
+    return text(f"UPDATE {table_name} SET {columns} WHERE id = :id")
+
+
+def legacy_delete(table_name):
+    return text(f"DELETE FROM {table_name} WHERE id = :id")
+
+
+def make_item(columns: int, i: int = 0):
+    return {f"c{n}": f"value{i}_{n}" for n in range(columns)}
+
+
+def bench_build(args):
+    item = make_item(args.columns)
+    cache = models.StatementCache()
+    builders = {
+        "insert legacy": lambda: legacy_insert(TABLE, item),
+        "insert cached": lambda: cache.get("insert", TABLE, tuple(sorted(item))),
+        "update legacy": lambda: legacy_update(TABLE, item),
+        "update cached": lambda: cache.get("update", TABLE, tuple(sorted(item))),
+        "delete legacy": lambda: legacy_delete(TABLE),
+        "delete cached": lambda: cache.get("delete", TABLE),
+    }
+    results = {}
+    for name, build in builders.items():
+        build()
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            build()
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            build()._generate_cache_key()
+        keyed = time.perf_counter() - start
+        results[name] = {
+            "build_us": round(built / args.iterations * 1e6, 2),
+            "build_and_cache_key_us": round(keyed / args.iterations * 1e6, 2),
+        }
+    print_table(f"Statement build time, {args.columns} columns ({args.iterations} iterations)", results)
+
+
+async def legacy_crud(session, i: int, columns: int):
+    item = dict(make_item(columns, i), id=i)
+    await session.execute(legacy_insert(TABLE, item), item)
+    await session.commit()
+    update = make_item(columns, i + 1)
+    await session.execute(legacy_update(TABLE, update), dict(update, id=i))
+    await session.commit()
+    await session.execute(legacy_delete(TABLE), {"id": i})
+    await session.commit()
+
+
+async def cached_crud(session, i: int, columns: int):
+    await models.insert_item(session, TABLE, dict(make_item(columns, i), id=i))
+    await models.update_item(session, TABLE, i, make_item(columns, i + 1))
+    await models.delete_item(session, TABLE, i)
+
+
+async def run_crud(label, SessionLocal, crud, args, results):
+    async with SessionLocal() as session:
+        # One session, so every request reuses the same pooled connection and its prepared statements
+        stats = await run_async_load(lambda i: crud(session, i + 1, args.columns), args.requests)
+    results[label] = {"p50_ms": stats["p50_ms"], "p99_ms": stats["p99_ms"], "crud_per_sec": stats["req_per_sec"]}
+
+
+async def bench_crud(args):
+    results = {}
+    if not args.database_url:
+        engine = FakeAsyncEngine(latency=args.latency_ms / 1000)
+        SessionLocal = lambda: FakeAsyncSession(engine)
+        await run_crud("legacy text()", SessionLocal, legacy_crud, args, results)
+        await run_crud("statement cache", SessionLocal, cached_crud, args, results)
+    else:
+        url = make_url(args.database_url)
+        column_defs = ', '.join(f"c{n} VARCHAR" for n in range(args.columns))
+        engine = create_async_engine(url)
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+            await conn.execute(text(f"CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY, {column_defs})"))
+        unprepared = create_async_engine(url.update_query_dict({"prepared_statement_cache_size": "0"}))
+        await run_crud("legacy, no prepared cache", async_sessionmaker(unprepared, expire_on_commit=False),
+                       legacy_crud, args, results)
+        await unprepared.dispose()
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+        await run_crud("legacy text()", SessionLocal, legacy_crud, args, results)
+        await run_crud("statement cache", SessionLocal, cached_crud, args, results)
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        await engine.dispose()
+    print_table(f"Single-row insert+update+delete, {args.columns} columns ({args.requests} rounds)", results)
+
+
+async def bench_prepared_cache(args):
+    url = make_url(args.database_url)
+    tables = [f"{TABLE}_{n}" for n in range(args.tables)]
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        for table in tables:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            await conn.execute(text(f"CREATE TABLE {table} (id SERIAL PRIMARY KEY, c0 VARCHAR)"))
+
+    async def insert(session, i: int):
+        await models.insert_item(session, tables[i % len(tables)], {"c0": f"value{i}"})
+
+    results = {}
+    for size in sorted({0, 100, TENANT_PREPARED_STATEMENT_CACHE_SIZE}):
+        sized = create_async_engine(url.update_query_dict({"prepared_statement_cache_size": str(size)}))
+        async with async_sessionmaker(sized, expire_on_commit=False)() as session:
+            # One round first, so every size is measured with its cache as full as it gets
+            for i in range(len(tables)):
+                await insert(session, i)
+            stats = await run_async_load(lambda i: insert(session, i), args.requests)
+        await sized.dispose()
+        results[f"cache size {size}"] = {"p50_ms": stats["p50_ms"], "p99_ms": stats["p99_ms"],
+                                         "inserts_per_sec": stats["req_per_sec"]}
+    async with engine.begin() as conn:
+        for table in tables:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    await engine.dispose()
+    print_table(f"Single-row inserts cycling through {args.tables} tables ({args.requests} inserts)", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=20000, help="Statement builds per variant")
+    parser.add_argument("--requests", type=int, default=2000, help="CRUD rounds per variant")
+    parser.add_argument("--latency-ms", type=float, default=0.3, help="Fake round trip per statement/commit")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--tables", type=int, default=150,
+                        help="Distinct statements in the prepared cache section (asyncpg's default cache holds 100)")
+    args = parser.parse_args()
+    bench_build(args)
+    asyncio.run(bench_crud(args))
+    if args.database_url:
+        asyncio.run(bench_prepared_cache(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Memory per tenant for each tenancy mode, plus a cross-tenant isolation check.
+
+Container mode needs a real Docker host; the database and schema modes need the shared cluster
+configured through SHARED_CLUSTER_* and only use Docker to read the cluster container's memory,
+which is reported as n/a when no Docker daemon is reachable. For every mode it provisions
+--tenants tenants through tenancy.py, opens one idle connection per tenant, and reports:
+
+- container mode: summed memory usage of the tenant containers;
+- database/schema modes: growth of the shared cluster container's memory usage.
+
+tests/test_tenancy.py checks the shared-cluster isolation without Docker or Postgres.
+
+With --check-isolation each tenant also tries to read a table owned by the previous tenant
+and must be refused. Everything created is removed at the end unless --keep is given.
+
+Usage:
+    python benchmarks/bench_tenancy_density.py --mode all --tenants 20 --cluster-container docker-db-1 --check-isolation
+"""
+import argparse
+import asyncio
+import time
+
+from common import print_table
+
+import docker
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from schemas import UserCreate
+from tenancy import ContainerTenancy, SchemaTenancy, SharedDatabaseTenancy
+from container_pool import WarmContainerPool
+from query_engine import get_tenant_url
+
+
+def container_memory(container) -> int:
+    stats = container.stats(stream=False)
+    return int(stats.get("memory_stats", {}).get("usage", 0))
+
+
+def sync_url(endpoint):
+    # Same routing as the query engine, with the synchronous driver for this script
+    return get_tenant_url(endpoint).set(drivername="postgresql+psycopg2", query={})
+
+
+def connect_tenant(endpoint, attempts: int = 60):
+    engine = create_engine(sync_url(endpoint), pool_size=1, max_overflow=0)
+    for _ in range(attempts):
+        try:
+            return engine, engine.connect()
+        except SQLAlchemyError:
+            time.sleep(1)
+    raise RuntimeError(f"Tenant {endpoint['username']} never accepted connections")
+
+
+def check_isolation(endpoints, connections):
+    """Each tenant writes a private table; the next tenant must not be able to read it."""
+    failures = 0
+    for endpoint, conn in zip(endpoints, connections):
+        conn.execute(text("CREATE TABLE IF NOT EXISTS isolation_probe (secret TEXT)"))
+        conn.execute(text("INSERT INTO isolation_probe VALUES ('owned by ' || current_user)"))
+        conn.commit()
+    for i, (endpoint, conn) in enumerate(zip(endpoints, connections)):
+        victim = endpoints[i - 1]
+        target = f"{victim['schema_name']}.isolation_probe" if victim.get("schema_name") else "isolation_probe"
+        try:
+            if victim.get("tenancy_mode") in ("database", "container"):
+                # Separate databases: the attacker tries to connect to the victim's database
+                probe = dict(endpoint, database_name=victim["database_name"], container_hostname=victim["container_hostname"],
+                             container_port=victim["container_port"])
+                engine = create_engine(sync_url(probe))
+                with engine.connect() as other:
+                    other.execute(text(f"SELECT * FROM {target}")).fetchall()
+                engine.dispose()
+            else:
+                conn.execute(text(f"SELECT * FROM {target}")).fetchall()
+            failures += 1
+            print(f"  ISOLATION FAILURE: {endpoint['username']} read {victim['username']}'s data")
+        except SQLAlchemyError:
+            conn.rollback()
+    return failures
+
+
+async def provision_all(backend, mode: str, count: int):
+    endpoints = []
+    for i in range(count):
+        user = UserCreate(username=f"bench_{mode}_{i}", password=f"pw_{i}_secret")
+        tenant = await backend.provision(user)
+        endpoints.append({
+            "username": user.username,
+            "password": user.password,
+            "container_id": tenant["container_id"],
+            "container_hostname": tenant["hostname"],
+            "container_port": tenant["port"],
+            "tenancy_mode": tenant["tenancy_mode"],
+            "database_name": tenant["database_name"],
+            "schema_name": tenant["schema_name"],
+        })
+    return endpoints
+
+
+def cleanup(mode: str, backend, endpoints, client):
+    if mode == "container":
+        for endpoint in endpoints:
+            try:
+                client.containers.get(endpoint["container_hostname"]).remove(force=True)
+            except docker.errors.NotFound:
+                pass
+        return
+    for endpoint in endpoints:
+        username = endpoint["username"]
+        statements = [f"DROP SCHEMA IF EXISTS {username} CASCADE"] if mode == "schema" else []
+        if statements:
+            backend.run_admin(statements, database=endpoint["database_name"])
+        if mode == "database":
+            backend.run_admin([f"DROP DATABASE IF EXISTS {username}"])
+        elif mode == "schema":
+            backend.run_admin([f"REVOKE ALL ON DATABASE {endpoint['database_name']} FROM {username}"])
+        backend.run_admin([f"DROP ROLE IF EXISTS {username}"])
+
+
+def run_mode(mode: str, args, client):
+    if mode == "container":
+        backend = ContainerTenancy(WarmContainerPool(size=0, docker_client=client))
+    elif mode == "database":
+        backend = SharedDatabaseTenancy()
+    else:
+        backend = SchemaTenancy()
+
+    cluster = client.containers.get(args.cluster_container) if mode != "container" and client else None
+    baseline = container_memory(cluster) if cluster else 0
+
+    start = time.perf_counter()
+    endpoints = asyncio.run(provision_all(backend, mode, args.tenants))
+    provision_seconds = time.perf_counter() - start
+    engines, connections = zip(*(connect_tenant(endpoint) for endpoint in endpoints))
+    time.sleep(args.settle_s)
+
+    if mode == "container":
+        used = sum(container_memory(client.containers.get(e["container_hostname"])) for e in endpoints)
+    else:
+        used = container_memory(cluster) - baseline if cluster else None
+    failures = check_isolation(endpoints, connections) if args.check_isolation else None
+
+    for conn, engine in zip(connections, engines):
+        conn.close()
+        engine.dispose()
+    if not args.keep:
+        cleanup(mode, backend, endpoints, client)
+
+    stats = {
+        "tenants": args.tenants,
+        "provision_s": round(provision_seconds, 2),
+        "memory_mb": round(used / 2 ** 20, 1) if used is not None else "n/a",
+        "mb_per_tenant": round(used / 2 ** 20 / args.tenants, 2) if used is not None else "n/a",
+    }
+    if failures is not None:
+        stats["isolation_failures"] = failures
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["container", "database", "schema", "all"], default="all")
+    parser.add_argument("--tenants", type=int, default=20)
+    parser.add_argument("--cluster-container", default="docker-db-1", help="Container running the shared cluster")
+    parser.add_argument("--settle-s", type=float, default=5.0, help="Wait before sampling memory")
+    parser.add_argument("--check-isolation", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="Do not remove the provisioned tenants")
+    args = parser.parse_args()
+
+    try:
+        client = docker.from_env()
+    except docker.errors.DockerException as e:
+        if args.mode in ("container", "all"):
+            parser.error(f"container mode needs a Docker host ({e}); use --mode database or --mode schema")
+        print(f"Docker is not reachable ({e}); cluster memory is not measured")
+        client = None
+    modes = ["container", "database", "schema"] if args.mode == "all" else [args.mode]
+    results = {mode: run_mode(mode, args, client) for mode in modes}
+    print_table("Tenant density by tenancy mode", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Shared helpers for the benchmark scripts: import path setup, load runner and latency statistics."""
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List
+
+# Benchmarks run from server/benchmarks but import the flat server modules
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+# The server modules build their main-DB engine at import time; give them a harmless URL
+os.environ.setdefault("MAIN_DB_HOST", "localhost")
+os.environ.setdefault("MAIN_DB_NAME", "bench")
+os.environ.setdefault("MAIN_DB_USER", "bench")
+os.environ.setdefault("MAIN_DB_PASSWORD", "bench")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Turn per-request latencies (seconds) into throughput and latency percentiles (milliseconds)."""
+    return {
+        "requests": len(latencies),
+        "req_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def run_load(fn: Callable[[int], None], requests: int, concurrency: int = 1) -> Dict[str, float]:
+    """Call fn(i) `requests` times from `concurrency` threads and summarize the latencies."""
+    def timed(i: int) -> float:
+        start = time.perf_counter()
+        fn(i)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, range(requests)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def timed_call(fn: Callable[[int], Awaitable], i: int) -> float:
+    """Await fn(i) and return how long it took in seconds."""
+    start = time.perf_counter()
+    await fn(i)
+    return time.perf_counter() - start
+
+
+async def run_async_load(fn: Callable[[int], Awaitable], requests: int, concurrency: int = 1) -> Dict[str, float]:
+    """Await fn(i) `requests` times with at most `concurrency` in flight and summarize the latencies."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i: int) -> float:
+        async with semaphore:
+            return await timed_call(fn, i)
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(bounded(i) for i in range(requests)))
+    return summarize(list(latencies), time.perf_counter() - start)
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, float]]):
+    """Print one line of statistics per benchmarked variant."""
+    print(f"\n{title}")
+    for name, stats in rows.items():
+        fields = "  ".join(f"{key}={value}" for key, value in stats.items())
+        print(f"  {name:<24} {fields}")
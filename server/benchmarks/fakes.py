@@ -0,0 +1,490 @@
+"""In-process stand-ins for Docker and tenant Postgres used by the benchmarks."""
+import asyncio
+import re
+import subprocess
+import time
+from collections import namedtuple
+
+import docker
+from sqlalchemy import Table
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+ExecResult = namedtuple("ExecResult", ["exit_code", "output"])
+
+
+class FakeContainer:
+    """
+    A tenant container. exec_run of a psql command string forks a real process, like
+    `docker exec psql` does; pg_isready reports ready once `boot_time` has elapsed.
+    """
+
+    def __init__(self, containers, name: str, exec_latency: float = 0.0, boot_time: float = 0.0,
+                 labels=None, port: int = 5432, environment=None):
+        self.containers = containers
+        self.name = name
+        self.id = f"fake-{name}"
+        self.exec_latency = exec_latency
+        self.labels = dict(labels or {})
+        self.environment = dict(environment or {})
+        self.ports = {"5432/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(port)}]}
+        self.status = "running"
+        self.started_at = time.monotonic()
+        self.boot_time = boot_time
+        self.exec_calls = []
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "running" and time.monotonic() - self.started_at >= self.boot_time
+
+    @property
+    def attrs(self):
+        return {"HostConfig": {"PortBindings": self.ports}}
+
+    def exec_run(self, cmd, environment=None):
+        self.exec_calls.append(cmd)
+        if self.exec_latency:
+            time.sleep(self.exec_latency)
+        if isinstance(cmd, list):
+            # Admin commands (pg_isready, psql -c ...) issued with an argument list
+            if not self.ready:
+                return ExecResult(2, b"no response\n")
+            return ExecResult(0, b"OK\n")
+        # Fork/exec cost of psql inside the container
+        subprocess.run(["sh", "-c", "echo ' ?column? '; echo '----------'; echo '        1'; echo '(1 row)'"],
+                       stdout=subprocess.PIPE, check=True)
+        return ExecResult(0, b" ?column? \n----------\n        1\n(1 row)\n")
+
+    def rename(self, name: str):
+        self.containers.api_call()
+        if name in self.containers.by_name:
+            raise docker.errors.APIError(f"Conflict. The container name {name} is already in use")
+        del self.containers.by_name[self.name]
+        self.name = name
+        self.containers.by_name[name] = self
+
+    def reload(self):
+        self.containers.api_call()
+
+    def stop(self, timeout=None):
+        self.containers.api_call()
+        self.status = "exited"
+
+    def start(self):
+        self.containers.api_call()
+        self.status = "running"
+        self.started_at = time.monotonic()
+
+    def pause(self):
+        self.containers.api_call()
+        self.status = "paused"
+
+    def unpause(self):
+        # A frozen Postgres resumes without booting again
+        self.containers.api_call()
+        self.status = "running"
+
+    def remove(self, force=False):
+        self.containers.api_call()
+        self.containers.by_name.pop(self.name, None)
+        self.status = "removed"
+
+
+class FakeContainers:
+    def __init__(self, api_latency: float = 0.0, exec_latency: float = 0.0, boot_time: float = 0.0,
+                 start_latency: float = 0.0):
+        self.api_latency = api_latency
+        self.exec_latency = exec_latency
+        self.boot_time = boot_time
+        self.start_latency = start_latency
+        self.by_name = {}
+        self.next_port = 20000
+        # Host ports bound outside Docker; containers.run fails on them, and on ports of running containers
+        self.taken_ports = set()
+
+    def api_call(self):
+        if self.api_latency:
+            time.sleep(self.api_latency)
+
+    def get(self, name: str):
+        self.api_call()
+        if name not in self.by_name:
+            raise docker.errors.NotFound(f"No such container: {name}")
+        return self.by_name[name]
+
+    def add(self, name: str, **kwargs):
+        kwargs.setdefault("boot_time", self.boot_time)
+        self.by_name[name] = FakeContainer(self, name, self.exec_latency, **kwargs)
+        return self.by_name[name]
+
+    def run(self, image, name=None, environment=None, ports=None, network=None, labels=None, detach=True, **kwargs):
+        self.api_call()
+        if self.start_latency:
+            time.sleep(self.start_latency)
+        if name in self.by_name:
+            raise docker.errors.APIError(f"Conflict. The container name {name} is already in use")
+        port = next(iter((ports or {}).values()), None) or self.next_port
+        self.next_port += 1
+        bound = {int(c.ports["5432/tcp"][0]["HostPort"]) for c in self.by_name.values() if c.status == "running"}
+        container = self.add(name, labels=labels, port=port, environment=environment)
+        if port in self.taken_ports or port in bound:
+            # Docker creates the container, then fails to start it
+            container.status = "created"
+            raise docker.errors.APIError(f"driver failed programming external connectivity: Bind for 0.0.0.0:{port} "
+                                         f"failed: port is already allocated")
+        return container
+
+    def list(self, all=False, filters=None):
+        self.api_call()
+        containers = list(self.by_name.values())
+        label = (filters or {}).get("label")
+        if label:
+            key, _, value = label.partition("=")
+            containers = [c for c in containers if key in c.labels and (not value or c.labels[key] == value)]
+        if not all:
+            containers = [c for c in containers if c.status == "running"]
+        return containers
+
+
+class FakeNetworks:
+    def __init__(self):
+        self.names = set()
+
+    def get(self, name: str):
+        if name not in self.names:
+            raise docker.errors.NotFound(f"network {name} not found")
+        return name
+
+    def create(self, name: str, driver=None):
+        self.names.add(name)
+        return name
+
+
+class FakeDockerClient:
+    """
+    Minimal docker.DockerClient replacement with configurable API latency, container
+    start latency (containers.run) and Postgres boot time (until pg_isready succeeds).
+    """
+
+    def __init__(self, api_latency: float = 0.0, exec_latency: float = 0.0, boot_time: float = 0.0,
+                 start_latency: float = 0.0):
+        self.containers = FakeContainers(api_latency, exec_latency, boot_time, start_latency)
+        self.networks = FakeNetworks()
+
+
+def fake_endpoint(username: str, port: int = 5432):
+    """A users-table row as returned by adminUtils.get_user_endpoint."""
+    return {
+        "username": username,
+        "password": "secret",
+        "container_id": f"fake-postgres_{username}",
+        "container_hostname": f"postgres_{username}",
+        "container_port": port,
+    }
+
+
+class FakeResult:
+    """Subset of SQLAlchemy's CursorResult used by the query engine."""
+
+    def __init__(self, columns=None, rows=None, rowcount=1):
+        self.columns = list(columns or [])
+        self.rows = list(rows or [])
+        self.returns_rows = bool(self.columns)
+        self.rowcount = len(self.rows) if self.returns_rows else rowcount
+
+    def keys(self):
+        return self.columns
+
+    def fetchall(self):
+        return self.rows
+
+    def mappings(self):
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+
+class _FakeSavepoint:
+    """begin_nested(): SAVEPOINT on enter, RELEASE or ROLLBACK TO on exit, one round trip each."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def __aenter__(self):
+        await self.engine.run("SAVEPOINT sa_savepoint_1")
+        return self
+
+    async def __aexit__(self, exc_type, *exc):
+        await self.engine.run("ROLLBACK TO SAVEPOINT sa_savepoint_1" if exc_type else "RELEASE SAVEPOINT sa_savepoint_1")
+        return False
+
+
+class FakeAsyncConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def begin_nested(self):
+        return _FakeSavepoint(self.engine)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        # DDL issued through the synchronous API (e.g. Table.create) costs one round trip
+        table = getattr(fn, "__self__", None)
+        if isinstance(table, Table):
+            await self.engine.run(str(CreateTable(table).compile(dialect=postgresql.dialect())))
+        else:
+            await self.engine.run(getattr(fn, "__name__", "run_sync"))
+
+    async def exec_driver_sql(self, statement, parameters=None):
+        return await self.engine.run(str(statement), parameters)
+
+    async def execute(self, statement, parameters=None):
+        return await self.engine.run(str(statement), parameters)
+
+    async def stream(self, statement, parameters=None):
+        return FakeStreamResult(await self.engine.run(str(statement), parameters))
+
+    async def get_raw_connection(self):
+        return FakeRawConnection(self.engine)
+
+
+class FakeDriverConnection:
+    """Subset of asyncpg.Connection: simple-protocol execute and COPY."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def execute(self, statement):
+        await self.engine.run(statement)
+        return "OK"
+
+    async def copy_records_to_table(self, table_name, records, columns=None):
+        await self.engine.copy(len(records))
+        return f"COPY {len(records)}"
+
+    async def copy_to_table(self, table_name, source, columns=None, format=None, header=None):
+        rows = source.getvalue().count(b"\n")
+        await self.engine.copy(rows)
+        return f"COPY {rows}"
+
+
+class FakeRawConnection:
+    def __init__(self, engine):
+        self.driver_connection = FakeDriverConnection(engine)
+
+
+class FakeAsyncSession:
+    """
+    Subset of AsyncSession; commit and rollback cost one round trip. Like a real session it
+    checks a connection out of the engine's pool on first use and returns it when closed.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.checked_out = False
+
+    async def _checkout(self):
+        if not self.checked_out:
+            await self.engine.slots.acquire()
+            self.engine.checked_out += 1
+            self.checked_out = True
+
+    async def execute(self, statement, parameters=None):
+        await self._checkout()
+        return await self.engine.run(str(statement), parameters)
+
+    async def stream(self, statement, parameters=None):
+        await self._checkout()
+        return FakeStreamResult(await self.engine.run(str(statement), parameters))
+
+    async def connection(self):
+        await self._checkout()
+        return FakeAsyncConnection(self.engine)
+
+    async def commit(self):
+        await self.engine.wait(self.engine.latency)
+
+    async def rollback(self):
+        await self.engine.wait(self.engine.latency)
+
+    async def close(self):
+        if self.checked_out:
+            self.checked_out = False
+            self.engine.checked_out -= 1
+            self.engine.slots.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+
+class FakeStreamResult:
+    """Subset of SQLAlchemy's AsyncResult for server-side cursor reads."""
+
+    def __init__(self, result: FakeResult):
+        self.result = result
+
+    def keys(self):
+        return self.result.columns
+
+    async def partitions(self, size: int):
+        for start in range(0, len(self.result.rows), size):
+            yield self.result.rows[start:start + size]
+
+
+class _FakeCheckout:
+    """Async context manager that holds one of the engine's pool slots."""
+
+    def __init__(self, engine, transaction: bool = False):
+        self.engine = engine
+        self.transaction = transaction
+
+    async def __aenter__(self):
+        await self.engine.slots.acquire()
+        self.engine.checked_out += 1
+        if self.transaction:
+            await self.engine.wait(self.engine.transaction_latency)
+        return FakeAsyncConnection(self.engine)
+
+    async def __aexit__(self, *exc):
+        try:
+            if self.transaction:
+                await self.engine.wait(self.engine.transaction_latency)
+        finally:
+            self.engine.checked_out -= 1
+            self.engine.slots.release()
+        return False
+
+
+class FakeAsyncEngine:
+    """
+    Stand-in for a tenant AsyncEngine.
+
+    Every statement waits `latency` seconds (one round trip) plus `row_cost` per parameter
+    set or copied row; with blocking=True it sleeps on the thread (how a synchronous driver
+    behaves inside an async handler) instead of yielding. begin() waits `transaction_latency`
+    for BEGIN and again for COMMIT.
+    """
+
+    def __init__(self, latency: float = 0.0, pool_size: int = 5, blocking: bool = False, responder=None,
+                 row_cost: float = 0.0, copy_row_cost: float = None, transaction_latency: float = 0.0):
+        self.latency = latency
+        self.transaction_latency = transaction_latency
+        self.row_cost = row_cost
+        # COPY streams rows without per-row protocol messages; by default a quarter of row_cost
+        self.copy_row_cost = row_cost / 4 if copy_row_cost is None else copy_row_cost
+        self.blocking = blocking
+        self.responder = responder or default_responder
+        self.pool_size = pool_size
+        self.slots = asyncio.Semaphore(pool_size)
+        self.checked_out = 0
+        self.statements = 0
+        self.disposed = False
+
+    async def wait(self, seconds: float):
+        if seconds <= 0:
+            return
+        if self.blocking:
+            time.sleep(seconds)
+        elif seconds < 0.001:
+            # asyncio.sleep overshoots sub-millisecond waits badly; yield once, then spin
+            deadline = time.perf_counter() + seconds
+            await asyncio.sleep(0)
+            while time.perf_counter() < deadline:
+                pass
+        else:
+            await asyncio.sleep(seconds)
+
+    async def run(self, statement, parameters=None):
+        self.statements += 1
+        rows = len(parameters) if isinstance(parameters, list) else 1
+        await self.wait(self.latency + rows * self.row_cost)
+        return self.responder(statement, parameters)
+
+    async def copy(self, rows: int):
+        self.statements += 1
+        await self.wait(self.latency + rows * self.copy_row_cost)
+
+    def begin(self):
+        return _FakeCheckout(self, transaction=True)
+
+    def connect(self):
+        return _FakeCheckout(self)
+
+    async def dispose(self):
+        self.disposed = True
+
+
+def default_responder(statement, parameters=None):
+    if statement.lstrip().upper().startswith("SELECT"):
+        return FakeResult(["?column?"], [(1,)])
+    return FakeResult(rowcount=1)
+
+
+# Column types as the compiled DDL spells them, and as format_type() reports them in the catalog
+_CATALOG_TYPES = {"SERIAL": "integer", "INTEGER": "integer", "BIGINT": "bigint", "SMALLINT": "smallint",
+                  "VARCHAR": "character varying", "TEXT": "text", "FLOAT": "double precision",
+                  "DOUBLE": "double precision", "REAL": "real", "NUMERIC": "numeric", "BOOLEAN": "boolean"}
+_CREATE_TABLE = re.compile(r"^CREATE TABLE (?:IF NOT EXISTS )?\"?(\w+)\"?\s*\((.*)\)\s*;?$", re.IGNORECASE | re.DOTALL)
+_DROP_TABLE = re.compile(r"^DROP TABLE (?:IF EXISTS )?\"?(\w+)\"?", re.IGNORECASE)
+_ADD_COLUMN = re.compile(r"^ALTER TABLE \"?(\w+)\"? ADD (?:COLUMN )?(?:IF NOT EXISTS )?\"?(\w+)\"?\s+(\w+)", re.IGNORECASE)
+_DROP_COLUMN = re.compile(r"^ALTER TABLE \"?(\w+)\"? DROP (?:COLUMN )?(?:IF EXISTS )?\"?(\w+)\"?", re.IGNORECASE)
+_SELECT_FROM = re.compile(r"^SELECT .*? FROM \"?(\w+)\"?(?:.*? LIMIT (\d+))?", re.IGNORECASE | re.DOTALL)
+
+
+class FakeTenantDatabase:
+    """
+    Responder for a FakeAsyncEngine that keeps a tenant's schema: CREATE TABLE, DROP TABLE and
+    ALTER TABLE ADD/DROP COLUMN change it, the catalog query (catalog.CATALOG_QUERY) reports it,
+    and a SELECT from a table returns up to `rows` generated rows with the table's columns.
+    """
+
+    def __init__(self, rows: int = 100):
+        self.rows = rows
+        self.tables = {}
+
+    def _column_value(self, column_type: str, i: int):
+        if column_type in ("integer", "bigint", "smallint"):
+            return i
+        if column_type in ("double precision", "real", "numeric"):
+            return i * 1.5
+        if column_type == "boolean":
+            return i % 2 == 0
+        return f"value{i}"
+
+    def respond(self, statement, parameters=None):
+        sql = statement.strip()
+        if "pg_catalog.pg_class" in sql:
+            rows = [(table, column, column_type, column == "id")
+                    for table, columns in self.tables.items() for column, column_type in columns]
+            return FakeResult(["relname", "attname", "format_type", "attnotnull"], rows)
+        match = _CREATE_TABLE.match(sql)
+        if match:
+            columns = []
+            for definition in match.group(2).split(","):
+                name, _, column_type = definition.strip().partition(" ")
+                column_type = column_type.split("(")[0].split(" ")[0].upper()
+                if column_type in _CATALOG_TYPES:
+                    columns.append((name.strip('"'), _CATALOG_TYPES[column_type]))
+            self.tables.setdefault(match.group(1), columns)
+            return FakeResult(rowcount=-1)
+        match = _DROP_TABLE.match(sql)
+        if match:
+            self.tables.pop(match.group(1), None)
+            return FakeResult(rowcount=-1)
+        match = _ADD_COLUMN.match(sql)
+        if match and match.group(1) in self.tables:
+            column_type = _CATALOG_TYPES.get(match.group(3).upper(), "text")
+            self.tables[match.group(1)].append((match.group(2), column_type))
+            return FakeResult(rowcount=-1)
+        match = _DROP_COLUMN.match(sql)
+        if match and match.group(1) in self.tables:
+            self.tables[match.group(1)] = [column for column in self.tables[match.group(1)] if column[0] != match.group(2)]
+            return FakeResult(rowcount=-1)
+        match = _SELECT_FROM.match(sql)
+        if match and match.group(1) in self.tables:
+            columns = self.tables[match.group(1)]
+            count = min(self.rows, int(match.group(2))) if match.group(2) else self.rows
+            rows = [tuple(self._column_value(column_type, i) for _, column_type in columns) for i in range(1, count + 1)]
+            return FakeResult([name for name, _ in columns], rows)
+        return default_responder(sql, parameters)
@@ -0,0 +1,558 @@
+"""
+Load-testing suite for the tenant API, with a JSON baseline to catch regressions.
+
+Every workload drives the real application (main.app with the /db app and the /users router)
+in process through httpx's ASGI transport. Docker is fakes.FakeDockerClient (containers.run takes
+--start-s, Postgres accepts connections --boot-s later), the main database is SQLite with
+--main-db-ms per statement, and each tenant database is a fakes.FakeAsyncEngine holding a
+fakes.FakeTenantDatabase schema, --db-ms per round trip. With --database-url the tenants live on
+a real local Postgres instead, one schema per tenant, reached through the tenant pool registry
+(database.tenant_pools) as in production.
+
+Workloads:
+    read_heavy    table pages through /db (95%), updates that invalidate the result cache (5%)
+    write_heavy   inserts (70%) and updates (20%) through /users, page reads (10%)
+    ddl_churn     create, alter, list and drop tables through /db, invalidating the catalog each time
+    registration  bursts of --burst concurrent /register calls (warm pool claims, then cold starts)
+    many_tenant   page reads spread over --many-tenants tenants, routing and catalog caches cold
+
+Request mixes are drawn from --seed, so two runs send the same requests, and each workload runs
+--repeat rounds of which the median is reported. Per workload: HTTP requests, errors, throughput,
+p50/p95/p99 latency, the resident memory of this process (the worker serving the app) at the end
+and at its peak, and the peak of tenant connections checked out. --save writes the results as a JSON baseline; --compare reads one and exits with status 1
+when a metric is worse than the baseline by more than --tolerance.
+
+Usage:
+    python benchmarks/suite.py [--workloads read_heavy ddl_churn] [--requests 2000] [--concurrency 32]
+                               [--save baseline.json] [--compare baseline.json] [--database-url URL]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from common import print_table, summarize
+from fakes import FakeAsyncEngine, FakeAsyncSession, FakeDockerClient, FakeTenantDatabase, fake_endpoint
+
+# The suite measures the request path, not the per-tenant rate limit (read when scheduler is imported)
+os.environ.setdefault("TENANT_RATE_PER_SECOND", "1000000")
+
+import httpx
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+import adminUtils
+import query_engine
+import user_routes
+from catalog import catalog_cache
+from container_pool import warm_pool
+from database import TENANT_POOL_MAX_SIZE, tenant_pools
+from main import app
+from query_engine import PooledBackend, get_tenant_endpoint
+from routing import tenant_routes
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ITEM_COLUMNS = {"name": "String", "qty": "Integer", "price": "Float"}
+
+# Metrics compared with the baseline: 1 when higher is better, -1 when lower is better, and the
+# absolute change below which a difference is noise whatever the relative change
+COMPARED_METRICS = {
+    "req_per_sec": (1, 0.0),
+    "p50_ms": (-1, 0.5),
+    "p95_ms": (-1, 1.0),
+    "p99_ms": (-1, 2.0),
+    "errors": (-1, 0),
+    "peak_rss_mb": (-1, 10.0),
+    "peak_connections": (-1, 2),
+}
+
+USERS_DDL = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(100) UNIQUE NOT NULL,
+    password VARCHAR(100) NOT NULL,
+    registration_time TIMESTAMP NOT NULL,
+    container_id VARCHAR(100) NOT NULL,
+    container_hostname VARCHAR(100) NOT NULL,
+    container_port INTEGER NOT NULL,
+    tenancy_mode VARCHAR(20) NOT NULL DEFAULT 'container',
+    database_name VARCHAR(100),
+    schema_name VARCHAR(100)
+)
+"""
+
+
+def rss_mb() -> float:
+    """Resident memory of this process in MiB (the peak so far where the current value is unavailable)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2 ** 20
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KiB elsewhere
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def install_main_db(args, path: str):
+    """Point adminUtils (users table reads and writes, routing lookups) at a SQLite main database."""
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+    if args.main_db_ms:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _round_trip(*_):
+            time.sleep(args.main_db_ms / 1000)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(USERS_DDL)
+    adminUtils.engine = engine
+    adminUtils.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def seed_users(usernames):
+    """Insert users rows directly, as if the tenants had registered earlier."""
+    with adminUtils.SessionLocal() as session:
+        session.execute(text("""
+            INSERT INTO users (username, password, registration_time, container_id, container_hostname, container_port)
+            VALUES (:username, :password, CURRENT_TIMESTAMP, :container_id, :container_hostname, :container_port)
+        """), [fake_endpoint(username) for username in usernames])
+        session.commit()
+
+
+class CountedEngine(FakeAsyncEngine):
+    """A fake tenant engine that reports every checkout and checkin to its FakeTenants."""
+
+    def __init__(self, tenants, **kwargs):
+        self.tenants = tenants
+        self._checked_out = 0
+        super().__init__(**kwargs)
+
+    @property
+    def checked_out(self) -> int:
+        return self._checked_out
+
+    @checked_out.setter
+    def checked_out(self, value: int):
+        self.tenants.in_use += value - self._checked_out
+        self.tenants.peak = max(self.tenants.peak, self.tenants.in_use)
+        self._checked_out = value
+
+
+class FakeTenants:
+    """Tenant databases as fake engines, one per tenant, standing in for the tenant pool registry."""
+
+    def __init__(self, args):
+        self.args = args
+        self.engines = {}
+        self.in_use = 0
+        self.peak = 0
+
+    def engine(self, username: str) -> FakeAsyncEngine:
+        if username not in self.engines:
+            self.engines[username] = CountedEngine(self, latency=self.args.db_ms / 1000, pool_size=TENANT_POOL_MAX_SIZE,
+                                                   responder=FakeTenantDatabase(rows=self.args.rows).respond)
+        return self.engines[username]
+
+    async def install(self):
+        # Pool keys end with the username (query_engine.get_tenant_key)
+        query_engine.query_backend = PooledBackend(engine_lookup=lambda key, url: self.engine(key[-1]))
+
+        async def get_tenant_sessionmaker(username: str):
+            engine = self.engine((await get_tenant_endpoint(username))["username"])
+            return lambda: FakeAsyncSession(engine)
+
+        user_routes.get_tenant_sessionmaker = get_tenant_sessionmaker
+
+    async def prepare(self, usernames):
+        pass
+
+    def sample(self):
+        # Checkouts are counted as they happen
+        pass
+
+    def reset_peak(self):
+        self.peak = self.in_use
+
+    def engine_count(self) -> int:
+        return len(self.engines)
+
+    async def close(self):
+        pass
+
+
+class PostgresTenants:
+    """Tenant databases as schemas of one local Postgres, reached through database.tenant_pools."""
+
+    def __init__(self, args):
+        from sqlalchemy.engine import make_url
+        self.url = make_url(args.database_url).set(drivername="postgresql+asyncpg")
+        self.schemas = set()
+        self.admin = None
+        self.peak = 0
+
+    async def install(self):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        def engine_factory(database_url, **kwargs):
+            # Tenant URLs carry the tenant as their user; its tables live in the schema of that name
+            return create_async_engine(self.url, connect_args={"server_settings": {"search_path": database_url.username}},
+                                       **kwargs)
+
+        tenant_pools.engine_factory = engine_factory
+        self.admin = create_async_engine(self.url)
+
+    async def prepare(self, usernames):
+        async with self.admin.begin() as conn:
+            for username in usernames:
+                await conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {username} CASCADE")
+                await conn.exec_driver_sql(f"CREATE SCHEMA {username}")
+        self.schemas.update(usernames)
+
+    def sample(self):
+        self.peak = max(self.peak, tenant_pools.stats()["connections_in_use"])
+
+    def reset_peak(self):
+        self.peak = tenant_pools.stats()["connections_in_use"]
+
+    def engine_count(self) -> int:
+        return tenant_pools.stats()["engines"]
+
+    async def close(self):
+        await tenant_pools.dispose_all()
+        async with self.admin.begin() as conn:
+            for schema in self.schemas:
+                await conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await self.admin.dispose()
+
+
+class Recorder:
+    """Times every HTTP request of a workload and counts responses by status."""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.latencies = []
+        self.statuses = Counter()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        self.statuses[response.status_code] += 1
+        return response
+
+
+class Sampler:
+    """Samples resident memory (and tenant connections, where they are not counted exactly) while a workload runs."""
+
+    def __init__(self, tenants, interval: float = 0.005):
+        self.tenants = tenants
+        self.interval = interval
+        self.peak_rss = 0.0
+        self._task = None
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, rss_mb())
+        self.tenants.sample()
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self.tenants.reset_peak()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.sample()
+        return False
+
+
+class Harness:
+    """The application under test, its stand-ins and the tenants seeded for the workloads."""
+
+    def __init__(self, args, tenants, client: httpx.AsyncClient):
+        self.args = args
+        self.tenants = tenants
+        self.client = client
+
+    async def seed(self, prefix: str, count: int):
+        """Register `count` tenants holding an `items` table of --rows rows; returns their usernames."""
+        usernames = [f"{prefix}{i:04d}" for i in range(count)]
+        seed_users(usernames)
+        await self.tenants.prepare(usernames)
+        rows = [{"name": f"item{i}", "qty": i, "price": i * 1.5} for i in range(self.args.rows)]
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def create(username):
+            async with semaphore:
+                response = await self.client.post(f"/users/{username}/create_table",
+                                                  json={"table_name": "items", "columns": ITEM_COLUMNS})
+                response.raise_for_status()
+                response = await self.client.post(f"/users/{username}/bulk_insert", params={"table_name": "items"},
+                                                  json=rows)
+                response.raise_for_status()
+
+        await asyncio.gather(*(create(username) for username in usernames))
+        return usernames
+
+    async def drive(self, step, steps: int, concurrency: int):
+        """Run step(recorder, i) for i in range(steps), at most `concurrency` at a time, and report."""
+        recorder = Recorder(self.client)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(i):
+            async with semaphore:
+                await step(recorder, i)
+
+        async with Sampler(self.tenants) as sampler:
+            start = time.perf_counter()
+            await asyncio.gather(*(bounded(i) for i in range(steps)))
+            elapsed = time.perf_counter() - start
+        return dict(summarize(recorder.latencies, elapsed),
+                    errors=sum(count for status, count in recorder.statuses.items() if status >= 400),
+                    rss_mb=round(rss_mb(), 1),
+                    peak_rss_mb=round(sampler.peak_rss, 1),
+                    peak_connections=self.tenants.peak,
+                    engines=self.tenants.engine_count())
+
+    async def measure(self, step, steps: int, concurrency: int):
+        """drive() --repeat times; every metric is the median of the rounds."""
+        return median_of([await self.drive(step, steps, concurrency) for _ in range(self.args.repeat)])
+
+
+def median_of(rounds):
+    return {key: round(statistics.median(stats[key] for stats in rounds), 3) for key in rounds[0]}
+
+
+async def read_heavy(harness: Harness, args):
+    tenants = await harness.seed("read", args.tenants)
+    rng = random.Random(args.seed)
+    plan = [(rng.choice(tenants), rng.random(), rng.randrange(args.rows)) for _ in range(args.requests)]
+
+    async def step(recorder, i):
+        tenant, roll, row = plan[i]
+        if roll < 0.05:
+            await recorder.request("PUT", f"/db/users/{tenant}/tables/items",
+                                   json={"sql_query": f"UPDATE items SET qty = qty + 1 WHERE id = {row + 1}"})
+        else:
+            await recorder.request("GET", f"/db/users/{tenant}/tables/items",
+                                   params={"limit": 20, "after_id": row // 20 * 20})
+
+    return await harness.measure(step, args.requests, args.concurrency)
+
+
+async def write_heavy(harness: Harness, args):
+    tenants = await harness.seed("write", args.tenants)
+    rng = random.Random(args.seed)
+    plan = [(rng.choice(tenants), rng.random(), rng.randrange(args.rows)) for _ in range(args.requests)]
+
+    async def step(recorder, i):
+        tenant, roll, row = plan[i]
+        if roll < 0.7:
+            await recorder.request("POST", f"/users/{tenant}/insert_item", params={"table_name": "items"},
+                                   json={"item": {"name": f"new{i}", "qty": i, "price": i * 0.5}})
+        elif roll < 0.9:
+            await recorder.request("PUT", f"/users/{tenant}/update_item/{row + 1}", params={"table_name": "items"},
+                                   json={"item": {"qty": i}})
+        else:
+            await recorder.request("GET", f"/db/users/{tenant}/tables/items", params={"limit": 20})
+
+    return await harness.measure(step, args.requests, args.concurrency)
+
+
+async def ddl_churn(harness: Harness, args):
+    tenants = await harness.seed("ddl", args.tenants)
+
+    async def step(recorder, i):
+        # The four statements of one table run in order; different tables interleave
+        tenant, table = tenants[i % len(tenants)], f"churn_{i}"
+        await recorder.request("POST", f"/db/users/{tenant}/tables",
+                               json={"sql_query": f"CREATE TABLE {table} (id SERIAL PRIMARY KEY, note VARCHAR(50))"})
+        await recorder.request("PATCH", f"/db/users/{tenant}/tables/{table}/structure",
+                               json={"sql_query": f"ALTER TABLE {table} ADD COLUMN qty INTEGER"})
+        await recorder.request("GET", f"/db/users/{tenant}/tables")
+        await recorder.request("DELETE", f"/db/users/{tenant}/tables/{table}")
+
+    return await harness.measure(step, max(1, args.requests // 4), args.concurrency)
+
+
+async def registration(harness: Harness, args):
+    warm_pool.size = args.warm_pool
+    await warm_pool.start()
+    rounds = []
+    try:
+        for burst in range(args.repeat):
+            # Every burst starts with a full warm pool and registers new usernames
+            while warm_pool.depth < args.warm_pool:
+                await asyncio.sleep(0.05)
+
+            async def step(recorder, i):
+                await recorder.request("POST", "/register", json={"username": f"reg{burst}_{i:04d}", "password": "secret"})
+
+            rounds.append(await harness.drive(step, args.burst, args.burst))
+    finally:
+        await warm_pool.stop()
+    return median_of(rounds)
+
+
+async def many_tenant(harness: Harness, args):
+    tenants = await harness.seed("many", args.many_tenants)
+    tenant_routes.clear()
+    for tenant in tenants:
+        catalog_cache.invalidate(tenant)
+    rng = random.Random(args.seed)
+    plan = [rng.choice(tenants) for _ in range(args.requests)]
+
+    async def step(recorder, i):
+        await recorder.request("GET", f"/db/users/{plan[i]}/tables/items", params={"limit": 20})
+
+    return await harness.measure(step, args.requests, args.concurrency)
+
+
+WORKLOADS = {
+    "read_heavy": read_heavy,
+    "write_heavy": write_heavy,
+    "ddl_churn": ddl_churn,
+    "registration": registration,
+    "many_tenant": many_tenant,
+}
+
+
+def compare(baseline, results, tolerance: float):
+    """
+    Compare results with a saved baseline.
+
+    Returns:
+    - (rows for print_table, number of regressions). A metric regresses when it is worse by more
+      than `tolerance` (relative) and by more than its noise floor in COMPARED_METRICS.
+    """
+    rows, regressions = {}, 0
+    for workload, stats in results.items():
+        previous = baseline["results"].get(workload)
+        if previous is None:
+            continue
+        for metric, (direction, noise) in COMPARED_METRICS.items():
+            if metric not in stats or metric not in previous:
+                continue
+            old, new = previous[metric], stats[metric]
+            worse = (old - new) * direction
+            relative = worse / abs(old) if old else (1.0 if worse > 0 else 0.0)
+            if worse > noise and relative > tolerance:
+                status = "REGRESSION"
+                regressions += 1
+            elif -worse > noise and -relative > tolerance:
+                status = "improved"
+            else:
+                status = "ok"
+            rows[f"{workload} {metric}"] = {
+                "baseline": old,
+                "now": new,
+                "change_pct": round((new - old) / abs(old) * 100, 1) if old else None,
+                "status": status,
+            }
+    return rows, regressions
+
+
+def configuration(args):
+    return {key: value for key, value in vars(args).items() if key not in ("save", "compare", "tolerance")}
+
+
+async def run(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        install_main_db(args, os.path.join(directory, "main.db"))
+        adminUtils._docker_client = FakeDockerClient(api_latency=args.api_ms / 1000, boot_time=args.boot_s,
+                                                     start_latency=args.start_s)
+        tenants = PostgresTenants(args) if args.database_url else FakeTenants(args)
+        await tenants.install()
+        # Unhandled exceptions count as 500 responses instead of aborting the run
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            harness = Harness(args, tenants, client)
+            try:
+                for name in args.workloads:
+                    results[name] = await WORKLOADS[name](harness, args)
+            finally:
+                await tenants.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--requests", type=int, default=2000, help="HTTP requests per workload")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--tenants", type=int, default=20, help="tenants of the read, write and DDL workloads")
+    parser.add_argument("--many-tenants", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=100, help="rows of each tenant's items table")
+    parser.add_argument("--burst", type=int, default=50, help="concurrent registrations")
+    parser.add_argument("--warm-pool", type=int, default=10, help="warm containers ready before the burst")
+    parser.add_argument("--db-ms", type=float, default=1.0, help="fake tenant Postgres round trip")
+    parser.add_argument("--main-db-ms", type=float, default=0.5, help="main database statement latency")
+    parser.add_argument("--api-ms", type=float, default=2.0, help="fake Docker API round trip")
+    parser.add_argument("--start-s", type=float, default=0.2, help="fake containers.run latency")
+    parser.add_argument("--boot-s", type=float, default=0.5, help="fake Postgres initdb + boot time")
+    parser.add_argument("--repeat", type=int, default=3, help="rounds per workload; the median is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", help="local Postgres for the tenants (one schema each); fakes when omitted")
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--compare", help="compare the results with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change tolerated before a regression")
+    args = parser.parse_args()
+
+    # adminUtils reports every container and users row with print; keep the tables readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(run(args))
+    backend = "local Postgres" if args.database_url else "fakes"
+    print_table(f"Tenant API workloads ({backend}, concurrency {args.concurrency})", results)
+
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changed = sorted(key for key, value in configuration(args).items()
+                         if baseline.get("config", {}).get(key) != value)
+        if changed:
+            print(f"\nwarning: baseline was recorded with different settings: {', '.join(changed)}")
+        rows, regressions = compare(baseline, results, args.tolerance)
+        print_table(f"Against {args.compare} (recorded {baseline.get('created_at')})", rows)
+        print(f"\n{regressions} regression(s) beyond {args.tolerance:.0%}")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": configuration(args),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+        print(f"\nbaseline written to {args.save}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
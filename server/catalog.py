@@ -0,0 +1,188 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Boolean, Column, Float, Integer, MetaData, String, Table
+from sqlalchemy.types import NullType
+
+from models import CHANGE_FLOOR_TABLE, CHANGE_LOG_TABLE
+from query_engine import run_query
+
+# Tenants whose catalog is kept in memory (least recently used first out)
+CATALOG_MAX_TENANTS = int(os.getenv("CATALOG_MAX_TENANTS", "1000"))
+# Seconds before a cached catalog is re-read, to pick up DDL run outside the API
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "600"))
+# A lookup for a table missing from the catalog re-reads it, at most this often per tenant
+CATALOG_MISS_RELOAD_SECONDS = float(os.getenv("CATALOG_MISS_RELOAD_SECONDS", "1"))
+
+# Tables, columns and types of the tenant's own schema, in column order
+CATALOG_QUERY = """
+SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema()
+ORDER BY c.relname, a.attnum
+"""
+
+# Statements that change the catalog when they reach a tenant through the raw SQL endpoints
+DDL_PATTERN = re.compile(r"\b(CREATE|ALTER|DROP|RENAME)\b", re.IGNORECASE)
+
+# Postgres type names mapped back to the SQLAlchemy types used by models.type_mapping
+PG_TYPE_MAPPING = {
+    "integer": Integer,
+    "bigint": Integer,
+    "smallint": Integer,
+    "character varying": String,
+    "text": String,
+    "double precision": Float,
+    "real": Float,
+    "numeric": Float,
+    "boolean": Boolean,
+}
+
+
+def is_ddl(sql_query: str) -> bool:
+    """Return True when the SQL text may create, alter or drop a table."""
+    return DDL_PATTERN.search(sql_query) is not None
+
+
+class TenantCatalog:
+    """Tables and columns of one tenant's schema, with a MetaData holding a Table per table."""
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]]):
+        self.tables = tables
+        self.loaded_at = time.monotonic()
+        self._metadata: Optional[MetaData] = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "TenantCatalog":
+        tables: Dict[str, List[Dict[str, Any]]] = {}
+        for table_name, column_name, column_type, not_null in rows:
+            columns = tables.setdefault(table_name, [])
+            if column_name:
+                columns.append({"name": column_name, "type": column_type, "nullable": not_null not in (True, "t")})
+        return cls(tables)
+
+    @property
+    def metadata(self) -> MetaData:
+        """Per-tenant MetaData, built on first use and dropped with the catalog."""
+        if self._metadata is None:
+            metadata = MetaData()
+            for table_name, columns in self.tables.items():
+                Table(table_name, metadata, *(
+                    Column(column["name"], PG_TYPE_MAPPING.get(column["type"].split("(")[0], NullType)(),
+                           nullable=column["nullable"], primary_key=column["name"] == "id")
+                    for column in columns
+                ))
+            self._metadata = metadata
+        return self._metadata
+
+    def table_names(self) -> List[str]:
+        # The change log's bookkeeping tables stay in `tables`, for changefeed.py, but are not listed
+        return sorted(table for table in self.tables if table not in (CHANGE_LOG_TABLE, CHANGE_FLOOR_TABLE))
+
+    def column_names(self, table_name: str) -> List[str]:
+        return [column["name"] for column in self.tables[table_name]]
+
+
+class CatalogCache:
+    """
+    Bounded LRU of tenant catalogs read from pg_catalog.
+
+    Catalogs are dropped by `invalidate` whenever the API runs DDL for a tenant, and expire after
+    `ttl` seconds so changes made outside the API are eventually seen.
+    """
+
+    def __init__(self, max_tenants: int = CATALOG_MAX_TENANTS, ttl: float = CATALOG_TTL_SECONDS, query=run_query):
+        self.max_tenants = max_tenants
+        self.ttl = ttl
+        self.query = query
+        self._catalogs: "OrderedDict[str, TenantCatalog]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    async def get(self, username: str) -> TenantCatalog:
+        catalog = self._catalogs.get(username)
+        if catalog is not None and time.monotonic() - catalog.loaded_at < self.ttl:
+            self._catalogs.move_to_end(username)
+            self.hits += 1
+            return catalog
+        self.misses += 1
+        return await self._load(username)
+
+    async def _load(self, username: str) -> TenantCatalog:
+        future = self._loading.get(username)
+        if future is None:
+            future = asyncio.get_running_loop().create_task(self._fetch(username))
+            self._loading[username] = future
+            future.add_done_callback(partial(self._load_done, username))
+        return await asyncio.shield(future)
+
+    def _load_done(self, username: str, future: asyncio.Future):
+        if self._loading.get(username) is future:
+            del self._loading[username]
+
+    async def _fetch(self, username: str) -> TenantCatalog:
+        result = await self.query(username, CATALOG_QUERY)
+        catalog = TenantCatalog.from_rows(result.records())
+        if self._loading.get(username) is not asyncio.current_task():
+            # Invalidated while reading: the result may predate the DDL, so do not cache it
+            return catalog
+        self._catalogs[username] = catalog
+        self._catalogs.move_to_end(username)
+        while len(self._catalogs) > self.max_tenants:
+            self._catalogs.popitem(last=False)
+            self.evictions += 1
+        return catalog
+
+    def invalidate(self, username: str):
+        """Forget a tenant's catalog after DDL; the next lookup reads pg_catalog again."""
+        self._loading.pop(username, None)
+        if self._catalogs.pop(username, None) is not None:
+            self.invalidations += 1
+
+    async def list_tables(self, username: str) -> List[str]:
+        return (await self.get(username)).table_names()
+
+    async def require_table(self, username: str, table_name: str) -> TenantCatalog:
+        """Return the tenant's catalog, raising 404 when the table does not exist."""
+        catalog = await self.get(username)
+        if table_name not in catalog.tables and time.monotonic() - catalog.loaded_at >= CATALOG_MISS_RELOAD_SECONDS:
+            # The table may have been created outside the API since the catalog was read
+            self.invalidate(username)
+            catalog = await self.get(username)
+        if table_name not in catalog.tables:
+            raise HTTPException(status_code=404, detail=f"Table '{table_name}' not found.")
+        return catalog
+
+    async def validate_columns(self, username: str, table_name: str, columns: Iterable[str]):
+        """Raise 404 for an unknown table and 400 for columns the table does not have."""
+        catalog = await self.require_table(username, table_name)
+        known = set(catalog.column_names(table_name))
+        unknown = [column for column in columns if column not in known]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown columns for table '{table_name}': {', '.join(unknown)}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "tenants": len(self._catalogs),
+            "max_tenants": self.max_tenants,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,216 @@
+import logging
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from catalog import catalog_cache
+from models import (CHANGE_FLOOR_TABLE, CHANGE_LOG_TABLE, change_tracking_statements, page_size, quote_identifier,
+                    validate_identifier)
+from query_engine import run_query
+
+# Where a table's log starts, and the oldest transaction still running: everything logged by
+# transactions below it has committed (or rolled back), so nothing can appear there later
+HORIZON_QUERY = """
+SELECT txid_snapshot_xmin(txid_current_snapshot()), f.txid, f.complete
+FROM {floor} f
+WHERE f.table_name = '{table}' AND f.relid = '{relation}'::regclass::oid
+"""
+
+
+def parse_watermark(token: str) -> Tuple[int, Optional[int]]:
+    """
+    Parse a watermark returned by the feed.
+
+    Parameters:
+    - token: "<txid>" (every change up to that transaction was read) or "<txid>:<id>" (a page
+      ended inside that transaction's changes, after the row with that id).
+
+    Returns:
+    - (txid, id or None).
+    """
+    txid, _, row_id = token.partition(":")
+    try:
+        return int(txid), int(row_id) if row_id else None
+    except ValueError:
+        raise ValueError(f"Invalid watermark: {token}")
+
+
+def changes_query(table_name: str, columns: Sequence[str], since: Tuple[int, Optional[int]], upto: int,
+                  limit: int) -> str:
+    """
+    Build the query returning the rows of a table changed after a watermark.
+
+    Log entries are folded per id onto the last transaction that touched the row and joined with
+    the table as it is now: a row that no longer exists comes back with its id, NULL columns and
+    _deleted true. Rows are ordered by (transaction, id), which is what a watermark points into.
+
+    Parameters:
+    - table_name: The tracked table.
+    - columns: The table's columns other than 'id', in the order they are returned.
+    - since: The parsed watermark.
+    - upto: Only transactions below this id are read (the horizon of HORIZON_QUERY).
+    - limit: Maximum number of rows.
+
+    Returns:
+    - The SQL text; every value is an integer and is inlined.
+    """
+    table = quote_identifier(table_name)
+    txid, row_id = int(since[0]), since[1]
+    if row_id is None:
+        window, having = f"txid > {txid}", ""
+    else:
+        window, having = f"txid >= {txid}", f" HAVING (max(txid), row_id) > ({txid}, {int(row_id)})"
+    selected = "".join(f", t.{quote_identifier(column)}" for column in columns)
+    return (f"WITH changed AS (SELECT row_id, max(txid) AS txid FROM {CHANGE_LOG_TABLE} "
+            f"WHERE table_name = '{validate_identifier(table_name)}' AND {window} AND txid < {int(upto)} "
+            f"GROUP BY row_id{having} ORDER BY 2, 1 LIMIT {int(limit)}) "
+            f"SELECT c.txid AS _change_txid, t.id IS NULL AS _deleted, c.row_id AS id{selected} "
+            f"FROM changed c LEFT JOIN {table} t ON t.id = c.row_id ORDER BY c.txid, c.row_id")
+
+
+class ChangeFeed:
+    """
+    Incremental export of tenant tables from the trigger-maintained change log (see
+    models.CHANGE_TRACKING_SETUP).
+
+    A read returns the rows changed since a watermark, in their current state, and the watermark
+    to send next time, so a refresh costs what changed rather than the whole table. Watermarks are
+    transaction ids, and a read stops below the oldest transaction still running; a long open
+    transaction therefore holds the feed back until it ends, but its changes are never skipped.
+    """
+
+    def __init__(self, query=run_query, catalog=catalog_cache):
+        self.query = query
+        self.catalog = catalog
+        self.reads = 0
+        self.rows = 0
+        self.refreshes_required = 0
+        self.pruned = 0
+
+    async def _columns(self, username: str, table_name: str):
+        try:
+            validate_identifier(table_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        catalog = await self.catalog.require_table(username, table_name)
+        if CHANGE_FLOOR_TABLE not in catalog.tables:
+            raise HTTPException(status_code=409, detail=f"Change tracking is not enabled for table '{table_name}'.")
+        return [column for column in catalog.column_names(table_name) if column != "id"]
+
+    async def _horizon(self, username: str, table_name: str) -> Tuple[int, int, bool]:
+        result = await self.query(username, HORIZON_QUERY.format(
+            floor=CHANGE_FLOOR_TABLE, table=table_name, relation=quote_identifier(table_name)))
+        if result.text is not None:
+            raise HTTPException(status_code=400, detail="Change feeds require QUERY_ENGINE_MODE=pool.")
+        if not result.rows:
+            # Never tracked, or dropped and re-created without tracking
+            raise HTTPException(status_code=409, detail=f"Change tracking is not enabled for table '{table_name}'.")
+        return result.rows[0]
+
+    def _refresh_required(self, table_name: str, horizon: int, reason: str):
+        self.refreshes_required += 1
+        raise HTTPException(status_code=410, detail={
+            "message": f"{reason} Read {table_name} in full, then ask for changes since the watermark.",
+            # Taken before the full read, so changes that land during it are sent again rather than lost
+            "watermark": str(horizon - 1),
+        })
+
+    async def read(self, username: str, table_name: str, since: Optional[str] = None,
+                   limit: Optional[int] = None):
+        """
+        Read the rows of a table changed since a watermark.
+
+        Parameters:
+        - username: The tenant.
+        - table_name: The tracked table.
+        - since: A watermark from an earlier read; omitted, the whole log is replayed when it
+          covers the table since it was empty.
+        - limit: Maximum number of rows (models.page_size).
+
+        Returns:
+        - (result, watermark, has_more): a query_engine.QueryResult of _change_txid, _deleted, id
+          and the table's columns, the watermark for the next read, and whether the limit cut
+          the changes short. A 410 carrying a watermark asks for a full read first.
+        """
+        columns = await self._columns(username, table_name)
+        try:
+            position = parse_watermark(since) if since is not None else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        horizon, floor, complete = await self._horizon(username, table_name)
+        if position is None:
+            if not complete:
+                self._refresh_required(table_name, horizon, "The change log does not reach back to an empty table.")
+            position = (floor - 1, None)
+        elif position[0] < floor - 1:
+            self._refresh_required(table_name, horizon, "The watermark predates the change log (truncated or pruned).")
+        size = page_size(limit)
+        result = await self.query(username, changes_query(table_name, columns, position, horizon, size))
+        self.reads += 1
+        self.rows += len(result.rows)
+        if len(result.rows) == size:
+            last = result.rows[-1]
+            return result, f"{last[0]}:{last[2]}", True
+        # Every change below the horizon has been read
+        return result, str(max(horizon - 1, position[0])), False
+
+    async def enable(self, username: str, table_name: str) -> Dict[str, Any]:
+        """
+        Start tracking a table that was not created through the API (or predates change tracking).
+
+        Returns:
+        - Whether the log covers the table from empty; when it does not, the first read asks for
+          a full read.
+        """
+        try:
+            script = ";\n".join(change_tracking_statements(table_name))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await self.catalog.require_table(username, table_name)
+        try:
+            await self.query(username, script)
+        finally:
+            self.catalog.invalidate(username)
+        _, _, complete = await self._horizon(username, table_name)
+        logging.info(f"Change tracking enabled for {username}.{table_name}")
+        return {"table": table_name, "complete": complete}
+
+    async def prune(self, username: str, table_name: str, through: str) -> int:
+        """
+        Drop log entries once every consumer has read past them.
+
+        Parameters:
+        - username: The tenant.
+        - table_name: The tracked table.
+        - through: A watermark; entries of the transactions it covers in full are deleted.
+
+        Returns:
+        - The number of log entries deleted. Reads from older watermarks then get a 410.
+        """
+        await self._columns(username, table_name)
+        try:
+            txid, row_id = parse_watermark(through)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if row_id is not None:
+            # The watermark's own transaction has not been read in full
+            txid -= 1
+        # Raise the floor first, so a read between the two statements cannot miss a deleted row
+        await self.query(username, f"UPDATE {CHANGE_FLOOR_TABLE} SET txid = GREATEST(txid, {txid + 1}), "
+                                   f"complete = FALSE WHERE table_name = '{table_name}'")
+        result = await self.query(username, f"DELETE FROM {CHANGE_LOG_TABLE} "
+                                            f"WHERE table_name = '{table_name}' AND txid <= {txid}")
+        deleted = max(result.rowcount, 0)
+        self.pruned += deleted
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "reads": self.reads,
+            "rows": self.rows,
+            "refreshes_required": self.refreshes_required,
+            "pruned": self.pruned,
+        }
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, Optional
+
+import docker
+from fastapi import HTTPException
+
+from adminUtils import (NETWORK_NAME, POSTGRES_IMAGE, create_postgresql_container, ensure_network, get_docker_client,
+                        port_allocator, published_port, run_postgres_container)
+from executors import run_blocking
+from metrics import container_lifecycle
+from models import quote_identifier, validate_identifier
+from ports import PortAllocator
+from schemas import UserCreate
+
+# Number of pre-started, unassigned Postgres containers kept ready for /register (0 disables the pool)
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "2"))
+# Seconds a new warm container may take to accept connections before it is discarded
+WARM_POOL_READY_TIMEOUT = float(os.getenv("WARM_POOL_READY_TIMEOUT", "60"))
+
+WARM_CONTAINER_PREFIX = "postgres_warm_"
+WARM_POOL_LABEL = "multi-tenant.pool"
+
+
+def quote_literal(value: str) -> str:
+    """Quote a string as a SQL literal for statements run through psql."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+async def wait_until_ready(container, timeout: float):
+    """Poll pg_isready inside a container with exponential backoff until Postgres accepts connections."""
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    while True:
+        result = await run_blocking(container.exec_run, ["pg_isready", "-U", "postgres", "-h", "127.0.0.1"])
+        if result.exit_code == 0:
+            return
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Container {container.name} not ready after {timeout}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 2.0)
+
+
+class WarmContainerPool:
+    """
+    Keep pre-started Postgres containers ready so registration does not wait for initdb and boot.
+
+    Warm containers run with only the `postgres` superuser. Claiming one creates the tenant role
+    and database inside it and renames the container to postgres_{username}; a background task
+    refills the pool back to `size`. Docker labels cannot be changed after creation, so an
+    assigned container is recognised by its name, and the users table records the assignment.
+    """
+
+    def __init__(self, size: int = WARM_POOL_SIZE, docker_client=None, ready_timeout: float = WARM_POOL_READY_TIMEOUT,
+                 image: str = POSTGRES_IMAGE, network_name: str = NETWORK_NAME, ports: PortAllocator = None):
+        self.size = size
+        self.ready_timeout = ready_timeout
+        self.image = image
+        self.network_name = network_name
+        self._client = docker_client
+        self.ports = ports or port_allocator
+        self._ready = deque()
+        self._creating = 0
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.claims = 0
+        self.misses = 0
+        self.created = 0
+        self.failures = 0
+        self._claim_latencies = deque(maxlen=1000)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_docker_client()
+        return self._client
+
+    @property
+    def depth(self) -> int:
+        return len(self._ready)
+
+    async def start(self):
+        """Adopt warm containers left by a previous run and start the refill task."""
+        if self.size <= 0:
+            return
+        self._refill_needed = asyncio.Event()
+        await run_blocking(self._adopt_existing)
+        self._task = asyncio.get_running_loop().create_task(self._refill_loop())
+        self._refill_needed.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _adopt_existing(self):
+        containers = self.client.containers.list(all=True, filters={"label": f"{WARM_POOL_LABEL}=warm"})
+        for container in containers:
+            if not container.name.startswith(WARM_CONTAINER_PREFIX):
+                continue
+            if container.status != "running":
+                container.remove(force=True)
+                self.ports.release(container.name)
+                continue
+            self._ready.append(container)
+        if self._ready:
+            logging.info(f"Adopted {len(self._ready)} warm Postgres containers")
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            while self.depth + self._creating < self.size:
+                self._creating += 1
+                try:
+                    container = await run_blocking(self._create_warm_container)
+                    await self._wait_ready(container)
+                    self._ready.append(container)
+                    self.created += 1
+                except Exception as e:
+                    self.failures += 1
+                    logging.error(f"Failed to start warm Postgres container: {e}")
+                    # Back off instead of hammering a failing Docker daemon
+                    await asyncio.sleep(5)
+                finally:
+                    self._creating -= 1
+
+    def _create_warm_container(self):
+        ensure_network(self.client, self.network_name)
+        container, _ = run_postgres_container(
+            self.client,
+            f"{WARM_CONTAINER_PREFIX}{uuid.uuid4().hex[:12]}",
+            environment={"POSTGRES_PASSWORD": secrets.token_urlsafe(24)},
+            labels={WARM_POOL_LABEL: "warm"},
+            ports=self.ports,
+        )
+        return container
+
+    def _discard(self, container):
+        container.remove(force=True)
+        self.ports.release(container.name)
+
+    async def _wait_ready(self, container):
+        try:
+            await wait_until_ready(container, self.ready_timeout)
+        except TimeoutError:
+            await run_blocking(self._discard, container)
+            raise
+
+    def _assign(self, container, user: UserCreate):
+        """Create the tenant role and database inside a warm container and rename it for the tenant."""
+        username = user.username
+        # Quoted so the role and database keep the username's case, which is what the tenant logs in with
+        identifier = quote_identifier(username)
+        statements = [
+            f"CREATE ROLE {identifier} LOGIN PASSWORD {quote_literal(user.password)}",
+            f"CREATE DATABASE {identifier} OWNER {identifier}",
+        ]
+        for statement in statements:
+            result = container.exec_run(["psql", "-U", "postgres", "-v", "ON_ERROR_STOP=1", "-c", statement])
+            if result.exit_code != 0:
+                raise RuntimeError(result.output.decode('utf-8'))
+        container_name = f"postgres_{username}"
+        warm_name = container.name
+        container.rename(container_name)
+        self.ports.rename(warm_name, container_name)
+        container.reload()
+        return container, container_name, published_port(container)
+
+    async def claim(self, user: UserCreate):
+        """
+        Assign a warm container to a new user, falling back to a cold start when the pool is empty.
+
+        Returns:
+        - (container, container_hostname, port), like adminUtils.create_postgresql_container.
+        """
+        try:
+            validate_identifier(user.username)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        start = time.perf_counter()
+        try:
+            while self._ready:
+                container = self._ready.popleft()
+                try:
+                    assigned = await run_blocking(self._assign, container, user)
+                    self.claims += 1
+                    container_lifecycle.observe(time.perf_counter() - start, "warm_claim")
+                    return assigned
+                except Exception as e:
+                    self.failures += 1
+                    logging.error(f"Failed to claim warm container {container.name}: {e}")
+                    await run_blocking(self._discard, container)
+            self.misses += 1
+            with container_lifecycle.time("cold_start"):
+                return await run_blocking(create_postgresql_container, user, self.client, self.ports)
+        finally:
+            self._claim_latencies.append(time.perf_counter() - start)
+            if self._refill_needed is not None:
+                self._refill_needed.set()
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._claim_latencies)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 3) if latencies else None
+
+        return {
+            "target_size": self.size,
+            "depth": self.depth,
+            "starting": self._creating,
+            "claims": self.claims,
+            "misses": self.misses,
+            "created": self.created,
+            "failures": self.failures,
+            "claim_latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99)},
+        }
+
+
+warm_pool = WarmContainerPool()
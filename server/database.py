@@ -1,45 +1,281 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.exc import SQLAlchemyError
-from typing import Dict
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import asyncio
 import logging
-from functools import lru_cache
+import os
+import threading
+import time
+
+from profiler import QueryProfiler, query_profiler
 
 logging.basicConfig(level=logging.INFO)
 
-# Dictionary to hold session makers for different users
-DATABASE_SESSIONS: Dict[str, sessionmaker] = {}
-
-@lru_cache(maxsize=100)  # Cache up to 100 sessions
-def get_session(username: str, database_url: str):
-    """Retrieve a session maker from the cache, creating it if necessary."""
-    try:
-        engine = create_engine(database_url)
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        # Test the connection
-        with SessionLocal() as session:
-            session.execute(text("SELECT 1"))
-        return SessionLocal
-    except SQLAlchemyError as e:
-        logging.error(f"Failed to create session for user {username} with URL {database_url}: {str(e)}")
-        raise
-
-# Assuming DATABASE_POOLS also stores the database URL
-DATABASE_POOLS: Dict[str, dict] = {}
-
-def add_database(username: str, database_url: str):
-    """Add a new connection pool and session maker to the DATABASE_POOLS dictionary for a given username."""
-    try:
-        engine = create_engine(database_url, pool_size=10, max_overflow=20)  # Adjust pool_size and max_overflow as needed
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        # Test the connection
-        with SessionLocal() as session:
-            session.execute(text("SELECT 1"))
-        DATABASE_POOLS[username] = {
-            "session_local": SessionLocal,
-            "database_url": database_url
-        }
-        logging.info(f"Database pool added for user {username} with URL: {database_url}")
-    except SQLAlchemyError as e:
-        logging.error(f"Failed to add database pool for user {username} with URL {database_url}: {str(e)}")
-        raise
+# Global budget of Postgres connections the registry may hold open across all tenants
+TENANT_POOL_MAX_CONNECTIONS = int(os.getenv("TENANT_POOL_MAX_CONNECTIONS", "500"))
+# Tenant engines unused for this many seconds are disposed
+TENANT_POOL_IDLE_SECONDS = float(os.getenv("TENANT_POOL_IDLE_SECONDS", "300"))
+TENANT_POOL_MIN_SIZE = int(os.getenv("TENANT_POOL_MIN_SIZE", "1"))
+TENANT_POOL_MAX_SIZE = int(os.getenv("TENANT_POOL_MAX_SIZE", "10"))
+# Window over which peak concurrent checkouts are measured to resize a tenant pool
+TENANT_POOL_LOAD_WINDOW = float(os.getenv("TENANT_POOL_LOAD_WINDOW", "60"))
+# statement_timeout set on every tenant connection, so one runaway query cannot hold a slot forever (0 disables)
+TENANT_STATEMENT_TIMEOUT_MS = int(os.getenv("TENANT_STATEMENT_TIMEOUT_MS", "30000"))
+
+
+class _PoolEntry:
+    """A tenant engine plus the bookkeeping the registry uses to size and evict it."""
+
+    def __init__(self, engine: AsyncEngine, database_url: Any, pool_size: int):
+        self.engine = engine
+        self.database_url = database_url
+        self.pool_size = pool_size
+        self.session_local = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.window_start = self.last_used
+
+    @property
+    def reserved(self) -> int:
+        # pool_size persistent connections plus the same number of overflow connections
+        return self.pool_size * 2
+
+
+class TenantPoolRegistry:
+    """
+    Bounded registry of per-tenant async engines.
+
+    Engines are kept in LRU order and evicted (and disposed) when the global connection
+    budget would be exceeded or when they have been idle for longer than `idle_seconds`.
+    Each tenant's pool size follows its peak concurrent checkouts over the last load window.
+    """
+
+    def __init__(self, max_connections: int = TENANT_POOL_MAX_CONNECTIONS,
+                 idle_seconds: float = TENANT_POOL_IDLE_SECONDS,
+                 min_pool_size: int = TENANT_POOL_MIN_SIZE,
+                 max_pool_size: int = TENANT_POOL_MAX_SIZE,
+                 load_window: float = TENANT_POOL_LOAD_WINDOW,
+                 statement_timeout_ms: int = TENANT_STATEMENT_TIMEOUT_MS,
+                 engine_factory: Callable[..., AsyncEngine] = create_async_engine,
+                 profiler: QueryProfiler = query_profiler):
+        self.max_connections = max_connections
+        self.idle_seconds = idle_seconds
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max_pool_size
+        self.load_window = load_window
+        self.statement_timeout_ms = statement_timeout_ms
+        self.engine_factory = engine_factory
+        self.profiler = profiler
+        self._entries: "OrderedDict[Hashable, _PoolEntry]" = OrderedDict()
+        # Last observed pool size per tenant, so a re-created engine starts at its previous size
+        self._size_hints: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resizes = 0
+        # Dispose coroutines scheduled on the event loop, kept referenced until they finish
+        self._pending_disposals = set()
+
+    def _create_entry(self, key: Hashable, database_url: Any, pool_size: int) -> _PoolEntry:
+        options = {}
+        if self.statement_timeout_ms > 0:
+            # Sent with the startup packet, so it is the session default of every connection. A SET run
+            # through the asyncpg adapter's cursor would open the connection's first transaction, and
+            # its rollback (reset-on-return, a failed first query) would undo the timeout.
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(int(self.statement_timeout_ms))}}
+        engine = self.engine_factory(database_url, pool_size=pool_size, max_overflow=pool_size,
+                                     pool_recycle=1800, **options)
+        entry = _PoolEntry(engine, database_url, pool_size)
+        # Pool events are emitted by the synchronous engine behind an AsyncEngine
+        pool_target = getattr(engine, "sync_engine", engine)
+
+        @event.listens_for(pool_target, "checkout")
+        def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+            entry.in_use += 1
+            entry.peak_in_use = max(entry.peak_in_use, entry.in_use)
+
+        @event.listens_for(pool_target, "checkin")
+        def _on_checkin(dbapi_conn, conn_record):
+            entry.in_use = max(0, entry.in_use - 1)
+
+        # Pool keys end with the username (query_engine.get_tenant_key); add_database uses the bare username
+        self.profiler.attach(engine, key[-1] if isinstance(key, tuple) else str(key))
+        logging.info(f"Tenant pool created for {key} with pool_size={pool_size}")
+        return entry
+
+    def _desired_size(self, entry: _PoolEntry) -> int:
+        # Keep one connection of headroom above the observed peak
+        return min(self.max_pool_size, max(self.min_pool_size, entry.peak_in_use + 1))
+
+    def _make_room(self, needed: int, keep: Optional[Hashable] = None) -> List[_PoolEntry]:
+        """Pop LRU entries until `needed` more connections fit in the budget. Caller holds the lock."""
+        evicted = []
+        reserved = sum(entry.reserved for entry in self._entries.values())
+        for key in list(self._entries.keys()):
+            if reserved + needed <= self.max_connections:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            reserved -= entry.reserved
+            evicted.append(entry)
+            self.evictions += 1
+        return evicted
+
+    def _maybe_resize(self, key: Hashable, entry: _PoolEntry, now: float) -> List[_PoolEntry]:
+        """Replace the engine when its load window shows it is over- or under-sized. Caller holds the lock."""
+        # Re-evaluate once per load window, or early when the pool is spilling into overflow
+        if now - entry.window_start < self.load_window and entry.peak_in_use <= entry.pool_size:
+            return []
+        desired = self._desired_size(entry)
+        entry.window_start = now
+        entry.peak_in_use = entry.in_use
+        if desired == entry.pool_size:
+            return []
+        # Connections still checked out from the old engine are closed when they are returned
+        disposed = self._make_room((desired - entry.pool_size) * 2, keep=key)
+        replacement = self._create_entry(key, entry.database_url, desired)
+        self._entries[key] = replacement
+        self._size_hints[key] = desired
+        self.resizes += 1
+        disposed.append(entry)
+        return disposed
+
+    async def _dispose_engine(self, engine: AsyncEngine):
+        try:
+            await engine.dispose()
+        except (SQLAlchemyError, OSError) as e:
+            logging.error(f"Failed to dispose tenant pool: {str(e)}")
+
+    def _dispose(self, entries: List[_PoolEntry]):
+        """Schedule disposal of evicted engines without blocking the caller."""
+        if not entries:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        for entry in entries:
+            if loop is None:
+                asyncio.run(self._dispose_engine(entry.engine))
+                continue
+            task = loop.create_task(self._dispose_engine(entry.engine))
+            self._pending_disposals.add(task)
+            task.add_done_callback(self._pending_disposals.discard)
+
+    def _get_entry(self, key: Hashable, database_url: Any) -> _PoolEntry:
+        now = time.monotonic()
+        disposed = []
+        with self._lock:
+            if now - self._last_sweep >= min(self.idle_seconds, 30):
+                disposed.extend(self._pop_idle(now))
+            entry = self._entries.get(key)
+            if entry is not None and entry.database_url != database_url:
+                # Tenant moved to a new endpoint or credentials; drop the stale engine
+                disposed.append(self._entries.pop(key))
+                entry = None
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                disposed.extend(self._maybe_resize(key, entry, now))
+                entry = self._entries[key]
+            else:
+                self.misses += 1
+                pool_size = self._size_hints.get(key, self.min_pool_size)
+                disposed.extend(self._make_room(pool_size * 2))
+                entry = self._create_entry(key, database_url, pool_size)
+                self._entries[key] = entry
+                self._size_hints[key] = pool_size
+                self._size_hints.move_to_end(key)
+                while len(self._size_hints) > max(1000, len(self._entries)):
+                    self._size_hints.popitem(last=False)
+            entry.last_used = now
+        self._dispose(disposed)
+        return entry
+
+    def get_engine(self, key: Hashable, database_url: Any) -> AsyncEngine:
+        """Return the pooled engine for a tenant, creating it (without a probe query) on a miss."""
+        return self._get_entry(key, database_url).engine
+
+    def get_sessionmaker(self, key: Hashable, database_url: Any) -> async_sessionmaker:
+        """Return the session maker bound to a tenant's pooled engine."""
+        return self._get_entry(key, database_url).session_local
+
+    def _pop_idle(self, now: float) -> List[_PoolEntry]:
+        """Remove entries idle past the threshold. Caller holds the lock."""
+        self._last_sweep = now
+        idle = [key for key, entry in self._entries.items()
+                if now - entry.last_used >= self.idle_seconds and not entry.in_use]
+        self.evictions += len(idle)
+        return [self._entries.pop(key) for key in idle]
+
+    def evict_idle(self) -> int:
+        """Dispose every tenant engine that has been idle past the threshold."""
+        with self._lock:
+            idle = self._pop_idle(time.monotonic())
+        self._dispose(idle)
+        return len(idle)
+
+    def evict(self, key: Hashable) -> bool:
+        """Dispose a tenant's engine, e.g. when the tenant is deleted or moved."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.evictions += 1
+        if entry is None:
+            return False
+        self._dispose([entry])
+        return True
+
+    def evict_matching(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Dispose every tenant engine whose key matches, e.g. all pools of a hibernated tenant."""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            entries = [self._entries.pop(key) for key in keys]
+            self.evictions += len(entries)
+        self._dispose(entries)
+        return len(entries)
+
+    async def dispose_all(self):
+        """Dispose every tenant engine, used on application shutdown."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        await asyncio.gather(*(self._dispose_engine(entry.engine) for entry in entries), *self._pending_disposals)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and current occupancy of the registry."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "engines": len(self._entries),
+                "reserved_connections": sum(entry.reserved for entry in self._entries.values()),
+                "connections_in_use": sum(entry.in_use for entry in self._entries.values()),
+                "max_connections": self.max_connections,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "resizes": self.resizes,
+            }
+
+
+tenant_pools = TenantPoolRegistry()
+
+def get_tenant_engine(key: Hashable, database_url: Any) -> AsyncEngine:
+    """Return the pooled engine for a tenant endpoint, creating it on first use."""
+    return tenant_pools.get_engine(key, database_url)
+
+def get_session(key: Hashable, database_url: Any) -> async_sessionmaker:
+    """Retrieve a session maker for a tenant's database from the tenant pool registry."""
+    return tenant_pools.get_sessionmaker(key, database_url)
+
+def add_database(username: str, database_url: Any):
+    """Register a user's database in the tenant pool registry so later lookups are hits."""
+    tenant_pools.get_engine(username, database_url)
+    logging.info(f"Database pool added for user {username}")
@@ -1,54 +1,69 @@
 from fastapi import FastAPI, HTTPException, Request
-import docker
+from typing import Optional
+from models import full_scan_query, keyset_page_query, page_size
+from query_engine import run_query, stream_query
+from catalog import catalog_cache, is_ddl
+from serialization import JSON_LAYOUTS, TypedJSONResponse, stream_response
+from result_cache import cached_json_response, result_cache
+from batch import plan_batch, run_batch
+from schemas import BatchRequest, IndexApplyRequest
+from advisor import index_advisor
+from changefeed import change_feed
+from metrics import instrument
 
-app = FastAPI()
+app = FastAPI(default_response_class=TypedJSONResponse)
+instrument(app, "db")
 
-# Helper function to get Docker container
-def get_docker_container(username: str):
-    container_name = f"postgres_{username}"
-    client = docker.from_env()
-    try:
-        return client.containers.get(container_name)
-    except docker.errors.NotFound:
-        raise HTTPException(status_code=404, detail=f"Container {container_name} not found.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
-
-# Helper function to execute SQL queries
-def execute_sql(container, sql_query: str, username: str, db_name: str):
+# Helper function to execute SQL queries over the tenant query engine (pooled, or psql exec fallback)
+async def execute_sql(sql_query: str, username: str):
+    return await run_query(username, sql_query)
+
+# Helper function for statements that write: cached reads of the table (of the whole tenant for raw SQL
+# that may touch any table) are dropped afterwards, and the cached catalog too for DDL
+async def execute_write(sql_query: str, username: str, table_name: Optional[str] = None, ddl: bool = False):
     try:
-        exec_result = container.exec_run(f"psql -U {username} -d {db_name} -c \"{sql_query}\"")
-        if exec_result.exit_code == 0:
-            return exec_result.output.decode('utf-8')
+        return await execute_sql(sql_query, username)
+    finally:
+        if table_name is not None:
+            result_cache.invalidate_table(username, table_name)
         else:
-            raise HTTPException(status_code=400, detail=exec_result.output.decode('utf-8'))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+            result_cache.invalidate_tenant(username)
+        if ddl:
+            catalog_cache.invalidate(username)
 
 # Endpoint to list all tables
 @app.get("/users/{username}/tables")
 async def list_tables(username: str):
-    container = get_docker_container(username)
-    sql_query = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_type = 'BASE TABLE';"
-    result = execute_sql(container, sql_query, username, username)
-
-    # Process the result to return only the table names, excluding "table_name" and "(x rows)"
-    lines = result.split('\n')
-    table_names = [line.strip() for line in lines if line.strip() and not line.startswith('table_name') and not line.startswith('-') and not line.endswith('rows)')]
-
-    # Remove the "table_name" header if it exists
-    if "table_name" in table_names:
-        table_names.remove("table_name")
+    # Served from the tenant's cached catalog; DDL endpoints invalidate it
+    table_names = await catalog_cache.list_tables(username)
 
     return {"message": "Tables retrieved successfully.", "tables": table_names}
 
 # Endpoint to get data from a specific table
 @app.get("/users/{username}/tables/{table_name}")
-async def get_table_data(username: str, table_name: str):
-    container = get_docker_container(username)
-    sql_query = f"SELECT * FROM {table_name};"
-    result = execute_sql(container, sql_query, username, username)
-    return {"message": f"Data from {table_name} retrieved successfully.", "data": result}
+async def get_table_data(request: Request, username: str, table_name: str, limit: Optional[int] = None,
+                         after_id: Optional[int] = None, format: Optional[str] = None, layout: str = "objects"):
+    try:
+        if format is not None:
+            # Stream the whole table (NDJSON, CSV, Arrow IPC or Parquet) from a server-side cursor
+            return await stream_response(await stream_query(username, full_scan_query(table_name)), format)
+        sql_query = keyset_page_query(table_name, limit, after_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if layout not in JSON_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported JSON layout: {layout}")
+
+    async def read_page():
+        result = await execute_sql(sql_query, username)
+        data = result.to_response(layout)
+        # Cursor for the next page: the last id returned, when the page came back full
+        next_after_id = None
+        if result.text is None and "id" in result.columns and len(result.rows) == page_size(limit):
+            next_after_id = result.rows[-1][result.columns.index("id")]
+        return {"message": f"Data from {table_name} retrieved successfully.", "data": data, "next_after_id": next_after_id}
+
+    # Encoded once and served from the result cache until a write through the API touches the table
+    return await cached_json_response(request, username, table_name, ("page", limit, after_id, layout), read_page)
 
 # Endpoint to create a new table
 @app.post("/users/{username}/tables")
@@ -58,17 +73,15 @@ async def create_table(username: str, request: Request):
     if not sql_query:
         raise HTTPException(status_code=400, detail="SQL query for table creation is required.")
     
-    container = get_docker_container(username)
-    result = execute_sql(container, sql_query, username, username)
-    return {"message": "Table created successfully.", "result": result}
+    result = await execute_write(sql_query, username, ddl=True)
+    return {"message": "Table created successfully.", "result": result.to_response()}
 
 # Endpoint to delete a table
 @app.delete("/users/{username}/tables/{table_name}")
 async def delete_table(username: str, table_name: str):
-    container = get_docker_container(username)
     sql_query = f"DROP TABLE IF EXISTS {table_name};"
-    result = execute_sql(container, sql_query, username, username)
-    return {"message": f"Table {table_name} deleted successfully.", "result": result}
+    result = await execute_write(sql_query, username, table_name, ddl=True)
+    return {"message": f"Table {table_name} deleted successfully.", "result": result.to_response()}
 
 # Endpoint to update data in a table
 @app.put("/users/{username}/tables/{table_name}")
@@ -78,9 +91,8 @@ async def update_table_data(username: str, table_name: str, request: Request):
     if not sql_query:
         raise HTTPException(status_code=400, detail="SQL query for updating table data is required.")
     
-    container = get_docker_container(username)
-    result = execute_sql(container, sql_query, username, username)
-    return {"message": f"Table {table_name} updated successfully.", "result": result}
+    result = await execute_write(sql_query, username, ddl=is_ddl(sql_query))
+    return {"message": f"Table {table_name} updated successfully.", "result": result.to_response()}
 
 # Endpoint to modify table structure (add/remove columns, change data type, add constraints, etc.)
 @app.patch("/users/{username}/tables/{table_name}/structure")
@@ -90,14 +102,85 @@ async def modify_table_structure(username: str, table_name: str, request: Reques
     if not sql_query:
         raise HTTPException(status_code=400, detail="SQL query for modifying table structure is required.")
     
-    container = get_docker_container(username)
-    result = execute_sql(container, sql_query, username, username)
-    return {"message": f"Table {table_name} structure modified successfully.", "result": result}
+    result = await execute_write(sql_query, username, ddl=True)
+    return {"message": f"Table {table_name} structure modified successfully.", "result": result.to_response()}
 
 # Endpoint to drop a table (for completeness, same as delete but often used in different contexts)
 @app.delete("/users/{username}/tables/{table_name}/drop")
 async def drop_table(username: str, table_name: str):
-    container = get_docker_container(username)
     sql_query = f"DROP TABLE IF EXISTS {table_name};"
-    result = execute_sql(container, sql_query, username, username)
-    return {"message": f"Table {table_name} dropped successfully.", "result": result}
+    result = await execute_write(sql_query, username, table_name, ddl=True)
+    return {"message": f"Table {table_name} dropped successfully.", "result": result.to_response()}
+
+# Endpoint to run an ordered list of operations in one transaction on one pooled connection
+@app.post("/users/{username}/batch")
+async def run_batch_endpoint(username: str, batch: BatchRequest):
+    try:
+        steps = plan_batch(batch.operations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        outcome = await run_batch(username, steps, on_error=batch.on_error, pipeline=batch.pipeline)
+    finally:
+        # Raw SQL may touch any table; typed operations name theirs
+        if any(step.op == "sql" for step in steps):
+            result_cache.invalidate_tenant(username)
+        else:
+            for table_name in {step.table_name for step in steps}:
+                result_cache.invalidate_table(username, table_name)
+        if any(step.ddl for step in steps):
+            catalog_cache.invalidate(username)
+    return {"message": "Batch executed successfully.", **outcome}
+
+# Endpoint to recommend indexes from the tenant's profiled queries and table scan statistics
+@app.get("/users/{username}/indexes/advice")
+async def index_advice(username: str, top: int = 500):
+    return await index_advisor.recommend(username, top)
+
+# Endpoint to build indexes with CREATE INDEX CONCURRENTLY (the advisor's recommendations when none are given)
+@app.post("/users/{username}/indexes")
+async def apply_indexes(username: str, request: IndexApplyRequest):
+    if request.indexes is not None:
+        specs = [(spec.table_name, spec.columns) for spec in request.indexes]
+    else:
+        advice = await index_advisor.recommend(username)
+        specs = [(recommendation["table"], recommendation["columns"]) for recommendation in advice["recommendations"]]
+    created, failed = [], []
+    # One at a time: concurrent builds on one table wait for each other anyway
+    for table_name, columns in specs:
+        try:
+            created.append(await index_advisor.create_index(username, table_name, columns))
+        except HTTPException as e:
+            failed.append({"table": table_name, "columns": columns, "error": e.detail})
+    return {"message": f"{len(created)} indexes created, {len(failed)} failed.", "created": created, "failed": failed}
+
+# Endpoint to read the rows of a table changed since a watermark, for incremental refreshes
+@app.get("/users/{username}/tables/{table_name}/changes")
+async def get_table_changes(username: str, table_name: str, since: Optional[str] = None, limit: Optional[int] = None,
+                            format: Optional[str] = None, layout: str = "columns"):
+    if layout not in JSON_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported JSON layout: {layout}")
+    result, watermark, has_more = await change_feed.read(username, table_name, since, limit)
+    if format is not None:
+        async def batches():
+            yield result.columns, result.rows
+
+        # Arrow and Parquet bodies have nowhere else to carry the cursor
+        response = await stream_response(batches(), format)
+        response.headers["X-Watermark"] = watermark
+        response.headers["X-Has-More"] = "true" if has_more else "false"
+        return response
+    return {"message": f"Changes to {table_name} retrieved successfully.", "data": result.to_response(layout),
+            "watermark": watermark, "has_more": has_more}
+
+# Endpoint to start tracking changes of a table created outside the API
+@app.post("/users/{username}/tables/{table_name}/changes")
+async def enable_table_changes(username: str, table_name: str):
+    tracking = await change_feed.enable(username, table_name)
+    return {"message": f"Change tracking enabled for {table_name}.", **tracking}
+
+# Endpoint to delete change log entries every consumer has read
+@app.delete("/users/{username}/tables/{table_name}/changes")
+async def prune_table_changes(username: str, table_name: str, through: str):
+    deleted = await change_feed.prune(username, table_name, through)
+    return {"message": f"{deleted} change log entries of {table_name} deleted.", "deleted": deleted}
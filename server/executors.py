@@ -0,0 +1,14 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Bounded pool for calls that would block the event loop (Docker SDK, main-database lookups)
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "16"))
+
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call in the bounded thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, partial(fn, *args, **kwargs))
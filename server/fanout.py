@@ -0,0 +1,420 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import Counter
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from adminUtils import load_user_endpoints
+from catalog import CATALOG_QUERY
+from executors import run_blocking
+from hibernation import hibernation as default_hibernation
+from models import CHANGE_FLOOR_TABLE, CHANGE_LOG_TABLE
+from query_engine import is_script, query_backend
+from serialization import dumps
+
+# Tenants queried at once by one fan-out, and the longest a single tenant may take
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "32"))
+FANOUT_TENANT_TIMEOUT = float(os.getenv("FANOUT_TENANT_TIMEOUT", "10"))
+# Rows kept per tenant; the rest of a tenant's result is dropped and the tenant marked truncated
+FANOUT_MAX_ROWS_PER_TENANT = int(os.getenv("FANOUT_MAX_ROWS_PER_TENANT", "1000"))
+# Tenant names listed per schema drift finding (the counts are always complete)
+FANOUT_MAX_LISTED_TENANTS = 50
+
+# Catalog probes runnable by name, so the common operational questions need no SQL
+PROBES = {
+    # Estimated live rows per table, from the statistics collector (no table is scanned)
+    "row_counts": """
+SELECT relname AS table_name, n_live_tup AS row_estimate
+FROM pg_catalog.pg_stat_user_tables
+WHERE schemaname = current_schema()
+""",
+    # On-disk size of every table with its indexes and TOAST data
+    "table_sizes": """
+SELECT c.relname AS table_name, pg_total_relation_size(c.oid) AS total_bytes
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema()
+""",
+    "database_size": "SELECT pg_database_size(current_database()) AS total_bytes",
+    "connections": """
+SELECT COALESCE(state, 'background') AS state, count(*) AS connections
+FROM pg_catalog.pg_stat_activity
+WHERE datname = current_database()
+GROUP BY 1
+""",
+    "server_version": "SELECT current_setting('server_version') AS server_version",
+    # Columns of every table, as the catalog cache reads them; aggregate=drift compares tenants
+    "schema": CATALOG_QUERY,
+}
+
+AGGREGATES = ("sum", "min", "max", "avg", "drift")
+
+# Statements a fan-out may run; pooled tenants additionally run them in a READ ONLY transaction
+READ_ONLY_PATTERN = re.compile(r"^\s*(?:SELECT|WITH|VALUES|TABLE|SHOW|EXPLAIN)\b", re.IGNORECASE)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _psql_table(text: str) -> Tuple[List[str], List[tuple]]:
+    # psql's aligned output: a header line, a rule, the rows and a "(n rows)" footer
+    lines = [line for line in text.split("\n") if line.strip()]
+    if not lines:
+        return [], []
+    columns = [cell.strip() for cell in lines[0].split("|")]
+    body = [line for line in lines[1:] if not line.startswith("-") and not line.endswith(("rows)", "row)"))]
+    return columns, [tuple(cell.strip() for cell in line.split("|")) for line in body]
+
+
+def merge_results(results: Sequence[Dict[str, Any]]) -> Tuple[List[str], List[tuple]]:
+    """
+    Concatenate the rows of every successful tenant, prefixed with the tenant's name.
+
+    Parameters:
+    - results: Per-tenant results as produced by FanOut.run_tenant.
+
+    Returns:
+    - ("tenant" plus the union of the tenants' columns in first-seen order, rows aligned on them;
+      a column a tenant did not return is NULL in its rows).
+    """
+    columns: List[str] = []
+    seen = set()
+    for result in results:
+        for column in result.get("columns", ()):
+            if column not in seen:
+                seen.add(column)
+                columns.append(column)
+    rows = []
+    for result in results:
+        if result["status"] != "ok":
+            continue
+        positions = [result["columns"].index(column) if column in result["columns"] else None for column in columns]
+        for row in result["rows"]:
+            rows.append((result["tenant"], *(row[i] if i is not None else None for i in positions)))
+    return ["tenant"] + columns, rows
+
+
+def aggregate_rows(columns: List[str], rows: Sequence[tuple], how: str,
+                   group_by: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Aggregate merged fan-out rows across tenants.
+
+    Parameters:
+    - columns, rows: As returned by merge_results (the first column is the tenant).
+    - how: sum, min, max or avg, applied to every numeric column that is not grouped on.
+    - group_by: Columns to group on; by default every column holding a non-numeric value.
+
+    Returns:
+    - {"columns", "rows"}: the group columns, one aggregate per numeric column, and the number of
+      tenants contributing to each group.
+    """
+    if how not in ("sum", "min", "max", "avg"):
+        raise ValueError(f"Unsupported aggregate: {how}")
+    value_columns = columns[1:]
+    if group_by is None:
+        group_by = [column for position, column in enumerate(value_columns, 1)
+                    if any(row[position] is not None and not _is_number(row[position]) for row in rows)]
+    unknown = [column for column in group_by if column not in value_columns]
+    if unknown:
+        raise ValueError(f"Unknown group_by columns: {', '.join(unknown)}")
+    keys = [columns.index(column) for column in group_by]
+    measures = [(position, column) for position, column in enumerate(columns) if position and column not in group_by]
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for row in rows:
+        group = groups.setdefault(tuple(row[i] for i in keys), {"tenants": set(), "values": [[] for _ in measures]})
+        group["tenants"].add(row[0])
+        for values, (position, _) in zip(group["values"], measures):
+            if _is_number(row[position]):
+                values.append(row[position])
+    reducers: Dict[str, Callable[[list], Any]] = {
+        "sum": sum, "min": min, "max": max, "avg": lambda values: sum(values) / len(values),
+    }
+    output = []
+    for key, group in groups.items():
+        aggregated = [reducers[how](values) if values else None for values in group["values"]]
+        output.append((*key, *aggregated, len(group["tenants"])))
+    output.sort(key=lambda row: tuple((value is None, str(value)) for value in row[:len(keys)]))
+    return {"columns": list(group_by) + [f"{how}_{column}" for _, column in measures] + ["tenants"], "rows": output}
+
+
+def schema_drift(results: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compare the "schema" probe across tenants.
+
+    For every table the most common definition (columns, types and nullability, in order) is
+    taken as the reference; tenants without the table or with another definition are reported.
+
+    Returns:
+    - The number of tenants compared, tables identical wherever they exist, and one finding per
+      drifting table.
+    """
+    definitions: Dict[str, Dict[str, tuple]] = {}
+    tenants = [result["tenant"] for result in results if result["status"] == "ok"]
+    for result in results:
+        if result["status"] != "ok":
+            continue
+        tables: Dict[str, list] = {}
+        for table_name, column_name, column_type, not_null in result["rows"]:
+            if table_name in (CHANGE_LOG_TABLE, CHANGE_FLOOR_TABLE):
+                continue
+            columns = tables.setdefault(table_name, [])
+            if column_name:
+                columns.append((column_name, column_type, not_null in (True, "t")))
+        for table_name, columns in tables.items():
+            definitions.setdefault(table_name, {})[result["tenant"]] = tuple(columns)
+
+    findings, consistent = [], 0
+    for table_name in sorted(definitions):
+        by_tenant = definitions[table_name]
+        variants = Counter(by_tenant.values())
+        missing = [tenant for tenant in tenants if tenant not in by_tenant]
+        if len(variants) == 1 and not missing:
+            consistent += 1
+            continue
+        reference, _ = variants.most_common(1)[0]
+        differing = []
+        for definition, count in variants.most_common()[1:]:
+            names = [tenant for tenant, columns in by_tenant.items() if columns == definition]
+            differing.append({
+                "tenants": count,
+                "sample_tenants": names[:FANOUT_MAX_LISTED_TENANTS],
+                "missing_columns": [column[0] for column in reference if column[0] not in {c[0] for c in definition}],
+                "extra_columns": [column[0] for column in definition if column[0] not in {c[0] for c in reference}],
+                "changed_columns": [column[0] for column in definition
+                                    if column[0] in {c[0] for c in reference} and column not in reference],
+            })
+        findings.append({
+            "table": table_name,
+            "tenants_with_table": len(by_tenant),
+            "reference_columns": [{"name": name, "type": column_type, "not_null": not_null}
+                                  for name, column_type, not_null in reference],
+            "missing_in": len(missing),
+            "sample_missing_in": missing[:FANOUT_MAX_LISTED_TENANTS],
+            "variants": differing,
+        })
+    return {"tenants": len(tenants), "consistent_tables": consistent, "drift": findings}
+
+
+class FanOut:
+    """
+    Run one read-only query, or a named catalog probe, across many tenants.
+
+    Tenants come from the main users table. At most `concurrency` of them are queried at once and
+    each gets `tenant_timeout` seconds; a slow, failing or hibernated tenant is reported in its
+    own result and never fails the fan-out. Results can be consumed as they arrive (iterate) or
+    merged and aggregated once every tenant has answered (run).
+    """
+
+    def __init__(self, concurrency: int = FANOUT_CONCURRENCY, tenant_timeout: float = FANOUT_TENANT_TIMEOUT,
+                 max_rows: int = FANOUT_MAX_ROWS_PER_TENANT, backend=None,
+                 load_users: Callable[[], Dict[str, Dict[str, Any]]] = load_user_endpoints,
+                 hibernation=default_hibernation):
+        self.concurrency = concurrency
+        self.tenant_timeout = tenant_timeout
+        self.max_rows = max_rows
+        self.backend = backend
+        self.load_users = load_users
+        self.hibernation = hibernation
+        self.runs = 0
+        self.tenant_queries = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def statement(self, sql: Optional[str] = None, probe: Optional[str] = None) -> str:
+        """Resolve a request to the statement to run, raising 400 for anything but one read-only statement."""
+        if (sql is None) == (probe is None):
+            raise HTTPException(status_code=400, detail="Give either 'sql' or 'probe'.")
+        if probe is not None:
+            if probe not in PROBES:
+                raise HTTPException(status_code=400,
+                                    detail=f"Unknown probe: {probe}. Available: {', '.join(sorted(PROBES))}")
+            return PROBES[probe]
+        if not READ_ONLY_PATTERN.match(sql) or is_script(sql):
+            raise HTTPException(status_code=400, detail="Fan-out runs a single read-only statement (SELECT, WITH, "
+                                                        "VALUES, TABLE, SHOW or EXPLAIN).")
+        return sql
+
+    async def select_tenants(self, tenants: Optional[Sequence[str]] = None) -> Tuple[List[str], List[str]]:
+        """Return (registered tenants to query, requested names that are not registered)."""
+        users = await run_blocking(self.load_users)
+        if tenants is None:
+            return sorted(users), []
+        return [tenant for tenant in tenants if tenant in users], [tenant for tenant in tenants if tenant not in users]
+
+    async def _execute(self, username: str, sql: str, timeout: float) -> Tuple[List[str], List[tuple]]:
+        backend = self.backend or query_backend
+        timeout_ms = max(1, int(timeout * 1000))
+        if not hasattr(backend, "get_engine"):
+            # psql exec mode: psql -c runs the string as one implicit transaction and prints only
+            # the last result; rows come back as text
+            result = await backend.execute(username, f"SET LOCAL transaction_read_only = on; "
+                                                     f"SET LOCAL statement_timeout = {timeout_ms}; {sql}")
+            if result.text is not None:
+                return _psql_table(result.text)
+            return result.columns, result.rows
+        engine = await backend.get_engine(username)
+        async with engine.begin() as conn:
+            # One round trip: the transaction may not write, and Postgres gives up when the caller does
+            await conn.exec_driver_sql(f"SELECT set_config('transaction_read_only', 'on', true), "
+                                       f"set_config('statement_timeout', '{timeout_ms}', true)")
+            result = await conn.exec_driver_sql(sql)
+            if not result.returns_rows:
+                return [], []
+            return list(result.keys()), [tuple(row) for row in result.fetchall()]
+
+    async def run_tenant(self, username: str, sql: str, timeout: float, wake: bool = False) -> Dict[str, Any]:
+        """
+        Query one tenant, never raising.
+
+        Returns:
+        - {"tenant", "status" (ok, error, timeout or hibernated), "elapsed_ms", and "columns",
+          "rows" and "truncated" when ok, or "error"}.
+        """
+        if self.hibernation.enabled and username in self.hibernation.hibernated and not wake:
+            # Waking every idle tenant for a report would undo hibernation
+            self.skipped += 1
+            return {"tenant": username, "status": "hibernated", "elapsed_ms": 0.0}
+        self.tenant_queries += 1
+        start = time.perf_counter()
+        try:
+            if self.hibernation.enabled and username in self.hibernation.hibernated:
+                await self.hibernation.wake(username)
+            columns, rows = await asyncio.wait_for(self._execute(username, sql, timeout), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return {"tenant": username, "status": "timeout", "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                    "error": f"No answer within {timeout} s."}
+        except Exception as e:
+            self.errors += 1
+            detail = e.detail if isinstance(e, HTTPException) else str(getattr(e, "orig", None) or e)
+            return {"tenant": username, "status": "error", "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                    "error": detail}
+        return {"tenant": username, "status": "ok", "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                "columns": list(columns), "rows": rows[:self.max_rows], "truncated": len(rows) > self.max_rows}
+
+    async def iterate(self, tenants: Sequence[str], sql: str, concurrency: Optional[int] = None,
+                      timeout: Optional[float] = None, wake: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Query the tenants with bounded parallelism, yielding each tenant's result as it completes.
+
+        Parameters:
+        - tenants: The tenants to query.
+        - sql: A statement accepted by `statement`.
+        - concurrency: Tenants queried at once (defaults to the instance's).
+        - timeout: Seconds per tenant (defaults to the instance's).
+        - wake: Start hibernated tenants instead of reporting them as hibernated.
+        """
+        concurrency = max(1, concurrency or self.concurrency)
+        timeout = timeout or self.tenant_timeout
+        self.runs += 1
+        pending = iter(tenants)
+        running = set()
+        # A fixed window of tasks rather than one task per tenant behind a semaphore: a thousand
+        # tenants do not become a thousand tasks, and tenants start in the order given
+        try:
+            for username in pending:
+                running.add(asyncio.ensure_future(self.run_tenant(username, sql, timeout, wake)))
+                if len(running) >= concurrency:
+                    break
+            while running:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    username = next(pending, None)
+                    if username is not None:
+                        running.add(asyncio.ensure_future(self.run_tenant(username, sql, timeout, wake)))
+                    yield task.result()
+        finally:
+            # The consumer went away (e.g. a streaming client disconnected)
+            for task in running:
+                task.cancel()
+
+    async def run(self, tenants: Sequence[str], sql: str, concurrency: Optional[int] = None,
+                  timeout: Optional[float] = None, wake: bool = False, aggregate: Optional[str] = None,
+                  group_by: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        Query the tenants and merge their results.
+
+        Returns:
+        - A summary, the per-tenant statuses, the merged rows (see merge_results) and, when asked
+          for, their aggregate (see aggregate_rows and schema_drift).
+        """
+        start = time.perf_counter()
+        results = [result async for result in self.iterate(tenants, sql, concurrency, timeout, wake)]
+        results.sort(key=lambda result: result["tenant"])
+        response = self.summarize(results, time.perf_counter() - start)
+        response["tenants"] = {result["tenant"]: {key: value for key, value in result.items()
+                                                  if key not in ("tenant", "columns", "rows")} for result in results}
+        columns, rows = merge_results(results)
+        response["columns"], response["rows"] = columns, rows
+        if aggregate is not None:
+            response["aggregate"] = self.aggregate(results, columns, rows, aggregate, group_by)
+        return response
+
+    async def ndjson(self, tenants: Sequence[str], sql: str, concurrency: Optional[int] = None,
+                     timeout: Optional[float] = None, wake: bool = False, aggregate: Optional[str] = None,
+                     group_by: Optional[Sequence[str]] = None, **extra) -> AsyncIterator[bytes]:
+        """
+        Stream a fan-out as NDJSON: one line per tenant result as it completes, then a last line
+        with the summary (plus `extra`) and the aggregate.
+        """
+        start = time.perf_counter()
+        results = []
+        async for result in self.iterate(tenants, sql, concurrency, timeout, wake):
+            results.append(result)
+            yield dumps(result) + b"\n"
+        response = self.summarize(results, time.perf_counter() - start)
+        response.update(extra)
+        if aggregate is not None:
+            columns, rows = merge_results(results)
+            try:
+                response["aggregate"] = self.aggregate(results, columns, rows, aggregate, group_by)
+            except HTTPException as e:
+                # The status line went out with the first tenant; report it in the body
+                response["aggregate"] = {"error": e.detail}
+        yield dumps(response) + b"\n"
+
+    def check_aggregate(self, aggregate: Optional[str], probe: Optional[str] = None):
+        """Raise 400 unless the aggregate applies to the request (drift needs the schema probe's rows)."""
+        if aggregate is not None and aggregate not in AGGREGATES:
+            raise HTTPException(status_code=400, detail=f"Unsupported aggregate: {aggregate}")
+        if aggregate == "drift" and probe != "schema":
+            raise HTTPException(status_code=400, detail="aggregate=drift compares the 'schema' probe.")
+
+    def aggregate(self, results, columns, rows, how: str, group_by=None) -> Dict[str, Any]:
+        if how == "drift":
+            return schema_drift(results)
+        try:
+            return aggregate_rows(columns, rows, how, group_by)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def summarize(self, results: Sequence[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+        statuses = Counter(result["status"] for result in results)
+        latencies = sorted(result["elapsed_ms"] for result in results if result["status"] == "ok")
+        summary = {"tenants": len(results), "statuses": dict(statuses), "elapsed_ms": round(elapsed * 1000, 3),
+                   "slowest_ms": latencies[-1] if latencies else None}
+        if statuses.get("timeout") or statuses.get("error"):
+            logging.warning(f"Fan-out over {len(results)} tenants: {statuses.get('error', 0)} errors, "
+                            f"{statuses.get('timeout', 0)} timeouts")
+        return {"summary": summary}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "tenant_queries": self.tenant_queries,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "hibernated_skipped": self.skipped,
+            "concurrency": self.concurrency,
+            "tenant_timeout": self.tenant_timeout,
+        }
+
+
+fanout = FanOut()
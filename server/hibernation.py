@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import docker
+
+from adminUtils import get_docker_client
+from container_pool import WARM_CONTAINER_PREFIX, wait_until_ready
+from database import tenant_pools
+from executors import run_blocking
+from metrics import container_lifecycle
+
+# Containers of tenants idle for this many seconds are hibernated (0 disables hibernation)
+HIBERNATE_IDLE_SECONDS = float(os.getenv("HIBERNATE_IDLE_SECONDS", "1800"))
+HIBERNATE_CHECK_INTERVAL = float(os.getenv("HIBERNATE_CHECK_INTERVAL", "60"))
+# "stop" frees the container's memory; "pause" freezes its processes for a faster wake-up
+HIBERNATE_ACTION = os.getenv("HIBERNATE_ACTION", "stop")
+# Longest a request waits for a hibernated tenant's Postgres to accept connections again
+HIBERNATE_WAKE_TIMEOUT = float(os.getenv("HIBERNATE_WAKE_TIMEOUT", "30"))
+
+TENANT_CONTAINER_PREFIX = "postgres_"
+# Tenant-scoped routes of the mounted db app and of the user router
+TENANT_PATH_PATTERN = re.compile(r"^/(?:db/)?users/([^/]+)/")
+
+
+def tenant_from_path(path: str) -> Optional[str]:
+    """Return the username of a tenant-scoped request path, or None."""
+    match = TENANT_PATH_PATTERN.match(path)
+    return match.group(1) if match else None
+
+
+class HibernationScheduler:
+    """
+    Track per-tenant last access and hibernate the containers of idle tenants.
+
+    A hibernated tenant is woken transparently by the next request for it: the container is
+    started (or unpaused) and the request waits, up to `wake_timeout`, for Postgres to be ready.
+    A request arriving while its tenant is being hibernated waits for that to finish and then
+    wakes it; tenants with requests in flight (see begin/end) are not hibernated.
+    Shared-cluster tenants have no container of their own and are never hibernated.
+    """
+
+    def __init__(self, idle_seconds: float = HIBERNATE_IDLE_SECONDS, check_interval: float = HIBERNATE_CHECK_INTERVAL,
+                 action: str = HIBERNATE_ACTION, wake_timeout: float = HIBERNATE_WAKE_TIMEOUT, docker_client=None,
+                 pools=tenant_pools):
+        if action not in ("stop", "pause"):
+            raise ValueError(f"Unsupported hibernate action: {action}")
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+        self.action = action
+        self.wake_timeout = wake_timeout
+        self.pools = pools
+        self._client = docker_client
+        self.last_access: Dict[str, float] = {}
+        self.hibernated = set()
+        self.in_flight: Dict[str, int] = {}
+        self._waking: Dict[str, asyncio.Future] = {}
+        # Tenants whose pools are being evicted and container stopped; requests wait on the future
+        self._hibernating: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.hibernations = 0
+        self.hibernations_skipped = 0
+        self.wakes = 0
+        self.wake_failures = 0
+        self._wake_latencies = deque(maxlen=1000)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_docker_client()
+        return self._client
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle_seconds > 0
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await run_blocking(self._seed_from_inventory)
+        self._task = asyncio.get_running_loop().create_task(self._hibernate_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _tenant_containers(self):
+        for container in self.client.containers.list(all=True):
+            if container.name.startswith(TENANT_CONTAINER_PREFIX) and not container.name.startswith(WARM_CONTAINER_PREFIX):
+                yield container.name[len(TENANT_CONTAINER_PREFIX):], container
+
+    def _seed_from_inventory(self):
+        """Start the idle clock for running tenants and remember tenants already hibernated."""
+        now = time.monotonic()
+        for username, container in self._tenant_containers():
+            if container.status in ("exited", "paused"):
+                self.hibernated.add(username)
+            elif container.status == "running":
+                self.last_access.setdefault(username, now)
+
+    async def touch(self, username: str):
+        """Record an access to a tenant and wake its container first if it is hibernated."""
+        self.last_access[username] = time.monotonic()
+        hibernating = self._hibernating.get(username)
+        if hibernating is not None:
+            # Too late to keep it running: let the stop finish, then start it again
+            await asyncio.shield(hibernating)
+        if username in self.hibernated:
+            await self.wake(username)
+
+    def begin(self, username: str):
+        """Count a request to the tenant's database as in flight; an in-flight tenant is not hibernated."""
+        self.in_flight[username] = self.in_flight.get(username, 0) + 1
+
+    def end(self, username: str):
+        remaining = self.in_flight.get(username, 0) - 1
+        if remaining > 0:
+            self.in_flight[username] = remaining
+        else:
+            self.in_flight.pop(username, None)
+
+    async def wake(self, username: str):
+        # Concurrent requests for the same tenant share one wake-up
+        future = self._waking.get(username)
+        if future is None:
+            future = asyncio.get_running_loop().create_task(self._wake(username))
+            self._waking[username] = future
+            future.add_done_callback(lambda _: self._waking.pop(username, None))
+        await asyncio.shield(future)
+
+    async def _wake(self, username: str):
+        start = time.perf_counter()
+        try:
+            container = await run_blocking(self.client.containers.get, f"{TENANT_CONTAINER_PREFIX}{username}")
+            await run_blocking(container.reload)
+            if container.status == "paused":
+                await run_blocking(container.unpause)
+            elif container.status != "running":
+                await run_blocking(container.start)
+            await wait_until_ready(container, self.wake_timeout)
+        except docker.errors.NotFound:
+            # Nothing to wake; let the request fail the usual way
+            self.hibernated.discard(username)
+            return
+        except Exception:
+            self.wake_failures += 1
+            raise
+        self.hibernated.discard(username)
+        self.wakes += 1
+        self._wake_latencies.append(time.perf_counter() - start)
+        container_lifecycle.observe(time.perf_counter() - start, "wake")
+        logging.info(f"Woke tenant {username} in {time.perf_counter() - start:.2f}s")
+
+    def forget(self, username: str):
+        """Stop tracking a deleted tenant."""
+        self.last_access.pop(username, None)
+        self.hibernated.discard(username)
+
+    async def _hibernate_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.hibernate_idle()
+            except Exception as e:
+                logging.error(f"Hibernation sweep failed: {e}")
+
+    async def hibernate_idle(self) -> int:
+        """Hibernate every tenant idle for longer than the threshold; returns how many were hibernated."""
+        now = time.monotonic()
+        idle = [username for username, last in self.last_access.items()
+                if now - last >= self.idle_seconds and username not in self.hibernated and username not in self._waking
+                and username not in self._hibernating]
+        count = 0
+        for username in idle:
+            if await self.hibernate(username):
+                count += 1
+        return count
+
+    def _still_idle(self, username: str) -> bool:
+        last = self.last_access.get(username)
+        return (last is not None and time.monotonic() - last >= self.idle_seconds
+                and not self.in_flight.get(username) and username not in self._waking)
+
+    async def hibernate(self, username: str) -> bool:
+        """Hibernate a tenant unless it was used since it was found idle; returns whether it was."""
+        try:
+            container = await run_blocking(self.client.containers.get, f"{TENANT_CONTAINER_PREFIX}{username}")
+        except docker.errors.NotFound:
+            # Shared-cluster tenant or deleted container: nothing to hibernate
+            self.last_access.pop(username, None)
+            return False
+        if username in self._hibernating or username in self.hibernated:
+            return False
+        # Marked and re-checked with no await in between: a request either made the tenant busy
+        # before this point, or arrives after it and waits in touch() for the stop to finish
+        hibernating = self._hibernating[username] = asyncio.get_running_loop().create_future()
+        try:
+            if not self._still_idle(username):
+                self.hibernations_skipped += 1
+                return False
+            # Drop pooled connections first so nothing holds sockets to the stopped server
+            self.pools.evict_matching(lambda key: key[-1] == username)
+            with container_lifecycle.time("hibernate"):
+                if self.action == "pause":
+                    await run_blocking(container.pause)
+                else:
+                    await run_blocking(container.stop)
+            self.hibernated.add(username)
+        finally:
+            del self._hibernating[username]
+            hibernating.set_result(None)
+        self.hibernations += 1
+        logging.info(f"Hibernated idle tenant {username} ({self.action})")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._wake_latencies)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 3) if latencies else None
+
+        return {
+            "enabled": self.enabled,
+            "action": self.action,
+            "tracked_tenants": len(self.last_access),
+            "hibernated": len(self.hibernated),
+            "hibernations": self.hibernations,
+            "hibernations_skipped": self.hibernations_skipped,
+            "wakes": self.wakes,
+            "wake_failures": self.wake_failures,
+            "wake_latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99)},
+        }
+
+
+hibernation = HibernationScheduler()
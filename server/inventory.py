@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from adminUtils import (TENANT_PUBLISH_PORTS, get_docker_client, load_user_endpoints, port_allocator, published_port,
+                        update_user_port)
+from container_pool import WARM_CONTAINER_PREFIX
+from executors import run_blocking
+from hibernation import TENANT_CONTAINER_PREFIX
+from ports import PortAllocator
+from routing import TenantRoutingCache, tenant_routes
+
+# Seconds between reconciliations of the users table and port ledger with Docker (0 disables the loop)
+INVENTORY_RECONCILE_INTERVAL = float(os.getenv("INVENTORY_RECONCILE_INTERVAL", "300"))
+
+
+class InventoryReconciler:
+    """
+    Periodically compare the users table and the port ledger with the real Docker inventory.
+
+    Ports published by containers but missing from the ledger are adopted and ledger entries
+    without a container are freed. A users row whose stored port differs from the port its
+    container publishes is corrected. Users without a container and tenant containers without
+    a user are only reported: deleting data is left to an operator.
+    """
+
+    def __init__(self, interval: float = INVENTORY_RECONCILE_INTERVAL, ports: PortAllocator = port_allocator,
+                 routes: TenantRoutingCache = tenant_routes, docker_client=None,
+                 load_users: Callable[[], Dict[str, Dict[str, Any]]] = load_user_endpoints,
+                 update_port: Callable[[str, int], Any] = update_user_port, publish_ports: bool = TENANT_PUBLISH_PORTS):
+        self.interval = interval
+        self.ports = ports
+        self.routes = routes
+        self._client = docker_client
+        self.load_users = load_users
+        self.update_port = update_port
+        self.publish_ports = publish_ports
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.failures = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_docker_client()
+        return self._client
+
+    async def start(self):
+        if self.interval <= 0:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._reconcile_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reconcile_loop(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"Inventory reconciliation failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _inventory(self) -> Dict[str, Any]:
+        """Tenant and warm containers by name, running or not."""
+        containers = self.client.containers.list(all=True, filters={"name": TENANT_CONTAINER_PREFIX})
+        return {container.name: container for container in containers
+                if container.name.startswith(TENANT_CONTAINER_PREFIX)}
+
+    async def reconcile(self) -> Dict[str, Any]:
+        """Run one reconciliation and return its report."""
+        start = time.perf_counter()
+        containers = await run_blocking(self._inventory)
+        users = await run_blocking(self.load_users)
+        in_use = {}
+        if self.publish_ports:
+            in_use = {published_port(container): name for name, container in containers.items()}
+        report: Dict[str, Any] = {"ports": await run_blocking(self.ports.reconcile, in_use), "port_fixes": {},
+                                  "users_without_container": [], "containers_without_user": []}
+
+        for username, endpoint in users.items():
+            if endpoint.get("tenancy_mode", "container") != "container":
+                continue
+            container = containers.get(f"{TENANT_CONTAINER_PREFIX}{username}")
+            if container is None:
+                report["users_without_container"].append(username)
+                continue
+            port = published_port(container)
+            if port != endpoint["container_port"]:
+                await run_blocking(self.update_port, username, port)
+                self.routes.invalidate(username)
+                report["port_fixes"][username] = {"stored": endpoint["container_port"], "actual": port}
+
+        for name in containers:
+            if name.startswith(WARM_CONTAINER_PREFIX):
+                continue
+            if name[len(TENANT_CONTAINER_PREFIX):] not in users:
+                report["containers_without_user"].append(name)
+
+        if report["users_without_container"] or report["containers_without_user"]:
+            logging.warning(f"Inventory drift: {len(report['users_without_container'])} users without a container, "
+                            f"{len(report['containers_without_user'])} containers without a user")
+        report["containers"] = len(containers)
+        report["users"] = len(users)
+        report["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        report["finished_at"] = time.time()
+        self.runs += 1
+        self.last_report = report
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "allocator": self.ports.stats(),
+            "last_report": self.last_report,
+        }
+
+
+inventory = InventoryReconciler()
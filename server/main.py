@@ -1,12 +1,32 @@
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from typing import Optional
 from adminUtils import (
-    create_postgresql_container, 
+    delete_user_from_db,
     init_main_db,
-    save_user_to_db,
+    port_allocator,
 )
-from schemas import UserCreate
-from database import add_database
+from schemas import BulkUserCreate, FanOutRequest, UserCreate
+from sqlalchemy.exc import SQLAlchemyError
+from database import tenant_pools
+from container_pool import warm_pool
+from tenancy import tenancy, tenancy_for
+from routing import tenant_routes
+from catalog import catalog_cache
+from result_cache import result_cache
+from scheduler import scheduler
+from models import statement_cache
+from query_engine import get_tenant_endpoint
+from hibernation import hibernation, tenant_from_path
+from provisioning import provisioning
+from profiler import query_profiler
+from changefeed import change_feed
+from fanout import fanout
+from serialization import STREAM_MEDIA_TYPES
+from inventory import inventory
+from executors import blocking_executor, run_blocking
+from metrics import CONTENT_TYPE, instrument, registry, span
 from user_routes import router as user_router
 from db_routes import app as db_app
 
@@ -24,18 +44,110 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
-def on_startup():
-    init_main_db()
+async def on_startup():
+    await run_blocking(init_main_db)
+    # Before the warm pool starts containers, so their ports come from the ledger
+    await run_blocking(port_allocator.load)
+    await tenancy.start()
+    await tenant_routes.warm()
+    await hibernation.start()
+    await provisioning.start()
+    await inventory.start()
 
-# app.include_router(user_router, prefix="/users")
+@app.on_event("shutdown")
+async def on_shutdown():
+    await inventory.stop()
+    await provisioning.stop()
+    await hibernation.stop()
+    await tenancy.stop()
+    await tenant_pools.dispose_all()
+
+class _ReleaseAfterSend:
+    """Send a response, then run `release` however sending ends (finished, failed or client gone)."""
+
+    def __init__(self, response: Response, release):
+        self.response = response
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.release()
+
+@app.middleware("http")
+async def wake_hibernated_tenant(request: Request, call_next):
+    # Record tenant activity and start a hibernated container before the request reaches it
+    username = tenant_from_path(request.url.path)
+    if username is None or not hibernation.enabled:
+        return await call_next(request)
+    try:
+        with span("wake"):
+            await hibernation.touch(username)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"detail": f"Tenant database is waking up, retry shortly: {e}"},
+                            headers={"Retry-After": "5"})
+    # In flight until the body is sent, so the tenant is not hibernated under a running request
+    hibernation.begin(username)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        hibernation.end(username)
+        raise
+    return _ReleaseAfterSend(response, lambda: hibernation.end(username))
+
+@app.middleware("http")
+async def admit_tenant_request(request: Request, call_next):
+    # Registered last so it runs first: rejected requests never wake a container or reach the database
+    username = tenant_from_path(request.url.path)
+    if username is None or not scheduler.enabled:
+        return await call_next(request)
+    try:
+        await scheduler.acquire(username)
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        scheduler.release(username)
+        raise
+    # call_next returns once the endpoint has; a streamed body (exports, fan-out NDJSON) is still
+    # being read from the tenant's database, so the slot is held until the body has been sent
+    return _ReleaseAfterSend(response, lambda: scheduler.release(username))
+
+# Outermost, so request latency includes admission and wake-up
+instrument(app, "main", tenant_of=tenant_from_path)
+
+# Saturation gauges, read when /metrics is scraped
+registry.gauge("tenant_pool_connections", "Tenant pool connections: in use, reserved by engines, and the global budget.",
+               lambda: {(state,): tenant_pools.stats()[key] for state, key in
+                        (("in_use", "connections_in_use"), ("reserved", "reserved_connections"), ("max", "max_connections"))},
+               ("state",))
+registry.gauge("tenant_pool_engines", "Tenant engines held by the pool registry.",
+               lambda: {(): tenant_pools.stats()["engines"]})
+registry.gauge("scheduler_requests", "Tenant requests running and queued in admission control, and the concurrency cap.",
+               lambda: {("running",): scheduler.running, ("queued",): scheduler.stats(tenants=0)["queued"],
+                        ("max",): scheduler.max_concurrency},
+               ("state",))
+registry.gauge("warm_pool_containers", "Warm containers ready to be claimed and being started.",
+               lambda: {("ready",): warm_pool.depth, ("starting",): warm_pool.stats()["starting"]}, ("state",))
+registry.gauge("blocking_executor_queue", "Blocking calls (Docker SDK, main database) waiting for a worker thread.",
+               lambda: {(): blocking_executor._work_queue.qsize()})
+registry.gauge("provisioning_tenants", "Tenants queued and in flight in the provisioning queue.",
+               lambda: {("queued",): provisioning.stats()["queued"], ("in_flight",): provisioning.stats()["in_flight"]},
+               ("state",))
+
+app.include_router(user_router, prefix="/users")
 app.mount("/db", db_app)
 # app.include_router(db_router, prefix="/db")
 
 @app.post("/register")
-def register_user(user: UserCreate):
+async def register_user(user: UserCreate):
     """
-    Register a new user by creating a PostgreSQL container for them and
-    saving their details to the main database.
+    Register a new user by provisioning their database with the configured tenancy
+    backend (a container from the warm pool, or a database or schema on the shared
+    cluster), waiting until it accepts connections and saving their details to the
+    main database. A failed registration is rolled back.
 
     Parameters:
     - user: The user details including username and password.
@@ -43,17 +155,281 @@ def register_user(user: UserCreate):
     Returns:
     - A message indicating successful registration.
     """
-    container, container_hostname, port,  = create_postgresql_container(user)
-    
-    save_user_to_db(user, container.id, container_hostname, port)
-    # Construct the database URL
-    # database_url = f"postgresql://{user.username}:{user.password}@{container_hostname}/{user.username}"
-    # print(f"db url: {database_url}")
-    # # Add the user's database connection to the DATABASES dictionary
-    # add_database(user.username, database_url)
-
+    try:
+        await provisioning.provision_tenant(user)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=500, detail=f"Failed to provision tenant database: {e}")
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"Tenant database did not become ready: {e}")
     return {"message": f"User '{user.username}' registered successfully."}
 
+@app.post("/register/bulk", status_code=202)
+async def register_users_bulk(request: BulkUserCreate):
+    """
+    Queue the registration of many users; they are provisioned concurrently in the background.
+
+    Parameters:
+    - request: The users to register.
+
+    Returns:
+    - The job id and the URL to poll for per-user progress.
+    """
+    try:
+        job = provisioning.submit(request.users)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job.id, "status": job.status, "status_url": f"/register/jobs/{job.id}"}
+
+@app.get("/register/jobs/{job_id}")
+def registration_job_status(job_id: str):
+    """
+    Report the progress of a bulk registration.
+
+    Parameters:
+    - job_id: The id returned by /register/bulk.
+
+    Returns:
+    - The job status (queued, running, succeeded, partial or failed), counts per state and per-user details.
+    """
+    job = provisioning.job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Registration job '{job_id}' not found.")
+    return job.to_dict()
+
+@app.delete("/users/{username}")
+async def delete_user(username: str):
+    """
+    Delete a user: drop their tenant database (container, database or schema) and their
+    row in the main database, and forget their cached routing entry and pooled connections.
+
+    Parameters:
+    - username: The user to delete.
+
+    Returns:
+    - A message indicating successful deletion.
+    """
+    endpoint = await get_tenant_endpoint(username)
+    tenant_routes.invalidate(username)
+    tenant_pools.evict_matching(lambda key: key[-1] == username)
+    try:
+        await tenancy_for(endpoint.get("tenancy_mode", "container")).deprovision(endpoint)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to remove tenant database: {e}")
+    await run_blocking(delete_user_from_db, username)
+    tenant_routes.invalidate(username)
+    hibernation.forget(username)
+    catalog_cache.invalidate(username)
+    result_cache.forget_tenant(username)
+    query_profiler.forget_tenant(username)
+    return {"message": f"User '{username}' deleted successfully."}
+
+@app.get("/admin/pools")
+def pool_stats():
+    """
+    Report the tenant pool registry counters.
+
+    Returns:
+    - Engine count, reserved and in-use connections, hit/miss/eviction counters.
+    """
+    return tenant_pools.stats()
+
+@app.get("/admin/warm_pool")
+def warm_pool_stats():
+    """
+    Report the warm container pool depth and claim latency.
+
+    Returns:
+    - Target size, ready depth, claims, cold-start misses and claim latency percentiles.
+    """
+    return warm_pool.stats()
+
+@app.get("/admin/routing")
+def routing_stats():
+    """
+    Report the tenant routing cache counters.
+
+    Returns:
+    - Cached entries, hit/miss/expiration/invalidation counters and lookup latency percentiles.
+    """
+    return tenant_routes.stats()
+
+@app.get("/admin/catalog")
+def catalog_stats():
+    """
+    Report the tenant catalog cache counters.
+
+    Returns:
+    - Cached tenant catalogs, hit/miss/invalidation/eviction counters and hit ratio.
+    """
+    return catalog_cache.stats()
+
+@app.get("/admin/result_cache")
+def result_cache_stats():
+    """
+    Report the query result cache counters.
+
+    Returns:
+    - Cached entries and bytes, hit/miss/304/eviction/invalidation counters and per-tenant hit rates.
+    """
+    return result_cache.stats()
+
+@app.get("/admin/scheduler")
+def scheduler_stats():
+    """
+    Report admission control counters.
+
+    Returns:
+    - Running and queued requests, rejections and per-tenant admission counters.
+    """
+    return scheduler.stats()
+
+@app.get("/admin/statements")
+def statement_cache_stats():
+    """
+    Report the built statement cache counters.
+
+    Returns:
+    - Cached statements, hit/miss/eviction counters and hit ratio.
+    """
+    return statement_cache.stats()
+
+@app.get("/admin/provisioning")
+def provisioning_stats():
+    """
+    Report the tenant provisioning queue counters.
+
+    Returns:
+    - Workers, queued and in-flight tenants, provisioned/failed/rolled-back counts and latency percentiles.
+    """
+    return provisioning.stats()
+
+@app.get("/admin/ports")
+def port_stats():
+    """
+    Report the tenant port allocator and the last inventory reconciliation.
+
+    Returns:
+    - Port range, allocated/free/blocked counts, and the drift found between the users table and Docker.
+    """
+    return inventory.stats()
+
+@app.post("/admin/ports/reconcile")
+async def reconcile_inventory():
+    """
+    Reconcile the users table and port ledger with the Docker inventory now.
+
+    Returns:
+    - The reconciliation report.
+    """
+    return await inventory.reconcile()
+
+@app.get("/admin/hibernation")
+def hibernation_stats():
+    """
+    Report idle tenant hibernation counters.
+
+    Returns:
+    - Tracked and hibernated tenant counts, hibernations, wakes and wake latency percentiles.
+    """
+    return hibernation.stats()
+
+@app.get("/admin/queries")
+def top_queries(n: int = 20, order_by: str = "total_ms", tenant: Optional[str] = None):
+    """
+    Report the most expensive tenant statements recorded by the query profiler (QUERY_PROFILER_ENABLED=1).
+
+    Parameters:
+    - n: Number of statements to return.
+    - order_by: total_ms, mean_ms, max_ms, calls or rows.
+    - tenant: Only this tenant's statements.
+
+    Returns:
+    - Profiler counters and the top statements by fingerprint, with sampled plan summaries.
+    """
+    try:
+        top = query_profiler.top(n, order_by, tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"profiler": query_profiler.stats(), "queries": top}
+
+@app.get("/admin/queries/slow")
+def slow_queries(limit: int = 100, tenant: Optional[str] = None):
+    """
+    Report the slow query log, most recent first.
+
+    Parameters:
+    - limit: Number of entries to return.
+    - tenant: Only this tenant's statements.
+
+    Returns:
+    - Slow statements with their fingerprint, duration and rows.
+    """
+    return {"slow_ms": query_profiler.slow_ms, "queries": query_profiler.slow_queries(limit, tenant)}
+
+@app.delete("/admin/queries")
+def reset_query_profiler():
+    """Clear the query profiler's statistics and slow query log."""
+    query_profiler.reset()
+    return {"message": "Query profiler reset."}
+
+@app.get("/admin/changes")
+def change_feed_stats():
+    """
+    Report change feed counters.
+
+    Returns:
+    - Feed reads, rows returned, reads answered with a full-refresh request and log entries pruned.
+    """
+    return change_feed.stats()
+
+@app.post("/admin/fanout")
+async def fanout_query(request: FanOutRequest):
+    """
+    Run a read-only query or a catalog probe across all (or the given) tenants, concurrently.
+
+    Parameters:
+    - request: The statement or probe, the tenants, and how to aggregate and deliver the results.
+
+    Returns:
+    - The per-tenant statuses, the merged rows with a leading tenant column and the aggregate;
+      with stream=true, NDJSON lines of per-tenant results as they arrive, then that summary.
+    """
+    sql = fanout.statement(request.sql, request.probe)
+    fanout.check_aggregate(request.aggregate, request.probe)
+    tenants, unknown = await fanout.select_tenants(request.tenants)
+    options = {"concurrency": request.concurrency, "timeout": request.timeout, "wake": request.wake,
+               "aggregate": request.aggregate, "group_by": request.group_by}
+    if request.stream:
+        return StreamingResponse(fanout.ndjson(tenants, sql, unknown_tenants=unknown, **options),
+                                 media_type=STREAM_MEDIA_TYPES["ndjson"])
+    response = await fanout.run(tenants, sql, **options)
+    response["unknown_tenants"] = unknown
+    return response
+
+@app.get("/admin/fanout")
+def fanout_stats():
+    """
+    Report fan-out counters.
+
+    Returns:
+    - Fan-outs run, tenant queries, timeouts, errors and hibernated tenants skipped.
+    """
+    return fanout.stats()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Expose request, stage, container lifecycle and saturation metrics for Prometheus.
+
+    Returns:
+    - The metrics in the Prometheus text exposition format.
+    """
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
 # ------------------------------------------------------------------------------
 # This is a one function to perform multiple tasks on the database
 # ------------------------------------------------------------------------------
@@ -0,0 +1,297 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# METRICS_ENABLED=0 turns the request middleware and stage spans into no-ops
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Distinct tenants given their own latency series; later tenants are counted under "_other"
+METRICS_MAX_TENANTS = int(os.getenv("METRICS_MAX_TENANTS", "500"))
+
+# Request and stage latency buckets (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Container starts, claims and wake-ups take seconds rather than milliseconds
+CONTAINER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time, so the hot path never updates it."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Dict[Labels, float]], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.collect().items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram; an observation is one bisect and two additions under a lock.
+
+    Buckets are stored per bucket and made cumulative only when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def snapshot(self, *labels: str) -> Optional[Dict[str, Any]]:
+        """Count and sum of one series, for the JSON admin endpoints and benchmarks."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                return None
+            return {"count": series[2], "sum": series[1]}
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        bounds = self.buckets + (float("inf"),)
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class MetricsRegistry:
+    """The process's metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._tenants = set()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Dict[Labels, float]],
+              labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, collect, labelnames))
+
+    def tenant_label(self, username: str) -> str:
+        """The tenant's own label while under METRICS_MAX_TENANTS distinct tenants, "_other" after that."""
+        if username in self._tenants:
+            return username
+        if len(self._tenants) < METRICS_MAX_TENANTS:
+            self._tenants.add(username)
+            return username
+        return "_other"
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by app, method, route template and status code.",
+    ("app", "method", "route", "status"))
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by app, method and route template.",
+    ("app", "method", "route"))
+tenant_latency = registry.histogram(
+    "tenant_request_duration_seconds", "Latency of tenant-scoped requests by tenant, admission and wake-up included.",
+    ("tenant",))
+stage_latency = registry.histogram(
+    "request_stage_duration_seconds",
+    "Time spent per request stage: wake, routing, docker_lookup, checkout, execute, encode.",
+    ("stage",))
+container_lifecycle = registry.histogram(
+    "container_lifecycle_seconds",
+    "Duration of tenant container operations: warm_claim, cold_start, wait_ready, wake, hibernate, deprovision.",
+    ("action",), buckets=CONTAINER_BUCKETS)
+
+# Stage durations of the current request, for its Server-Timing header
+_request_stages: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar("request_stages", default=None)
+
+
+def record_stage(stage: str, seconds: float):
+    """Record time spent in a request stage, in the histogram and in the request's Server-Timing."""
+    if not METRICS_ENABLED:
+        return
+    stage_latency.observe(seconds, stage)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+class span:
+    """Time the block as one stage of the current request (a class: cheaper than a generator context manager)."""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.stage, time.perf_counter() - self.start)
+
+
+def server_timing(stages: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in stages.items())
+
+
+class RequestMetricsMiddleware:
+    """
+    Plain ASGI middleware timing every request per route template and status, and adding a
+    Server-Timing header with the request's stages. Plain ASGI rather than @app.middleware("http"),
+    which runs the rest of the app in a separate task and costs far more per request.
+    """
+
+    def __init__(self, app, app_name: str, tenant_of: Optional[Callable[[str], Optional[str]]] = None):
+        self.app = app
+        self.app_name = app_name
+        self.tenant_of = tenant_of
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        stages = _request_stages.get()
+        token = None
+        if stages is None:
+            # The outermost instrumented app owns the request's stage timings; a mounted app shares them
+            stages = {}
+            token = _request_stages.set(stages)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if token is not None and stages:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", server_timing(stages).encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            # The innermost matched route; root_path carries the prefix of mounted apps, e.g. "/db"
+            template = getattr(scope.get("route"), "path_format", None)
+            template = scope.get("root_path", "") + template if template else "<unmatched>"
+            http_requests.inc(self.app_name, scope["method"], template, str(status))
+            http_latency.observe(elapsed, self.app_name, scope["method"], template)
+            if self.tenant_of is not None:
+                username = self.tenant_of(scope["path"])
+                if username is not None:
+                    tenant_latency.observe(elapsed, registry.tenant_label(username))
+            if token is not None:
+                _request_stages.reset(token)
+
+
+def instrument(app, app_name: str, tenant_of: Optional[Callable[[str], Optional[str]]] = None):
+    """
+    Add request metrics to a FastAPI app (nothing when METRICS_ENABLED=0).
+
+    Parameters:
+    - app: The FastAPI application; call this after adding its other middleware so it runs outermost.
+    - app_name: Value of the "app" label, e.g. "main" or "db".
+    - tenant_of: Maps a request path to its tenant, for the per-tenant latency histogram.
+    """
+    if METRICS_ENABLED:
+        app.add_middleware(RequestMetricsMiddleware, app_name=app_name, tenant_of=tenant_of)
@@ -1,6 +1,13 @@
 from sqlalchemy import Table, Column, Integer, String, Float, Boolean, MetaData, text
-from sqlalchemy.orm import Session
-from typing import Dict
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import TextClause
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+import csv
+import io
+import os
+import re
 
 # Mapping of string type names to SQLAlchemy types
 type_mapping = {
@@ -11,7 +18,34 @@ type_mapping = {
     # Add more types as needed
 }
 
-metadata = MetaData()
+# Page size used when a read does not ask for one, and the largest page a client may request
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# Rows fetched per round trip when streaming a table through a server-side cursor
+STREAM_BATCH_SIZE = 1000
+
+# Rows per transaction for bulk ingestion, and the chunk size from which COPY replaces executemany
+BULK_CHUNK_SIZE = 5000
+BULK_COPY_THRESHOLD = 500
+
+# Built INSERT/UPDATE/DELETE statements kept across requests (0 disables the cache)
+STATEMENT_CACHE_SIZE = int(os.getenv("STATEMENT_CACHE_SIZE", "4096"))
+
+# Install the change log (read by changefeed.py) on every table created through the API; off, tables
+# opt in one at a time through POST .../changes
+CHANGE_TRACKING = os.getenv("CHANGE_TRACKING", "0") == "1"
+# Per-table cap on change log entries (0 keeps everything); the logging trigger drops the oldest
+# transactions' entries past it, and reads from before them get a 410 asking for a full read
+CHANGE_LOG_MAX_ENTRIES = int(os.getenv("CHANGE_LOG_MAX_ENTRIES", "1000000"))
+# Bookkeeping tables of the change log, kept out of the tenant's table listings
+CHANGE_LOG_TABLE = "_change_log"
+CHANGE_FLOOR_TABLE = "_change_floor"
+
+IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Quotes exactly the names Postgres would otherwise fold or reject (mixed case, reserved words),
+# matching how SQLAlchemy names the columns of tables made by create_table_in_db
+_identifier_preparer = postgresql.dialect().identifier_preparer
 
 def create_table(metadata: MetaData, table_name: str, columns: Dict[str, str]) -> Table:
     """
@@ -39,61 +73,308 @@ def create_table(metadata: MetaData, table_name: str, columns: Dict[str, str]) -
     # Create and return the Table object
     return Table(table_name, metadata, *sql_columns)
 
-def create_table_in_db(session: Session, table_name: str, columns: Dict[str, str]) -> Dict[str, str]:
+async def create_table_in_db(session: AsyncSession, table_name: str, columns: Dict[str, str]) -> Dict[str, str]:
     """
     Dynamically create a table in the database.
 
     Parameters:
-    - session: SQLAlchemy Session instance.
+    - session: SQLAlchemy AsyncSession instance.
     - table_name: The name of the table to create.
     - columns: A dictionary where keys are column names and values are SQLAlchemy column type names as strings.
 
     Returns:
     - A message indicating the success of the table creation.
     """
-    table = create_table(metadata, table_name, columns)
-    metadata.create_all(bind=session.bind)
+    # A throwaway MetaData per call: a shared one would accumulate every tenant's tables
+    table = create_table(MetaData(), validate_identifier(table_name), columns)
+    conn = await session.connection()
+    await conn.run_sync(table.create, checkfirst=True)
+    if CHANGE_TRACKING:
+        for statement in change_tracking_statements(table_name):
+            await conn.exec_driver_sql(statement)
+    await session.commit()
     return {"message": f"Table {table_name} created successfully"}
 
-def insert_item(session: Session, table_name: str, item: Dict[str, any]) -> None:
+# Objects shared by every tracked table of a tenant, created on first use. Statement-level triggers
+# append the ids a statement touched to _change_log, with the writing transaction's id, so a bulk
+# load costs one extra INSERT ... SELECT rather than one per row. _change_floor records, per table,
+# the transaction from which the log is known to be whole (tracking enabled, TRUNCATE, pruning) and
+# whether the table was empty then, i.e. whether replaying the log alone rebuilds it.
+# With CHANGE_LOG_MAX_ENTRIES set, a logging statement checks the cap with a probability proportional to
+# the rows it logged, about once per quarter of the cap, so a table's log stays near the cap while
+# the check costs a few index entries per logged row.
+_TRIM_CHANGE_LOG = f"""
+    GET DIAGNOSTICS logged = ROW_COUNT;
+    IF random() < logged * 4.0 / {CHANGE_LOG_MAX_ENTRIES} THEN
+        PERFORM _trim_change_log(TG_TABLE_NAME, {CHANGE_LOG_MAX_ENTRIES});
+    END IF;""" if CHANGE_LOG_MAX_ENTRIES > 0 else ""
+
+CHANGE_TRACKING_SETUP = [
+    # Serializes concurrent setups of the same tenant (CREATE OR REPLACE FUNCTION is not concurrency safe)
+    "SELECT pg_advisory_xact_lock(hashtext('_change_log'))",
+    f"""CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    table_name TEXT NOT NULL,
+    row_id BIGINT NOT NULL
+)""",
+    f"CREATE INDEX IF NOT EXISTS {CHANGE_LOG_TABLE}_table_txid ON {CHANGE_LOG_TABLE} (table_name, txid)",
+    f"""CREATE TABLE IF NOT EXISTS {CHANGE_FLOOR_TABLE} (
+    table_name TEXT PRIMARY KEY,
+    relid OID NOT NULL,
+    txid BIGINT NOT NULL,
+    complete BOOLEAN NOT NULL
+)""",
+    f"""CREATE OR REPLACE FUNCTION _trim_change_log(target_name TEXT, keep BIGINT) RETURNS BIGINT LANGUAGE plpgsql AS $$
+DECLARE
+    cutoff BIGINT;
+    deleted BIGINT;
+BEGIN
+    SELECT txid INTO cutoff FROM {CHANGE_LOG_TABLE} WHERE table_name = target_name ORDER BY txid DESC OFFSET keep LIMIT 1;
+    IF cutoff IS NULL THEN
+        RETURN 0;
+    END IF;
+    -- Only ended transactions: one still running could log below the cut after it was made
+    cutoff := LEAST(cutoff, txid_snapshot_xmin(txid_current_snapshot()) - 1);
+    -- As in ChangeFeed.prune: raise the floor so reads from before the cut get a 410
+    UPDATE {CHANGE_FLOOR_TABLE} SET txid = GREATEST(txid, cutoff + 1), complete = FALSE WHERE table_name = target_name;
+    DELETE FROM {CHANGE_LOG_TABLE} WHERE table_name = target_name AND txid <= cutoff;
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END
+$$""",
+    f"""CREATE OR REPLACE FUNCTION _log_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    logged BIGINT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO {CHANGE_LOG_TABLE} (table_name, row_id) SELECT TG_TABLE_NAME, id FROM new_rows;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- The old ids too: an update that changes an id removes the old row
+        INSERT INTO {CHANGE_LOG_TABLE} (table_name, row_id)
+        SELECT TG_TABLE_NAME, id FROM new_rows UNION SELECT TG_TABLE_NAME, id FROM old_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO {CHANGE_LOG_TABLE} (table_name, row_id) SELECT TG_TABLE_NAME, id FROM old_rows;
+    ELSE
+        DELETE FROM {CHANGE_LOG_TABLE} WHERE table_name = TG_TABLE_NAME;
+        UPDATE {CHANGE_FLOOR_TABLE} SET txid = txid_current(), complete = TRUE WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END IF;{_TRIM_CHANGE_LOG}
+    RETURN NULL;
+END
+$$""",
+    f"""CREATE OR REPLACE FUNCTION _track_changes(target regclass) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    target_name TEXT;
+    empty BOOLEAN;
+BEGIN
+    SELECT relname INTO target_name FROM pg_class WHERE oid = target;
+    IF EXISTS (SELECT 1 FROM {CHANGE_FLOOR_TABLE} WHERE table_name = target_name AND relid = target::oid) THEN
+        RETURN;
+    END IF;
+    EXECUTE format('SELECT NOT EXISTS (SELECT 1 FROM %s)', target) INTO empty;
+    -- Entries left by an earlier table of the same name
+    DELETE FROM {CHANGE_LOG_TABLE} WHERE table_name = target_name;
+    INSERT INTO {CHANGE_FLOOR_TABLE} (table_name, relid, txid, complete)
+    VALUES (target_name, target::oid, txid_current(), empty)
+    ON CONFLICT (table_name) DO UPDATE SET relid = EXCLUDED.relid, txid = EXCLUDED.txid, complete = EXCLUDED.complete;
+    EXECUTE format('DROP TRIGGER IF EXISTS _changes_insert ON %s', target);
+    EXECUTE format('DROP TRIGGER IF EXISTS _changes_update ON %s', target);
+    EXECUTE format('DROP TRIGGER IF EXISTS _changes_delete ON %s', target);
+    EXECUTE format('DROP TRIGGER IF EXISTS _changes_truncate ON %s', target);
+    EXECUTE format('CREATE TRIGGER _changes_insert AFTER INSERT ON %s REFERENCING NEW TABLE AS new_rows '
+                   'FOR EACH STATEMENT EXECUTE PROCEDURE _log_changes()', target);
+    EXECUTE format('CREATE TRIGGER _changes_update AFTER UPDATE ON %s REFERENCING OLD TABLE AS old_rows '
+                   'NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE _log_changes()', target);
+    EXECUTE format('CREATE TRIGGER _changes_delete AFTER DELETE ON %s REFERENCING OLD TABLE AS old_rows '
+                   'FOR EACH STATEMENT EXECUTE PROCEDURE _log_changes()', target);
+    EXECUTE format('CREATE TRIGGER _changes_truncate AFTER TRUNCATE ON %s '
+                   'FOR EACH STATEMENT EXECUTE PROCEDURE _log_changes()', target);
+END
+$$""",
+]
+
+def change_tracking_statements(table_name: str) -> List[str]:
+    """
+    Build the statements that start tracking a table's changes; run them in one transaction.
+
+    Parameters:
+    - table_name: The table to track; it must have an integer 'id' primary key.
+
+    Returns:
+    - The shared setup statements, then the call installing the table's triggers (a no-op when
+      the table is tracked already).
+    """
+    return CHANGE_TRACKING_SETUP + [f"SELECT _track_changes('{quote_identifier(table_name)}')"]
+
+async def insert_item(session: AsyncSession, table_name: str, item: Dict[str, any]) -> None:
     """
     Insert a new item into the specified table.
 
     Parameters:
-    - session: SQLAlchemy Session instance.
+    - session: SQLAlchemy AsyncSession instance.
     - table_name: The name of the table to insert the item into.
     - item: A dictionary representing the item to insert.
 
     Returns:
     - None
     """
-    columns = ', '.join(item.keys())
-    values = ', '.join(f":{key}" for key in item.keys())
-    query = f"INSERT INTO {table_name} ({columns}) VALUES ({values})"
-    session.execute(text(query), item)
-    session.commit()
+    statement = statement_cache.get("insert", table_name, tuple(sorted(item)))
+    await session.execute(statement, item)
+    await session.commit()
+
+def validate_identifier(name: str) -> str:
+    """
+    Check that a table or column name is a plain SQL identifier before it is put into SQL text.
+
+    Parameters:
+    - name: The identifier to check.
+
+    Returns:
+    - The identifier unchanged.
+    """
+    if not IDENTIFIER_PATTERN.match(name):
+        raise ValueError(f"Invalid identifier: {name}")
+    return name
+
+def quote_identifier(name: str) -> str:
+    """Validate a table or column name and quote it for SQL text if Postgres requires it."""
+    return _identifier_preparer.quote(validate_identifier(name))
+
+def _build_statement(operation: str, table_name: str, columns: Tuple[str, ...]) -> str:
+    table = quote_identifier(table_name)
+    quoted = [quote_identifier(column) for column in columns]
+    if operation in ("insert", "upsert"):
+        if not columns:
+            return f"INSERT INTO {table} DEFAULT VALUES"
+        values = ', '.join(f":{column}" for column in columns)
+        query = f"INSERT INTO {table} ({', '.join(quoted)}) VALUES ({values})"
+        return query + _upsert_clause(columns) if operation == "upsert" else query
+    if operation == "update":
+        assignments = ', '.join(f"{name} = :{column}" for name, column in zip(quoted, columns))
+        return f"UPDATE {table} SET {assignments} WHERE id = :id"
+    if operation == "delete":
+        return f"DELETE FROM {table} WHERE id = :id"
+    raise ValueError(f"Unknown statement operation: {operation}")
+
+class StatementCache:
+    """
+    LRU of built text() statements keyed by (operation, table, column names).
+
+    The SQL text only depends on the table and the columns written, so one entry serves every
+    tenant with that table shape; reusing the TextClause also reuses SQLAlchemy's compiled form.
+    Parsing and planning are saved on the Postgres side by asyncpg's per-connection prepared
+    statement cache, which is keyed by this same SQL text.
+    """
+
+    def __init__(self, max_size: int = STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, TextClause]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, operation: str, table_name: str, columns: Sequence[str] = ()) -> TextClause:
+        """Return the statement for `operation` on `table_name` writing `columns`, building it on a miss."""
+        key = (operation, table_name, tuple(columns))
+        statement = self._entries.get(key)
+        if statement is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return statement
+        self.misses += 1
+        # Identifiers are validated here, so a cached key is always made of valid names
+        statement = text(_build_statement(operation, table_name, key[2]))
+        if self.max_size > 0:
+            self._entries[key] = statement
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return statement
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+statement_cache = StatementCache()
+
+def page_size(limit: Optional[int]) -> int:
+    """Clamp a requested page size to [1, MAX_PAGE_SIZE], defaulting to DEFAULT_PAGE_SIZE."""
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def keyset_page_query(table_name: str, limit: Optional[int] = None, after_id: Optional[int] = None) -> str:
+    """
+    Build a keyset (cursor) pagination query over the table's 'id' primary key.
+
+    Parameters:
+    - table_name: The name of the table to read.
+    - limit: Maximum number of rows in the page.
+    - after_id: Only rows with an id greater than this are returned.
 
-def get_items(session: Session, table_name: str) -> list:
+    Returns:
+    - The SQL text; limit and after_id are integers and are inlined so the query also runs through psql.
+    """
+    where = f" WHERE id > {int(after_id)}" if after_id is not None else ""
+    return f"SELECT * FROM {quote_identifier(table_name)}{where} ORDER BY id LIMIT {page_size(limit)}"
+
+def full_scan_query(table_name: str) -> str:
+    """Build the query used to stream a whole table in primary-key order."""
+    return f"SELECT * FROM {quote_identifier(table_name)} ORDER BY id"
+
+async def get_items(session: AsyncSession, table_name: str, limit: Optional[int] = None, after_id: Optional[int] = None) -> list:
     """
-    Retrieve all items from the specified table.
+    Retrieve one page of items from the specified table.
 
     Parameters:
-    - session: SQLAlchemy Session instance.
+    - session: SQLAlchemy AsyncSession instance.
     - table_name: The name of the table to retrieve items from.
+    - limit: Maximum number of items to return (defaults to DEFAULT_PAGE_SIZE).
+    - after_id: Return only items whose id is greater than this value.
 
     Returns:
-    - A list of items (rows) from the table.
+    - A list of items (rows as dictionaries) from the table, ordered by id.
     """
-    query = f"SELECT * FROM {table_name}"
-    result = session.execute(text(query))
-    return result.fetchall()
+    result = await session.execute(text(keyset_page_query(table_name, limit, after_id)))
+    return [dict(row) for row in result.mappings()]
 
-def update_item(session: Session, table_name: str, item_id: int, item: Dict[str, any]) -> None:
+async def stream_items(session: AsyncSession, table_name: str, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Iterate over every item of the specified table through a server-side cursor.
+
+    Parameters:
+    - session: SQLAlchemy AsyncSession instance.
+    - table_name: The name of the table to stream.
+    - batch_size: Number of rows fetched from the cursor at a time.
+
+    Yields:
+    - (columns, rows) tuples, one per batch; an empty table yields its columns once with no rows.
+    """
+    result = await session.stream(text(full_scan_query(table_name)))
+    columns = list(result.keys())
+    empty = True
+    async for partition in result.partitions(batch_size):
+        empty = False
+        yield columns, partition
+    if empty:
+        yield columns, []
+
+async def update_item(session: AsyncSession, table_name: str, item_id: int, item: Dict[str, any]) -> None:
     """
     Update an item in the specified table.
 
     Parameters:
-    - session: SQLAlchemy Session instance.
+    - session: SQLAlchemy AsyncSession instance.
     - table_name: The name of the table to update the item in.
     - item_id: The ID of the item to update.
     - item: A dictionary representing the new values for the item.
@@ -101,24 +382,94 @@ def update_item(session: Session, table_name: str, item_id: int, item: Dict[str,
     Returns:
     - None
     """
-    columns = ', '.join(f"{key} = :{key}" for key in item.keys())
-    query = f"UPDATE {table_name} SET {columns} WHERE id = :id"
-    item['id'] = item_id
-    session.execute(text(query), item)
-    session.commit()
+    statement = statement_cache.get("update", table_name, tuple(sorted(item)))
+    # WHERE id = :id shares its parameter with a SET id, so an 'id' in the item is overridden
+    await session.execute(statement, dict(item, id=item_id))
+    await session.commit()
 
-def delete_item(session: Session, table_name: str, item_id: int) -> None:
+async def delete_item(session: AsyncSession, table_name: str, item_id: int) -> None:
     """
     Delete an item from the specified table.
 
     Parameters:
-    - session: SQLAlchemy Session instance.
+    - session: SQLAlchemy AsyncSession instance.
     - table_name: The name of the table to delete the item from.
     - item_id: The ID of the item to delete.
 
     Returns:
     - None
     """
-    query = f"DELETE FROM {table_name} WHERE id = :id"
-    session.execute(text(query), {"id": item_id})
-    session.commit()
+    await session.execute(statement_cache.get("delete", table_name), {"id": item_id})
+    await session.commit()
+
+def _upsert_clause(columns: Sequence[str]) -> str:
+    quoted = [quote_identifier(column) for column in columns if column != 'id']
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in quoted)
+    return f" ON CONFLICT (id) DO UPDATE SET {updates}" if updates else " ON CONFLICT (id) DO NOTHING"
+
+async def _insert_values_chunk(session: AsyncSession, table_name: str, columns: List[str], records: List[tuple], upsert: bool) -> None:
+    # One prepared INSERT executed for every row of the chunk (executemany)
+    statement = statement_cache.get("upsert" if upsert else "insert", table_name, tuple(columns))
+    await session.execute(statement, [dict(zip(columns, record)) for record in records])
+
+async def _copy_chunk(session: AsyncSession, table_name: str, columns: List[str], records: List[tuple], upsert: bool,
+                      text_format: bool) -> None:
+    target = table_name
+    if upsert:
+        # COPY cannot resolve conflicts, so load a temporary table and merge it into the target
+        target = f"_bulk_{table_name}"
+        await session.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {quote_identifier(target)} "
+                                   f"(LIKE {quote_identifier(table_name)} INCLUDING DEFAULTS) ON COMMIT DROP"))
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection
+    if text_format:
+        # Values arrive as text (CSV uploads); let Postgres parse them with COPY ... (FORMAT csv)
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(records)
+        await driver.copy_to_table(target, source=io.BytesIO(buffer.getvalue().encode('utf-8')), columns=columns, format='csv')
+    else:
+        await driver.copy_records_to_table(target, records=records, columns=columns)
+    if upsert:
+        column_list = ', '.join(quote_identifier(column) for column in columns)
+        await session.execute(text(f"INSERT INTO {quote_identifier(table_name)} ({column_list}) SELECT {column_list} "
+                                   f"FROM {quote_identifier(target)}{_upsert_clause(columns)}"))
+
+async def bulk_insert_items(session: AsyncSession, table_name: str, columns: List[str], records: List[tuple],
+                            upsert: bool = False, text_format: bool = False, chunk_size: int = BULK_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Insert many items into the specified table, committing once per chunk.
+
+    Chunks smaller than BULK_COPY_THRESHOLD are sent as one executemany INSERT; larger chunks,
+    and every chunk of text (CSV) values, are loaded with COPY FROM STDIN.
+
+    Parameters:
+    - session: SQLAlchemy AsyncSession instance.
+    - table_name: The name of the table to insert the items into.
+    - columns: The column names, in the order of the values in each record.
+    - records: The rows to insert, as tuples aligned with columns.
+    - upsert: Update existing rows on an 'id' conflict instead of failing.
+    - text_format: The values are strings to be parsed by Postgres (CSV input).
+    - chunk_size: Number of rows per transaction.
+
+    Returns:
+    - A report with the number of rows inserted, chunks committed and per-chunk errors.
+    """
+    validate_identifier(table_name)
+    for column in columns:
+        validate_identifier(column)
+    report = {"inserted": 0, "chunks": 0, "errors": []}
+    for index, start in enumerate(range(0, len(records), chunk_size)):
+        chunk = records[start:start + chunk_size]
+        try:
+            if text_format or len(chunk) >= BULK_COPY_THRESHOLD:
+                await _copy_chunk(session, table_name, columns, chunk, upsert, text_format)
+            else:
+                await _insert_values_chunk(session, table_name, columns, chunk, upsert)
+            await session.commit()
+            report["inserted"] += len(chunk)
+            report["chunks"] += 1
+        except Exception as e:
+            await session.rollback()
+            report["errors"].append({"chunk": index, "first_row": start, "rows": len(chunk), "error": str(e)})
+    return report
@@ -0,0 +1,223 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+# Host ports handed to tenant containers, inclusive; nothing else on the host should bind in this range
+TENANT_PORT_RANGE_START = int(os.getenv("TENANT_PORT_RANGE_START", "20000"))
+TENANT_PORT_RANGE_END = int(os.getenv("TENANT_PORT_RANGE_END", "29999"))
+# Ports inside the range that must never be handed out, e.g. "20080,21000-21099"
+TENANT_PORT_RESERVED = os.getenv("TENANT_PORT_RESERVED", "")
+# Ledger rows younger than this are kept by reconciliation even without a container (one may be starting)
+TENANT_PORT_GRACE_SECONDS = float(os.getenv("TENANT_PORT_GRACE_SECONDS", "300"))
+
+PORT_LEDGER_DDL = '''
+    CREATE TABLE IF NOT EXISTS tenant_ports (
+        port INTEGER PRIMARY KEY,
+        owner VARCHAR(100) NOT NULL,
+        allocated_at TIMESTAMP NOT NULL DEFAULT now()
+    );
+'''
+
+
+def parse_port_ranges(spec: str) -> set:
+    """Parse "a,b-c" into the set of ports it names."""
+    ports = set()
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        low, _, high = part.partition("-")
+        ports.update(range(int(low), int(high or low) + 1))
+    return ports
+
+
+class PortAllocator:
+    """
+    Hand out tenant host ports from a reserved range with an in-memory free list.
+
+    The main database's tenant_ports table is the ledger shared by every backend process:
+    an allocation is an INSERT that only succeeds for a port nobody holds, so two processes
+    never publish the same port. Ports are owned by container name and released by it.
+    Until load() has read the ledger the allocator works in memory only (benchmarks, tests).
+    """
+
+    def __init__(self, start: int = TENANT_PORT_RANGE_START, end: int = TENANT_PORT_RANGE_END,
+                 reserved: str = TENANT_PORT_RESERVED, engine=None, grace_seconds: float = TENANT_PORT_GRACE_SECONDS):
+        if start > end:
+            raise ValueError(f"Empty tenant port range {start}-{end}")
+        self.start = start
+        self.end = end
+        self.reserved = parse_port_ranges(reserved)
+        self.engine = engine
+        self.grace_seconds = grace_seconds
+        self.persistent = False
+        self._lock = threading.Lock()
+        self._owners: Dict[int, str] = {}
+        self._by_owner: Dict[str, int] = {}
+        self._allocated_at: Dict[int, float] = {}
+        # Ports Docker refused (bound by something outside the ledger); skipped until restart
+        self._blocked = set()
+        # Free list; entries that were since taken are skipped lazily when popped
+        self._free = deque(port for port in range(start, end + 1) if port not in self.reserved)
+        self.capacity = len(self._free)
+        self.allocations = 0
+        self.releases = 0
+        self.conflicts = 0
+
+    def load(self):
+        """Read the ledger and persist every later allocation to it."""
+        with self._lock, self.engine.connect() as conn:
+            conn.execute(text(PORT_LEDGER_DDL))
+            conn.commit()
+            rows = conn.execute(text("SELECT port, owner FROM tenant_ports")).all()
+            self._owners, self._by_owner, self._allocated_at = {}, {}, {}
+            for port, owner in rows:
+                self._assign(port, owner)
+            self._free = deque(port for port in range(self.start, self.end + 1)
+                               if port not in self.reserved and port not in self._owners)
+            self.persistent = True
+        logging.info(f"Tenant port ledger loaded: {len(self._owners)} allocated, {len(self._free)} free")
+
+    def _claim_in_ledger(self, port: int, owner: str) -> bool:
+        with self.engine.begin() as conn:
+            claimed = conn.execute(text(
+                "INSERT INTO tenant_ports (port, owner) VALUES (:port, :owner) ON CONFLICT (port) DO NOTHING RETURNING port"
+            ), {"port": port, "owner": owner}).first()
+        return claimed is not None
+
+    def allocate(self, owner: str) -> int:
+        """
+        Take the next free port for the container `owner`; raises RuntimeError when the range is exhausted.
+
+        An owner holds at most one port: allocating again (a retried container start) returns the
+        port it already holds, which would otherwise stay in the ledger with no way to release it.
+        """
+        with self._lock:
+            held = self._by_owner.get(owner)
+            if held is not None:
+                return held
+            while self._free:
+                port = self._free.popleft()
+                if port in self._owners or port in self._blocked:
+                    continue
+                if self.persistent and not self._claim_in_ledger(port, owner):
+                    # Taken by another backend process since the ledger was loaded
+                    self.conflicts += 1
+                    self._assign(port, f"<other process {port}>")
+                    continue
+                self._assign(port, owner)
+                self.allocations += 1
+                return port
+        raise RuntimeError(f"No free tenant ports left in {self.start}-{self.end}")
+
+    def release(self, owner: str) -> Optional[int]:
+        """Return the port held by `owner` to the free list."""
+        with self._lock:
+            port = self._by_owner.get(owner)
+            if port is None:
+                return None
+            self._free_port(port)
+            if self.persistent:
+                with self.engine.begin() as conn:
+                    conn.execute(text("DELETE FROM tenant_ports WHERE port = :port"), {"port": port})
+            self.releases += 1
+            return port
+
+    def _assign(self, port: int, owner: str):
+        previous = self._owners.get(port)
+        if previous is not None:
+            self._by_owner.pop(previous, None)
+        self._owners[port] = owner
+        self._by_owner[owner] = port
+        self._allocated_at[port] = time.monotonic()
+
+    def _unassign(self, port: int):
+        self._by_owner.pop(self._owners.pop(port), None)
+        self._allocated_at.pop(port, None)
+
+    def _free_port(self, port: int):
+        self._unassign(port)
+        if self.start <= port <= self.end and port not in self.reserved:
+            self._free.append(port)
+
+    def rename(self, old_owner: str, new_owner: str):
+        """Follow a container rename (a warm container claimed by a tenant)."""
+        with self._lock:
+            port = self._by_owner.get(old_owner)
+            if port is None:
+                return
+            if new_owner in self._by_owner:
+                raise RuntimeError(f"Cannot rename {old_owner} to {new_owner}: it already holds port {self._by_owner[new_owner]}")
+            self._assign(port, new_owner)
+            if self.persistent:
+                with self.engine.begin() as conn:
+                    conn.execute(text("UPDATE tenant_ports SET owner = :new WHERE owner = :old"),
+                                 {"new": new_owner, "old": old_owner})
+
+    def block(self, port: int, owner: str):
+        """Drop a port Docker could not bind; it stays out of the free list until restart."""
+        with self._lock:
+            self._blocked.add(port)
+            if self._owners.get(port) == owner:
+                self._unassign(port)
+                if self.persistent:
+                    with self.engine.begin() as conn:
+                        conn.execute(text("DELETE FROM tenant_ports WHERE port = :port"), {"port": port})
+
+    def reconcile(self, in_use: Dict[int, str]) -> Dict[str, Any]:
+        """
+        Sync the ledger with the ports containers actually publish.
+
+        Parameters:
+        - in_use: Host port -> container name, for every tenant and warm container (running or not).
+
+        Returns:
+        - The ports freed (ledger entries past the grace period with no container), adopted
+          (published by a container but missing from the ledger) and re-owned.
+        """
+        report = {"freed": [], "adopted": [], "reowned": []}
+        now = time.monotonic()
+        with self._lock:
+            for port, owner in list(self._owners.items()):
+                if port not in in_use and now - self._allocated_at.get(port, now) >= self.grace_seconds:
+                    self._free_port(port)
+                    report["freed"].append(port)
+            for port, name in in_use.items():
+                if not self.start <= port <= self.end:
+                    continue
+                if port not in self._owners:
+                    report["adopted"].append(port)
+                elif self._owners[port] != name:
+                    report["reowned"].append(port)
+                else:
+                    continue
+                self._assign(port, name)
+            if self.persistent and any(report.values()):
+                with self.engine.begin() as conn:
+                    for port in report["freed"]:
+                        conn.execute(text("DELETE FROM tenant_ports WHERE port = :port"), {"port": port})
+                    for port in report["adopted"] + report["reowned"]:
+                        conn.execute(text(
+                            "INSERT INTO tenant_ports (port, owner) VALUES (:port, :owner) "
+                            "ON CONFLICT (port) DO UPDATE SET owner = EXCLUDED.owner"
+                        ), {"port": port, "owner": in_use[port]})
+        return report
+
+    def port_of(self, owner: str) -> Optional[int]:
+        return self._by_owner.get(owner)
+
+    def stats(self) -> Dict[str, Any]:
+        allocated = len(self._owners)
+        return {
+            "range": f"{self.start}-{self.end}",
+            "persistent": self.persistent,
+            "capacity": self.capacity,
+            "allocated": allocated,
+            "free": self.capacity - allocated - len(self._blocked - set(self._owners)),
+            "blocked": sorted(self._blocked),
+            "allocations": self.allocations,
+            "releases": self.releases,
+            "conflicts": self.conflicts,
+        }
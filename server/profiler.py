@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+# Opt-in: QUERY_PROFILER_ENABLED=1 records every statement run on tenant pools
+QUERY_PROFILER_ENABLED = os.getenv("QUERY_PROFILER_ENABLED", "0") == "1"
+# Statements at least this slow go to the slow query log (and the application log)
+QUERY_PROFILER_SLOW_MS = float(os.getenv("QUERY_PROFILER_SLOW_MS", "200"))
+# Slow statements kept in the ring buffer, and (tenant, fingerprint) aggregates kept (least recently seen first out)
+QUERY_PROFILER_SLOW_LOG_SIZE = int(os.getenv("QUERY_PROFILER_SLOW_LOG_SIZE", "1000"))
+QUERY_PROFILER_MAX_FINGERPRINTS = int(os.getenv("QUERY_PROFILER_MAX_FINGERPRINTS", "5000"))
+# Fraction of slow SELECTs re-run read-only under EXPLAIN (ANALYZE, BUFFERS) for a plan summary (0 disables), and how many at once
+QUERY_PROFILER_EXPLAIN_SAMPLE_RATE = float(os.getenv("QUERY_PROFILER_EXPLAIN_SAMPLE_RATE", "0.05"))
+QUERY_PROFILER_MAX_EXPLAINS = int(os.getenv("QUERY_PROFILER_MAX_EXPLAINS", "2"))
+
+# Longest statement text kept per fingerprint
+MAX_QUERY_TEXT = 2000
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING = re.compile(r"(?:[eE])?'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+# asyncpg's $1, psycopg2's %(name)s and SQLAlchemy's :name (not a ::type cast)
+_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|(?<!:):[A-Za-z_]\w*")
+# IN lists and VALUES rows of placeholders, then runs of VALUES rows
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROW_LIST = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql: str) -> tuple:
+    """
+    Normalize a statement so calls differing only in literals and parameters group together.
+
+    Returns:
+    - (fingerprint id, normalized text): comments dropped, literals and bind parameters replaced
+      by ?, IN and VALUES lists collapsed, whitespace squeezed.
+    """
+    normalized = _COMMENT.sub(" ", sql)
+    normalized = _STRING.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _PARAMETER.sub("?", normalized)
+    normalized = _WHITESPACE.sub(" ", normalized).strip().rstrip(";").strip()
+    normalized = _PLACEHOLDER_LIST.sub("(...)", normalized)
+    normalized = _ROW_LIST.sub("(...), ...", normalized)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16], normalized[:MAX_QUERY_TEXT]
+
+
+def summarize_plan(plan: Any) -> Dict[str, Any]:
+    """Condense EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output to what points at a missing index."""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]
+    nodes, stack = [], [root["Plan"]]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get("Plans", ()))
+    top = root["Plan"]
+
+    def relations(*node_types):
+        return sorted({node["Relation Name"] for node in nodes
+                       if node["Node Type"] in node_types and "Relation Name" in node})
+
+    return {
+        "node": top["Node Type"],
+        "total_cost": top.get("Total Cost"),
+        "plan_rows": top.get("Plan Rows"),
+        "actual_rows": top.get("Actual Rows"),
+        "planning_ms": root.get("Planning Time"),
+        "execution_ms": root.get("Execution Time"),
+        "shared_hit_blocks": top.get("Shared Hit Blocks"),
+        "shared_read_blocks": top.get("Shared Read Blocks"),
+        "seq_scans": relations("Seq Scan"),
+        "index_scans": relations("Index Scan", "Index Only Scan", "Bitmap Heap Scan"),
+        "rows_removed_by_filter": sum(node.get("Rows Removed by Filter", 0) for node in nodes),
+        "sorts": sum(1 for node in nodes if node["Node Type"] == "Sort"),
+    }
+
+
+class _QueryStats:
+    __slots__ = ("tenant", "fingerprint", "query", "calls", "errors", "total_ms", "min_ms", "max_ms", "rows",
+                 "last_seen", "plan", "plan_sampled_at")
+
+    def __init__(self, tenant: str, fingerprint_id: str, query: str):
+        self.tenant = tenant
+        self.fingerprint = fingerprint_id
+        self.query = query
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+        self.rows = 0
+        self.last_seen = 0.0
+        self.plan: Optional[Dict[str, Any]] = None
+        self.plan_sampled_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tenant": self.tenant,
+            "fingerprint": self.fingerprint,
+            "query": self.query,
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else None,
+            "min_ms": round(self.min_ms, 3) if self.calls else None,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "last_seen": self.last_seen,
+            "plan": self.plan,
+            "plan_sampled_at": self.plan_sampled_at,
+        }
+
+
+class QueryProfiler:
+    """
+    Per-tenant statement statistics keyed by fingerprint, plus a ring buffer of slow statements.
+
+    Tenant engines report every cursor execution through SQLAlchemy events (see attach), so the
+    raw SQL endpoints, the models.py helpers and batches are all covered. A sampled fraction of
+    slow SELECTs is re-run in the background under EXPLAIN (ANALYZE, BUFFERS) inside a read-only,
+    rolled-back transaction, and the plan summary is attached to the fingerprint.
+    """
+
+    def __init__(self, enabled: bool = QUERY_PROFILER_ENABLED, slow_ms: float = QUERY_PROFILER_SLOW_MS,
+                 slow_log_size: int = QUERY_PROFILER_SLOW_LOG_SIZE, max_fingerprints: int = QUERY_PROFILER_MAX_FINGERPRINTS,
+                 explain_sample_rate: float = QUERY_PROFILER_EXPLAIN_SAMPLE_RATE,
+                 max_explains: int = QUERY_PROFILER_MAX_EXPLAINS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.max_fingerprints = max_fingerprints
+        self.explain_sample_rate = explain_sample_rate
+        self.max_explains = max_explains
+        self._stats: "OrderedDict[tuple, _QueryStats]" = OrderedDict()
+        self._slow_log = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        # Fingerprints with an EXPLAIN in flight; the tasks are kept referenced until they finish
+        self._explaining = set()
+        self._explain_tasks = set()
+        self.recorded = 0
+        self.slow = 0
+        self.evictions = 0
+        self.explains = 0
+        self.explain_failures = 0
+
+    def attach(self, engine, tenant: str):
+        """Record every statement a tenant engine runs. Does nothing unless the profiler is enabled."""
+        if not self.enabled:
+            return
+        sync_engine = getattr(engine, "sync_engine", engine)
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+            if context is not None and context.execution_options.get("profile") is False:
+                return
+            rows = cursor.rowcount
+            if rows is None or rows < 0:
+                # SELECTs on asyncpg are fetched in full on execute; the rowcount is only set for DML
+                rows = len(getattr(cursor, "_rows", ()) or ())
+            fingerprint_id = self.record(tenant, statement, elapsed_ms, rows)
+            if elapsed_ms >= self.slow_ms and not executemany:
+                self._maybe_explain(engine, tenant, fingerprint_id, statement, parameters)
+
+        @event.listens_for(sync_engine, "handle_error")
+        def _error(context):
+            conn = context.connection
+            if conn is None or not conn.info.get("query_start"):
+                return
+            elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+            if context.statement is not None:
+                self.record(tenant, context.statement, elapsed_ms, 0, error=str(context.original_exception))
+
+    def record(self, tenant: str, sql: str, elapsed_ms: float, rows: Optional[int] = None,
+               error: Optional[str] = None) -> str:
+        """Add one execution of `sql` for `tenant`; returns the statement's fingerprint id."""
+        fingerprint_id, query = fingerprint(sql)
+        key = (tenant, fingerprint_id)
+        now = time.time()
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _QueryStats(tenant, fingerprint_id, query)
+                while len(self._stats) > self.max_fingerprints:
+                    self._stats.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._stats.move_to_end(key)
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            stats.min_ms = min(stats.min_ms, elapsed_ms)
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.rows += rows or 0
+            stats.last_seen = now
+            if error is not None:
+                stats.errors += 1
+            self.recorded += 1
+            if elapsed_ms >= self.slow_ms:
+                self.slow += 1
+                self._slow_log.append({"tenant": tenant, "fingerprint": fingerprint_id, "query": query,
+                                       "duration_ms": round(elapsed_ms, 3), "rows": rows, "error": error, "at": now})
+        if elapsed_ms >= self.slow_ms:
+            logging.warning(f"Slow query for tenant {tenant} ({elapsed_ms:.1f} ms, fingerprint {fingerprint_id}): {query[:200]}")
+        return fingerprint_id
+
+    def _maybe_explain(self, engine, tenant: str, fingerprint_id: str, statement: str, parameters):
+        if (random.random() >= self.explain_sample_rate or not _EXPLAINABLE.match(statement)
+                or fingerprint_id in self._explaining or len(self._explaining) >= self.max_explains):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._explaining.add(fingerprint_id)
+        task = loop.create_task(self._explain(engine, tenant, fingerprint_id, statement, parameters))
+        self._explain_tasks.add(task)
+        task.add_done_callback(self._explain_tasks.discard)
+
+    async def _explain(self, engine, tenant: str, fingerprint_id: str, statement: str, parameters):
+        try:
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(profile=False)
+                # ANALYZE runs the statement again: a read-only transaction rejects anything that
+                # would write (a volatile function, SELECT ... INTO), and it is never committed
+                transaction = await conn.begin()
+                try:
+                    await conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+                    result = await conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}",
+                                                        parameters or ())
+                    plan = summarize_plan(result.scalar())
+                finally:
+                    await transaction.rollback()
+            with self._lock:
+                stats = self._stats.get((tenant, fingerprint_id))
+                if stats is not None:
+                    stats.plan = plan
+                    stats.plan_sampled_at = time.time()
+            self.explains += 1
+        except Exception as e:
+            self.explain_failures += 1
+            logging.error(f"EXPLAIN of slow query {fingerprint_id} for tenant {tenant} failed: {e}")
+        finally:
+            self._explaining.discard(fingerprint_id)
+
+    def top(self, n: int = 20, order_by: str = "total_ms", tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The n statements with the highest total_ms, mean_ms, max_ms, calls or rows, optionally for one tenant."""
+        if order_by not in ("total_ms", "mean_ms", "max_ms", "calls", "rows"):
+            raise ValueError(f"Cannot order queries by {order_by}")
+        with self._lock:
+            entries = [stats.to_dict() for stats in self._stats.values() if tenant is None or stats.tenant == tenant]
+        entries.sort(key=lambda entry: entry[order_by] or 0, reverse=True)
+        return entries[:n]
+
+    def slow_queries(self, limit: int = 100, tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recent slow statements first."""
+        with self._lock:
+            entries = [entry for entry in reversed(self._slow_log) if tenant is None or entry["tenant"] == tenant]
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow_log.clear()
+
+    def forget_tenant(self, tenant: str):
+        """Drop a deleted tenant's statistics."""
+        with self._lock:
+            for key in [key for key in self._stats if key[0] == tenant]:
+                del self._stats[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "slow_ms": self.slow_ms,
+            "fingerprints": len(self._stats),
+            "max_fingerprints": self.max_fingerprints,
+            "recorded": self.recorded,
+            "slow": self.slow,
+            "slow_log": len(self._slow_log),
+            "evictions": self.evictions,
+            "explain_sample_rate": self.explain_sample_rate,
+            "explains": self.explains,
+            "explain_failures": self.explain_failures,
+            "explains_in_flight": len(self._explaining),
+        }
+
+
+query_profiler = QueryProfiler()
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from adminUtils import save_user_to_db
+from executors import run_blocking
+from models import validate_identifier
+from routing import TenantRoutingCache, tenant_routes
+from schemas import UserCreate
+from tenancy import tenancy as default_tenancy
+
+# Tenants provisioned at once by the job workers
+PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", "8"))
+# Longest a new tenant database may take to accept connections before it is rolled back
+PROVISION_READY_TIMEOUT = float(os.getenv("PROVISION_READY_TIMEOUT", "120"))
+# Largest bulk registration, and how many finished jobs stay queryable
+PROVISION_MAX_JOB_SIZE = int(os.getenv("PROVISION_MAX_JOB_SIZE", "5000"))
+PROVISION_JOB_HISTORY = int(os.getenv("PROVISION_JOB_HISTORY", "1000"))
+
+
+class ProvisioningJob:
+    """A bulk registration: one status entry per tenant, updated by the workers."""
+
+    def __init__(self, usernames: List[str]):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.tenants: Dict[str, Dict[str, Any]] = {username: {"status": "queued"} for username in usernames}
+        self.pending = len(usernames)
+        self.done = asyncio.Event()
+
+    def update(self, username: str, status: str, **details):
+        self.tenants[username] = dict(details, status=status)
+        if status in ("ready", "failed"):
+            self.pending -= 1
+            if self.pending == 0:
+                self.finished_at = time.time()
+                self.done.set()
+
+    @property
+    def status(self) -> str:
+        if self.pending:
+            queued = all(entry["status"] == "queued" for entry in self.tenants.values())
+            return "queued" if queued else "running"
+        failed = sum(1 for entry in self.tenants.values() if entry["status"] == "failed")
+        if not failed:
+            return "succeeded"
+        return "failed" if failed == len(self.tenants) else "partial"
+
+    def to_dict(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for entry in self.tenants.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "counts": counts,
+            "tenants": self.tenants,
+        }
+
+
+class ProvisioningQueue:
+    """
+    Provision tenants in the background with a fixed number of concurrent workers.
+
+    Each tenant goes through the configured tenancy backend (warm pool claim or cold start,
+    or a database/schema on the shared cluster), waits with exponential backoff until its
+    database accepts connections, and is then saved to the users table. A tenant that fails
+    after its database was created is deprovisioned again, so a failed registration leaves
+    nothing behind and can simply be retried.
+    """
+
+    def __init__(self, workers: int = PROVISION_WORKERS, ready_timeout: float = PROVISION_READY_TIMEOUT,
+                 tenancy=default_tenancy, routes: TenantRoutingCache = tenant_routes,
+                 save_user: Callable[..., Any] = save_user_to_db, history: int = PROVISION_JOB_HISTORY):
+        self.workers = workers
+        self.ready_timeout = ready_timeout
+        self.tenancy = tenancy
+        self.routes = routes
+        self.save_user = save_user
+        self.history = history
+        self.jobs: "OrderedDict[str, ProvisioningJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Usernames queued or in flight, so one cannot be provisioned twice at the same time
+        self._active = set()
+        self.provisioned = 0
+        self.failed = 0
+        self.rolled_back = 0
+        self._latencies = deque(maxlen=1000)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(max(1, self.workers))]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def provision_tenant(self, user: UserCreate) -> Dict[str, Any]:
+        """
+        Provision one tenant end to end: create its database, wait until it is ready, save it.
+
+        Parameters:
+        - user: The user details including username and password.
+
+        Returns:
+        - The tenant placement returned by the tenancy backend.
+        """
+        start = time.perf_counter()
+        tenant = await self.tenancy.provision(user)
+        try:
+            await self.tenancy.wait_ready(tenant, self.ready_timeout)
+            await run_blocking(self.save_user, user, tenant["container_id"], tenant["hostname"], tenant["port"],
+                               tenant["tenancy_mode"], tenant["database_name"], tenant["schema_name"])
+        except BaseException:
+            await self._rollback(user, tenant)
+            raise
+        # Drop a cached "unknown user" entry left by requests made before registration
+        self.routes.invalidate(user.username)
+        self.provisioned += 1
+        self._latencies.append(time.perf_counter() - start)
+        return tenant
+
+    async def _rollback(self, user: UserCreate, tenant: Dict[str, Any]):
+        endpoint = {"username": user.username, "tenancy_mode": tenant["tenancy_mode"],
+                    "database_name": tenant["database_name"], "schema_name": tenant["schema_name"]}
+        try:
+            await self.tenancy.deprovision(endpoint)
+            self.rolled_back += 1
+        except Exception as e:
+            logging.error(f"Failed to roll back provisioning of tenant {user.username}: {e}")
+
+    def submit(self, users: List[UserCreate]) -> ProvisioningJob:
+        """
+        Queue a bulk registration and return its job at once.
+
+        Invalid, in-flight and already registered usernames are reported as failed in the
+        job instead of rejecting the whole request; duplicates within the request raise ValueError.
+        """
+        if self._queue is None:
+            raise RuntimeError("Provisioning queue is not running")
+        if not users:
+            raise ValueError("A bulk registration needs at least one user.")
+        if len(users) > PROVISION_MAX_JOB_SIZE:
+            raise ValueError(f"A bulk registration may hold at most {PROVISION_MAX_JOB_SIZE} users.")
+        usernames = [user.username for user in users]
+        duplicates = sorted(username for username, count in Counter(usernames).items() if count > 1)
+        if duplicates:
+            raise ValueError(f"Duplicate usernames: {', '.join(duplicates)}")
+        job = ProvisioningJob(usernames)
+        for user in users:
+            username = user.username
+            error = None
+            try:
+                validate_identifier(username)
+            except ValueError as e:
+                error = str(e)
+            if error is None and username in self._active:
+                error = f"User '{username}' is already being provisioned."
+            if error is not None:
+                job.update(username, "failed", error=error)
+                continue
+            self._active.add(username)
+            self._queue.put_nowait((job, user))
+        self.jobs[job.id] = job
+        self._prune_jobs()
+        return job
+
+    def _prune_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def job(self, job_id: str) -> Optional[ProvisioningJob]:
+        return self.jobs.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job, user = await self._queue.get()
+            try:
+                await self._provision_for_job(job, user)
+            finally:
+                self._active.discard(user.username)
+                self._queue.task_done()
+
+    async def _provision_for_job(self, job: ProvisioningJob, user: UserCreate):
+        username = user.username
+        if await self.routes.get(username) is not None:
+            job.update(username, "failed", error=f"User '{username}' is already registered.")
+            return
+        job.update(username, "provisioning")
+        try:
+            tenant = await self.provision_tenant(user)
+        except asyncio.CancelledError:
+            job.update(username, "failed", error="Provisioning was cancelled.")
+            raise
+        except Exception as e:
+            self.failed += 1
+            # HTTPException carries its message in detail
+            job.update(username, "failed", error=str(getattr(e, "detail", None) or e))
+            logging.error(f"Provisioning tenant {username} failed: {e}")
+            return
+        job.update(username, "ready", tenancy_mode=tenant["tenancy_mode"], hostname=tenant["hostname"],
+                   port=tenant["port"])
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 3) if latencies else None
+
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": len(self._active),
+            "jobs": len(self.jobs),
+            "provisioned": self.provisioned,
+            "failed": self.failed,
+            "rolled_back": self.rolled_back,
+            "provision_latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99)},
+        }
+
+
+provisioning = ProvisioningQueue()
@@ -0,0 +1,273 @@
+import os
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+import docker
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import SQLAlchemyError
+
+from adminUtils import TENANT_PUBLISH_PORTS, get_docker_client
+from database import TENANT_STATEMENT_TIMEOUT_MS, get_session, get_tenant_engine
+from executors import run_blocking
+from metrics import record_stage, span
+from models import STREAM_BATCH_SIZE
+from profiler import query_profiler
+from serialization import encode_rows
+from routing import TenantRoutingCache, tenant_routes
+
+# "pool" runs tenant SQL over long-lived driver connections, "exec" keeps the old `docker exec psql` path
+QUERY_ENGINE_MODE = os.getenv("QUERY_ENGINE_MODE", "pool")
+
+# Set TENANT_DB_USE_HOST_PORT=1 when the backend runs outside the docker network and
+# must reach tenant databases through their published host ports.
+TENANT_DB_USE_HOST_PORT = os.getenv("TENANT_DB_USE_HOST_PORT", "0") == "1"
+TENANT_DB_HOST = os.getenv("TENANT_DB_HOST", "localhost")
+if TENANT_DB_USE_HOST_PORT and not TENANT_PUBLISH_PORTS:
+    logging.warning("TENANT_DB_USE_HOST_PORT=1 but TENANT_PUBLISH_PORTS=0: tenant containers have no host ports to reach")
+
+# Server-side prepared statements asyncpg keeps per pooled connection (LRU; defaults to asyncpg's own 100).
+# Statements from models.statement_cache reuse the same SQL text, so they are parsed and planned once per connection;
+# raise it when a tenant's working set of statements is larger (benchmarks/bench_statements.py --database-url sizes it).
+TENANT_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("TENANT_PREPARED_STATEMENT_CACHE_SIZE", "100"))
+
+# psql in exec mode gets the same statement_timeout as pooled connections
+PSQL_ENVIRONMENT = {"PGOPTIONS": f"-c statement_timeout={TENANT_STATEMENT_TIMEOUT_MS}"}
+
+
+@dataclass
+class QueryResult:
+    """Outcome of a tenant statement, either structured rows (pool mode) or psql text (exec mode)."""
+    columns: List[str] = field(default_factory=list)
+    rows: List[tuple] = field(default_factory=list)
+    rowcount: int = -1
+    returns_rows: bool = False
+    text: Optional[str] = None
+
+    def first_column(self) -> List[Any]:
+        """Return the values of the first column, parsing psql output in exec mode."""
+        if self.text is None:
+            return [row[0] for row in self.rows]
+        # Skip the header, the separator line and the "(x rows)" footer of psql's table output
+        lines = self.text.split('\n')
+        values = [line.strip() for line in lines if line.strip() and not line.startswith('-') and not line.endswith('rows)') and not line.endswith('row)')]
+        return values[1:]
+
+    def records(self) -> List[tuple]:
+        """Return every row, splitting psql's aligned columns (as strings) in exec mode."""
+        if self.text is None:
+            return self.rows
+        lines = [line for line in self.text.split('\n') if line.strip()]
+        body = [line for line in lines[1:] if not line.startswith('-') and not line.endswith('rows)') and not line.endswith('row)')]
+        return [tuple(cell.strip() for cell in line.split('|')) for line in body]
+
+    def to_response(self, layout: str = "objects"):
+        """Return the JSON-friendly payload sent back to the client, rows shaped by serialization.encode_rows."""
+        if self.text is not None:
+            return self.text
+        if self.returns_rows:
+            with span("encode"):
+                return encode_rows(self.columns, self.rows, layout)
+        return {"rowcount": self.rowcount}
+
+
+def get_tenant_url(endpoint: Dict[str, Any]) -> URL:
+    """Build the SQLAlchemy URL of a tenant database from its row in the users table."""
+    if endpoint.get("tenancy_mode", "container") != "container":
+        # Shared-cluster tenants store the cluster's own address
+        host, port = endpoint["container_hostname"], endpoint["container_port"]
+    elif TENANT_DB_USE_HOST_PORT:
+        host, port = TENANT_DB_HOST, endpoint["container_port"]
+    else:
+        host, port = endpoint["container_hostname"], 5432
+    return URL.create(
+        "postgresql+asyncpg",
+        username=endpoint["username"],
+        password=endpoint["password"],
+        host=host,
+        port=port,
+        database=endpoint.get("database_name") or endpoint["username"],
+        query={"prepared_statement_cache_size": str(TENANT_PREPARED_STATEMENT_CACHE_SIZE)},
+    )
+
+
+def is_script(sql_query: str) -> bool:
+    """Return True when the SQL text holds more than one statement (a ';' outside quotes and comments)."""
+    body = sql_query.strip().rstrip(';')
+    quote = None
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif body.startswith('--', i):
+            newline = body.find('\n', i)
+            i = len(body) if newline == -1 else newline
+        elif body.startswith('/*', i):
+            close = body.find('*/', i + 2)
+            i = len(body) if close == -1 else close + 1
+        elif char == ';':
+            return True
+        i += 1
+    return False
+
+
+async def run_script(conn, sql_script: str):
+    """
+    Run a multi-statement script over the simple query protocol, inside conn's transaction.
+
+    SQLAlchemy's asyncpg adapter sends BEGIN lazily, on its first cursor execute; a script handed
+    straight to the driver before that would run in its own implicit transaction and commit even
+    if the enclosing transaction rolls back. A cursor statement opens the transaction first.
+    """
+    await conn.exec_driver_sql("SELECT 1")
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.execute(sql_script)
+
+
+async def get_tenant_endpoint(username: str, routes: TenantRoutingCache = tenant_routes) -> Dict[str, Any]:
+    """Look up a tenant's row through the routing cache, raising 404 when unknown."""
+    endpoint = await routes.get(username)
+    if endpoint is None:
+        raise HTTPException(status_code=404, detail=f"Database for user '{username}' not found.")
+    return endpoint
+
+
+def get_tenant_key(endpoint: Dict[str, Any]):
+    """Key of a tenant's pool in the registry; shared-cluster tenants share a host but not a pool."""
+    return (endpoint["container_hostname"], endpoint["container_port"],
+            endpoint.get("database_name") or endpoint["username"], endpoint["username"])
+
+
+async def get_tenant_sessionmaker(username: str):
+    """Return the async session maker bound to a tenant's pooled engine."""
+    endpoint = await get_tenant_endpoint(username)
+    return get_session(get_tenant_key(endpoint), get_tenant_url(endpoint))
+
+
+class PooledBackend:
+    """Run tenant SQL over per-tenant async SQLAlchemy connection pools."""
+
+    def __init__(self, routes: TenantRoutingCache = tenant_routes, engine_lookup=get_tenant_engine):
+        self.routes = routes
+        self.engine_lookup = engine_lookup
+
+    async def get_engine(self, username: str):
+        with span("routing"):
+            endpoint = await get_tenant_endpoint(username, self.routes)
+            return self.engine_lookup(get_tenant_key(endpoint), get_tenant_url(endpoint))
+
+    async def execute(self, username: str, sql_query: str) -> QueryResult:
+        engine = await self.get_engine(username)
+        try:
+            checkout_start = time.perf_counter()
+            async with engine.begin() as conn:
+                record_stage("checkout", time.perf_counter() - checkout_start)
+                with span("execute"):
+                    if is_script(sql_query):
+                        # asyncpg prepares single statements; scripts go through the simple query protocol
+                        # (and past the engine's cursor events, so the profiler is told directly)
+                        script_start = time.perf_counter()
+                        await run_script(conn, sql_query)
+                        if query_profiler.enabled:
+                            query_profiler.record(username, sql_query, (time.perf_counter() - script_start) * 1000)
+                        return QueryResult()
+                    # exec_driver_sql keeps ':' and '%' in client SQL literal, like psql -c does
+                    result = await conn.exec_driver_sql(sql_query)
+                    if result.returns_rows:
+                        return QueryResult(columns=list(result.keys()), rows=[tuple(row) for row in result.fetchall()],
+                                           rowcount=result.rowcount, returns_rows=True)
+                    return QueryResult(rowcount=result.rowcount)
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=400, detail=str(getattr(e, "orig", None) or e))
+        except asyncpg.PostgresError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def stream(self, username: str, sql_query: str, batch_size: int = STREAM_BATCH_SIZE):
+        """Return an async iterator of (columns, rows) batches read through a server-side cursor."""
+        engine = await self.get_engine(username)
+        return self._iter_batches(engine, sql_query, batch_size)
+
+    async def _iter_batches(self, engine, sql_query: str, batch_size: int):
+        try:
+            checkout_start = time.perf_counter()
+            async with engine.connect() as conn:
+                record_stage("checkout", time.perf_counter() - checkout_start)
+                result = await conn.stream(text(sql_query))
+                columns = list(result.keys())
+                empty = True
+                async for partition in result.partitions(batch_size):
+                    empty = False
+                    yield columns, [tuple(row) for row in partition]
+                if empty:
+                    yield columns, []
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=400, detail=str(getattr(e, "orig", None) or e))
+
+
+class ExecBackend:
+    """Fallback that runs tenant SQL with psql inside the tenant's container."""
+
+    def __init__(self, docker_client_factory=get_docker_client):
+        self.docker_client_factory = docker_client_factory
+
+    async def get_container(self, username: str):
+        container_name = f"postgres_{username}"
+        try:
+            with span("docker_lookup"):
+                client = await run_blocking(self.docker_client_factory)
+                return await run_blocking(client.containers.get, container_name)
+        except docker.errors.NotFound:
+            raise HTTPException(status_code=404, detail=f"Container {container_name} not found.")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    async def execute(self, username: str, sql_query: str) -> QueryResult:
+        container = await self.get_container(username)
+        try:
+            start = time.perf_counter()
+            with span("execute"):
+                exec_result = await run_blocking(container.exec_run, f"psql -U {username} -d {username} -c \"{sql_query}\"",
+                                                 environment=PSQL_ENVIRONMENT)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+        if query_profiler.enabled:
+            # Includes the docker exec round trip; psql's text output has no reliable row count
+            query_profiler.record(username, sql_query, (time.perf_counter() - start) * 1000,
+                                  error=exec_result.output.decode('utf-8') if exec_result.exit_code != 0 else None)
+        if exec_result.exit_code != 0:
+            raise HTTPException(status_code=400, detail=exec_result.output.decode('utf-8'))
+        return QueryResult(text=exec_result.output.decode('utf-8'))
+
+    async def stream(self, username: str, sql_query: str, batch_size: int = STREAM_BATCH_SIZE):
+        raise HTTPException(status_code=400, detail="Streaming reads require QUERY_ENGINE_MODE=pool.")
+
+
+_BACKENDS = {
+    "pool": PooledBackend,
+    "exec": ExecBackend,
+}
+
+def create_backend(mode: str = QUERY_ENGINE_MODE):
+    """Instantiate the query backend for the given mode ("pool" or "exec")."""
+    if mode not in _BACKENDS:
+        raise ValueError(f"Unsupported query engine mode: {mode}")
+    logging.info(f"Tenant query engine running in '{mode}' mode")
+    return _BACKENDS[mode]()
+
+query_backend = create_backend()
+
+async def run_query(username: str, sql_query: str) -> QueryResult:
+    """Execute a SQL statement against a tenant's database using the configured backend."""
+    return await query_backend.execute(username, sql_query)
+
+async def stream_query(username: str, sql_query: str, batch_size: int = STREAM_BATCH_SIZE):
+    """Stream the rows of a SELECT against a tenant's database in (columns, rows) batches."""
+    return await query_backend.stream(username, sql_query, batch_size)
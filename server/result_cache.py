@@ -0,0 +1,195 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from fastapi import Request, Response
+
+from metrics import span
+from serialization import dumps
+
+# Memory budget for cached response bodies (0 disables the cache)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 2 ** 20)))
+# Larger bodies are served but never cached, so one big page cannot flush everything else
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(RESULT_CACHE_MAX_BYTES // 16)))
+# Upper bound on staleness for writes that bypass the API (e.g. a direct psql session)
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "30"))
+
+CacheKey = Tuple[str, str, Hashable]
+
+
+@dataclass
+class CachedResult:
+    body: bytes
+    etag: str
+    expires_at: float
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header (a list of tags, possibly weak, or '*') against an ETag."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+class ResultCache:
+    """
+    Memory-budgeted LRU of encoded read responses keyed by (tenant, table, query parameters).
+
+    Writes through the API invalidate a table (or, for raw SQL, the whole tenant). Each table and
+    tenant carries a version; a read only stores its result if no write happened while it ran.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES,
+                 ttl: float = RESULT_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, CachedResult]" = OrderedDict()
+        self._by_table: Dict[Tuple[str, str], Set[CacheKey]] = {}
+        self._table_versions: Dict[Tuple[str, str], int] = {}
+        self._tenant_versions: Dict[str, int] = {}
+        self._tenant_counters: Dict[str, Dict[str, int]] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def version(self, username: str, table_name: str) -> Tuple[int, int]:
+        return self._tenant_versions.get(username, 0), self._table_versions.get((username, table_name), 0)
+
+    def _count(self, username: str, counter: str):
+        counters = self._tenant_counters.setdefault(username, {"hits": 0, "misses": 0, "not_modified": 0})
+        counters[counter] += 1
+
+    def get(self, key: CacheKey) -> Optional[CachedResult]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() >= entry.expires_at:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            self._count(key[0], "misses")
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self._count(key[0], "hits")
+        return entry
+
+    def record_not_modified(self, username: str):
+        self.not_modified += 1
+        self._count(username, "not_modified")
+
+    def put(self, key: CacheKey, body: bytes, version: Tuple[int, int]) -> CachedResult:
+        """Build the entry for a freshly read body and cache it unless a write raced with the read."""
+        entry = CachedResult(body=body, etag=make_etag(body), expires_at=time.monotonic() + self.ttl)
+        username, table_name = key[0], key[1]
+        if not self.enabled or len(body) > self.max_entry_bytes or self.version(username, table_name) != version:
+            return entry
+        self._remove(key)
+        self._entries[key] = entry
+        self._by_table.setdefault((username, table_name), set()).add(key)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        return entry
+
+    def _remove(self, key: CacheKey):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= len(entry.body)
+        keys = self._by_table.get((key[0], key[1]))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_table[(key[0], key[1])]
+
+    def invalidate_table(self, username: str, table_name: str):
+        """Drop every cached read of a table after a write or DDL on it."""
+        self._table_versions[(username, table_name)] = self._table_versions.get((username, table_name), 0) + 1
+        for key in list(self._by_table.get((username, table_name), ())):
+            self._remove(key)
+        self.invalidations += 1
+
+    def invalidate_tenant(self, username: str):
+        """Drop every cached read of a tenant, e.g. after raw SQL that may touch any table."""
+        self._tenant_versions[username] = self._tenant_versions.get(username, 0) + 1
+        for key in [key for key in self._entries if key[0] == username]:
+            self._remove(key)
+        self.invalidations += 1
+
+    def forget_tenant(self, username: str):
+        """Drop a deleted tenant's entries and counters."""
+        self.invalidate_tenant(username)
+        self._tenant_counters.pop(username, None)
+        for table_key in [table_key for table_key in self._table_versions if table_key[0] == username]:
+            del self._table_versions[table_key]
+
+    def stats(self, tenants: int = 20) -> Dict[str, Any]:
+        """Totals plus the hit rate of the `tenants` busiest tenants."""
+        lookups = self.hits + self.misses
+        busiest = sorted(self._tenant_counters.items(), key=lambda item: item[1]["hits"] + item[1]["misses"], reverse=True)
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "tenants": {
+                username: dict(counters, hit_ratio=round(counters["hits"] / (counters["hits"] + counters["misses"]), 4))
+                for username, counters in busiest[:tenants]
+            },
+        }
+
+
+result_cache = ResultCache()
+
+
+async def cached_json_response(request: Request, username: str, table_name: str, params: Hashable,
+                               produce: Callable[[], Awaitable[Any]], cache: ResultCache = result_cache) -> Response:
+    """
+    Serve a JSON read through the result cache, answering 304 when the client's ETag still matches.
+
+    Parameters:
+    - request: The incoming request, for its If-None-Match header.
+    - username, table_name, params: The cache key; params must be hashable.
+    - produce: Coroutine function returning the JSON-friendly content on a miss.
+
+    Returns:
+    - A response carrying the body (or 304) with ETag and X-Cache headers.
+    """
+    key = (username, table_name, params)
+    entry = cache.get(key) if cache.enabled else None
+    status = "HIT"
+    if entry is None:
+        status = "MISS"
+        version = cache.version(username, table_name)
+        content = await produce()
+        with span("encode"):
+            body = dumps(content)
+        entry = cache.put(key, body, version)
+    headers = {"ETag": entry.etag, "X-Cache": status}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        cache.record_not_modified(username)
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
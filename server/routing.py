@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from adminUtils import get_user_endpoint, load_user_endpoints
+from executors import run_blocking
+
+# Seconds a tenant's routing entry (its users-table row) is served from memory before being re-read
+TENANT_ROUTE_TTL_SECONDS = float(os.getenv("TENANT_ROUTE_TTL_SECONDS", "300"))
+# Unknown usernames are remembered briefly so a flood of bad requests does not reach the main database
+TENANT_ROUTE_NEGATIVE_TTL_SECONDS = float(os.getenv("TENANT_ROUTE_NEGATIVE_TTL_SECONDS", "5"))
+
+
+class TenantRoutingCache:
+    """
+    In-process map of username -> stored connection details, loaded from the main `users` table.
+
+    Entries expire after `ttl` seconds and are dropped explicitly when a tenant is registered or
+    deleted. Concurrent misses for the same tenant share a single main-database read.
+    """
+
+    def __init__(self, loader: Callable[[str], Optional[Dict[str, Any]]] = get_user_endpoint,
+                 ttl: float = TENANT_ROUTE_TTL_SECONDS, negative_ttl: float = TENANT_ROUTE_NEGATIVE_TTL_SECONDS,
+                 bulk_loader: Optional[Callable[[], Dict[str, Dict[str, Any]]]] = None):
+        self.loader = loader
+        self.bulk_loader = bulk_loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: Dict[str, tuple] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._lookup_latencies = deque(maxlen=10000)
+
+    async def warm(self):
+        """Load every tenant at startup so the first request per tenant is already a hit."""
+        if self.bulk_loader is None:
+            return
+        endpoints = await run_blocking(self.bulk_loader)
+        expires_at = time.monotonic() + self.ttl
+        for username, endpoint in endpoints.items():
+            self._entries[username] = (endpoint, expires_at)
+
+    async def get(self, username: str) -> Optional[Dict[str, Any]]:
+        """Return a tenant's users-table row, or None when the tenant does not exist."""
+        start = time.perf_counter()
+        try:
+            entry = self._entries.get(username)
+            if entry is not None:
+                endpoint, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self.hits += 1
+                    return endpoint
+                self.expirations += 1
+                del self._entries[username]
+            self.misses += 1
+            return await self._load(username)
+        finally:
+            self._lookup_latencies.append(time.perf_counter() - start)
+
+    async def _load(self, username: str) -> Optional[Dict[str, Any]]:
+        future = self._loading.get(username)
+        if future is None:
+            future = asyncio.get_running_loop().create_task(self._fetch(username))
+            self._loading[username] = future
+            future.add_done_callback(lambda _: self._loading.pop(username, None))
+        # A cancelled request must not cancel the read other requests are waiting on
+        return await asyncio.shield(future)
+
+    async def _fetch(self, username: str) -> Optional[Dict[str, Any]]:
+        endpoint = await run_blocking(self.loader, username)
+        ttl = self.ttl if endpoint is not None else self.negative_ttl
+        if ttl > 0:
+            self._entries[username] = (endpoint, time.monotonic() + ttl)
+        return endpoint
+
+    def invalidate(self, username: str):
+        """Forget a tenant's routing entry, e.g. after it is registered, moved or deleted."""
+        if self._entries.pop(username, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._lookup_latencies)
+        lookups = self.hits + self.misses
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 4) if latencies else None
+
+        return {
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "lookup_latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99)},
+        }
+
+
+tenant_routes = TenantRoutingCache(bulk_loader=load_user_endpoints)
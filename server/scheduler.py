@@ -0,0 +1,245 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict
+
+from fastapi import HTTPException
+
+# Tenant requests allowed to run at once across the whole process (0 disables admission control)
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "64"))
+# Requests one tenant may run at once, and may have waiting for a slot before new ones get 429
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "4"))
+TENANT_MAX_QUEUE = int(os.getenv("TENANT_MAX_QUEUE", "32"))
+# Token bucket per tenant: sustained requests per second and burst size
+TENANT_RATE_PER_SECOND = float(os.getenv("TENANT_RATE_PER_SECOND", "50"))
+TENANT_BURST = float(os.getenv("TENANT_BURST", "100"))
+# Longest a request waits in the queue before it is answered 503
+SCHEDULER_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "10"))
+
+
+class TokenBucket:
+    """Classic token bucket; refilled lazily from the monotonic clock."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float = 1.0) -> float:
+        """Take `cost` tokens; returns 0 on success, otherwise the seconds until they are available."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class _TenantState:
+    def __init__(self, rate: float, burst: float, weight: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.weight = weight
+        self.running = 0
+        self.queue: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rate_limited = 0
+        self.queue_full = 0
+        self.timeouts = 0
+
+    @property
+    def idle(self) -> bool:
+        return self.running == 0 and not self.queue
+
+
+class TenantScheduler:
+    """
+    Admission control and fair scheduling of tenant requests.
+
+    A request first takes a token from its tenant's bucket (429 when empty) and then a run slot.
+    Slots are limited per tenant and globally; when they are all taken the request waits in its
+    tenant's bounded queue (429 when full). Freed slots are handed out by weighted round robin
+    across the tenants that have requests waiting, so a tenant with a deep queue cannot starve
+    the others.
+    """
+
+    def __init__(self, max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+                 tenant_concurrency: int = TENANT_MAX_CONCURRENCY, tenant_queue: int = TENANT_MAX_QUEUE,
+                 rate: float = TENANT_RATE_PER_SECOND, burst: float = TENANT_BURST,
+                 queue_timeout: float = SCHEDULER_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.tenant_queue = tenant_queue
+        self.rate = rate
+        self.burst = burst
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self._tenants: Dict[str, _TenantState] = {}
+        self._weights: Dict[str, int] = {}
+        # Tenants with waiting requests, in round-robin order, with their remaining grants this round
+        self._ready: "OrderedDict[str, int]" = OrderedDict()
+        self._last_prune = time.monotonic()
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    def set_weight(self, username: str, weight: int):
+        """Give a tenant `weight` slots per round-robin turn (default 1)."""
+        self._weights[username] = max(1, int(weight))
+        if username in self._tenants:
+            self._tenants[username].weight = self._weights[username]
+
+    def _state(self, username: str) -> _TenantState:
+        state = self._tenants.get(username)
+        if state is None:
+            state = _TenantState(self.rate, self.burst, self._weights.get(username, 1))
+            self._tenants[username] = state
+        return state
+
+    def _reject(self, detail: str, retry_after: float):
+        self.rejected += 1
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, round(retry_after)))})
+
+    async def acquire(self, username: str):
+        state = self._state(username)
+        wait = state.bucket.take()
+        if wait:
+            state.rate_limited += 1
+            self._reject(f"Rate limit exceeded for tenant '{username}'.", wait)
+        if not state.queue and state.running < self.tenant_concurrency and self.running < self.max_concurrency:
+            self._grant(state)
+            return
+        if len(state.queue) >= self.tenant_queue:
+            state.queue_full += 1
+            self._reject(f"Too many queued requests for tenant '{username}'.", 1)
+        waiter = asyncio.get_running_loop().create_future()
+        state.queue.append(waiter)
+        self._ready.setdefault(username, state.weight)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            state.timeouts += 1
+            self.timeouts += 1
+            self._abandon(state, waiter)
+            raise HTTPException(status_code=503, detail=f"Timed out waiting for a query slot for tenant '{username}'.",
+                                headers={"Retry-After": "1"})
+        except asyncio.CancelledError:
+            self._abandon(state, waiter)
+            raise
+
+    def _abandon(self, state: _TenantState, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # Granted just as the wait ended: hand the slot back
+            self.release_state(state)
+        else:
+            waiter.cancel()
+            try:
+                state.queue.remove(waiter)
+            except ValueError:
+                pass
+
+    def _grant(self, state: _TenantState):
+        state.running += 1
+        state.admitted += 1
+        self.running += 1
+
+    def release(self, username: str):
+        self.release_state(self._tenants[username])
+
+    def release_state(self, state: _TenantState):
+        state.running -= 1
+        self.running -= 1
+        self._dispatch()
+        self._prune()
+
+    def _dispatch(self):
+        """Hand free slots to waiting tenants in weighted round-robin order."""
+        while self.running < self.max_concurrency and self._ready:
+            granted = False
+            for username in list(self._ready):
+                state = self._tenants.get(username)
+                if state is None:
+                    del self._ready[username]
+                    continue
+                while state.queue and state.queue[0].done():
+                    state.queue.popleft()
+                if not state.queue:
+                    del self._ready[username]
+                    continue
+                if state.running >= self.tenant_concurrency:
+                    continue
+                self._grant(state)
+                state.queue.popleft().set_result(None)
+                granted = True
+                self._ready[username] -= 1
+                if self._ready[username] <= 0 or not state.queue:
+                    # Turn used up: go to the back of the ring with a fresh allowance
+                    del self._ready[username]
+                    if state.queue:
+                        self._ready[username] = state.weight
+                if self.running >= self.max_concurrency:
+                    return
+            if not granted:
+                # Every waiting tenant is at its own concurrency limit
+                return
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for username in [username for username, state in self._tenants.items() if state.idle and state.bucket.full()]:
+            del self._tenants[username]
+            # Its waiters may all have gone (cancelled or timed out) without _dispatch seeing it
+            self._ready.pop(username, None)
+
+    @asynccontextmanager
+    async def slot(self, username: str):
+        """Hold one of the tenant's run slots for the duration of the block."""
+        if not self.enabled:
+            yield
+            return
+        await self.acquire(username)
+        try:
+            yield
+        finally:
+            self.release(username)
+
+    def stats(self, tenants: int = 20) -> Dict[str, Any]:
+        busiest = sorted(self._tenants.items(), key=lambda item: item[1].running + len(item[1].queue), reverse=True)
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "queued": sum(len(state.queue) for state in self._tenants.values()),
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "tenants": {
+                username: {
+                    "running": state.running,
+                    "queued": len(state.queue),
+                    "weight": state.weight,
+                    "admitted": state.admitted,
+                    "rate_limited": state.rate_limited,
+                    "queue_full": state.queue_full,
+                    "timeouts": state.timeouts,
+                }
+                for username, state in busiest[:tenants]
+            },
+        }
+
+
+scheduler = TenantScheduler()
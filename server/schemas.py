@@ -1,9 +1,13 @@
 from pydantic import BaseModel
+from typing import List, Optional
 
 class UserCreate(BaseModel):
     username: str
     password: str
 
+class BulkUserCreate(BaseModel):
+    users: List[UserCreate]
+
 class TableCreate(BaseModel):
     table_name: str
     columns: dict  # Columns with types as dict: {'column_name': 'column_type'}
@@ -13,3 +17,34 @@ class ItemCreate(BaseModel):
 
 class ItemUpdate(BaseModel):
     item: dict  # Dynamic item fields
+
+class BatchOperation(BaseModel):
+    op: str  # "sql", "create_table", "insert", "update" or "delete"
+    sql: Optional[str] = None  # For "sql"
+    table_name: Optional[str] = None
+    columns: Optional[dict] = None  # For "create_table": {'column_name': 'column_type'}
+    item: Optional[dict] = None  # For "insert" and "update"
+    item_id: Optional[int] = None  # For "update" and "delete"
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+    on_error: str = "rollback"  # "rollback" the whole batch, or "continue" past failed operations
+    pipeline: bool = False  # Send every operation in one round trip (all-or-nothing, no row results)
+
+class IndexSpec(BaseModel):
+    table_name: str
+    columns: List[str]  # Key columns in order
+
+class IndexApplyRequest(BaseModel):
+    indexes: Optional[List[IndexSpec]] = None  # Omitted: apply every current recommendation of the index advisor
+
+class FanOutRequest(BaseModel):
+    sql: Optional[str] = None  # One read-only statement, or
+    probe: Optional[str] = None  # a named catalog probe (fanout.PROBES)
+    tenants: Optional[List[str]] = None  # Omitted: every tenant in the users table
+    aggregate: Optional[str] = None  # "sum", "min", "max", "avg", or "drift" for the schema probe
+    group_by: Optional[List[str]] = None  # Columns to aggregate by (default: the non-numeric ones)
+    concurrency: Optional[int] = None  # Tenants queried at once (default FANOUT_CONCURRENCY)
+    timeout: Optional[float] = None  # Seconds per tenant (default FANOUT_TENANT_TIMEOUT)
+    wake: bool = False  # Start hibernated tenants instead of skipping them
+    stream: bool = False  # NDJSON: one line per tenant as it answers, then the summary
@@ -0,0 +1,318 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+import os
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from metrics import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the standard library encoder
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - Arrow and Parquet output are optional
+    pa = None
+    pq = None
+
+# Media types of the streaming formats supported by the table read endpoints
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+# Formats that need pyarrow
+ARROW_FORMATS = ("arrow", "parquet")
+# Rows an Arrow/Parquet stream holds back while a column is still all NULL (its type unknown); a
+# column still NULL after that is written as text, which any later value can be cast to
+ARROW_SCHEMA_BUFFER_ROWS = int(os.getenv("ARROW_SCHEMA_BUFFER_ROWS", "10000"))
+
+# JSON layouts of a page of rows: objects keyed by column, positional row arrays, or one array per column
+JSON_LAYOUTS = ("objects", "rows", "columns")
+
+# JSON type names reported for the Python values produced by the driver
+VALUE_TYPES = (
+    (bool, "boolean"),
+    (int, "integer"),
+    (float, "number"),
+    (decimal.Decimal, "decimal"),
+    (str, "string"),
+    (datetime.datetime, "timestamp"),
+    (datetime.date, "date"),
+    (datetime.time, "time"),
+    (datetime.timedelta, "interval"),
+    (uuid.UUID, "uuid"),
+    ((bytes, bytearray, memoryview), "bytes"),
+    ((dict, list), "json"),
+)
+
+
+def _default(value):
+    # Values orjson and json do not know natively: Decimal keeps its exact text, bytes become hex
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return str(value)
+
+
+def loads(data):
+    """Decode JSON text or bytes, with orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(content: Any) -> bytes:
+    """Encode content as compact UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class TypedJSONResponse(JSONResponse):
+    """JSON response rendered with the fast encoder; returning it directly also skips jsonable_encoder."""
+
+    def render(self, content: Any) -> bytes:
+        with span("encode"):
+            return dumps(content)
+
+
+def value_type(value: Any) -> str:
+    for python_type, name in VALUE_TYPES:
+        if isinstance(value, python_type):
+            return name
+    return "string"
+
+
+def column_types(columns: List[str], rows: Sequence[Sequence]) -> List[Dict[str, str]]:
+    """Describe each column with the JSON type of its first non-NULL value ("null" when all are NULL)."""
+    described = []
+    for index, column in enumerate(columns):
+        sample = next((row[index] for row in rows if row[index] is not None), None)
+        described.append({"name": column, "type": value_type(sample) if sample is not None else "null"})
+    return described
+
+
+def encode_rows(columns: List[str], rows: Sequence[Sequence], layout: str = "objects"):
+    """
+    Shape rows for a JSON body.
+
+    "objects" is a list of {column: value}; "rows" and "columns" add the column types and send
+    positional arrays per row or one array per column, which are smaller and faster to encode.
+    """
+    if layout == "objects":
+        return [dict(zip(columns, row)) for row in rows]
+    if layout == "rows":
+        return {"columns": column_types(columns, rows), "rows": [list(row) for row in rows]}
+    if layout == "columns":
+        return {"columns": column_types(columns, rows),
+                "data": {column: [row[index] for row in rows] for index, column in enumerate(columns)}}
+    raise HTTPException(status_code=400, detail=f"Unsupported JSON layout: {layout}")
+
+
+def _arrow_array(values: List[Any]):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed or unsupported Python types: keep the column as text rather than failing the export
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+def arrow_batch(columns: List[str], rows: Sequence[Sequence]):
+    """Build an Arrow record batch from driver rows."""
+    arrays = [_arrow_array([row[index] for row in rows]) for index in range(len(columns))]
+    return pa.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+def encode_arrow(columns: List[str], rows: Sequence[Sequence]) -> bytes:
+    """Encode rows as a complete Arrow IPC stream."""
+    batch = arrow_batch(columns, rows)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_parquet(columns: List[str], rows: Sequence[Sequence]) -> bytes:
+    """Encode rows as a Parquet file."""
+    sink = pa.BufferOutputStream()
+    pq.write_table(pa.Table.from_batches([arrow_batch(columns, rows)]), sink)
+    return sink.getvalue().to_pybytes()
+
+Batch = Tuple[List[str], Sequence[Sequence]]
+
+
+def encode_ndjson(columns: List[str], rows: Sequence[Sequence]) -> bytes:
+    """Encode rows as newline-delimited JSON objects."""
+    return b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+
+def encode_csv(columns: List[str], rows: Sequence[Sequence], header: bool = False) -> str:
+    """Encode rows as CSV, optionally preceded by the header line."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def _merge_types(types):
+    """The narrowest type every one of `types` casts to: NULL takes any type, ints widen, else text."""
+    try:
+        return pa.unify_schemas([pa.schema([("value", t)]) for t in types], promote_options="permissive").field(0).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.string()
+
+
+def _merged_types(batches) -> list:
+    return [_merge_types([batch.schema.field(index).type for batch in batches])
+            for index in range(batches[0].num_columns)]
+
+
+def _settle_schema(batches):
+    fields = zip(batches[0].schema, _merged_types(batches))
+    return pa.schema([field.with_type(pa.string() if pa.types.is_null(merged) else merged) for field, merged in fields])
+
+
+def _conform(batch, schema):
+    # The writer's schema is fixed once it is open; a later batch's columns are cast to it (an
+    # inferred type narrower than the schema's, or values that fell back to text in one batch)
+    if batch.schema.equals(schema):
+        return batch
+    arrays = []
+    for column, field in zip(batch.columns, schema):
+        try:
+            arrays.append(column.cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            if not pa.types.is_string(field.type):
+                raise
+            arrays.append(pa.array([None if value is None else str(value) for value in column.to_pylist()],
+                                   type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+async def _encode_arrow_batches(first: Batch, batches: AsyncIterator[Batch], fmt: str):
+    # Neither format can change its schema once written, so batches are held back until no column
+    # is all NULL (or ARROW_SCHEMA_BUFFER_ROWS are held); the schema is then merged over all of them
+    pending = [arrow_batch(*first)]
+    exhausted = False
+    while (any(pa.types.is_null(merged) for merged in _merged_types(pending))
+           and sum(batch.num_rows for batch in pending) < ARROW_SCHEMA_BUFFER_ROWS):
+        try:
+            pending.append(arrow_batch(*await batches.__anext__()))
+        except StopAsyncIteration:
+            exhausted = True
+            break
+    schema = _settle_schema(pending)
+    # Both writers append to the buffer as they go (IPC messages, Parquet row groups), so it is
+    # drained after every cursor batch; only the Parquet footer waits for close()
+    buffer = io.BytesIO()
+    if fmt == "arrow":
+        writer = pa.ipc.new_stream(buffer, schema)
+        write = writer.write_batch
+    else:
+        writer = pq.ParquetWriter(buffer, schema)
+        write = lambda batch: writer.write_table(pa.Table.from_batches([batch]))
+    for batch in pending:
+        write(_conform(batch, schema))
+    if not exhausted:
+        async for columns, rows in batches:
+            yield _drain(buffer)
+            write(_conform(arrow_batch(columns, rows), schema))
+    writer.close()
+    yield _drain(buffer)
+
+
+def _drain(buffer: io.BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+async def _encode_batches(first: Batch, batches: AsyncIterator[Batch], fmt: str):
+    if fmt in ARROW_FORMATS:
+        async for chunk in _encode_arrow_batches(first, batches, fmt):
+            yield chunk
+        return
+    columns, rows = first
+    if fmt == "csv":
+        yield encode_csv(columns, rows, header=True)
+    else:
+        yield encode_ndjson(columns, rows)
+    async for columns, rows in batches:
+        yield encode_csv(columns, rows) if fmt == "csv" else encode_ndjson(columns, rows)
+
+
+async def stream_response(batches: AsyncIterator[Batch], fmt: str) -> StreamingResponse:
+    """
+    Wrap an async iterator of (columns, rows) batches into an NDJSON, CSV, Arrow IPC or
+    Parquet StreamingResponse.
+
+    The first batch is fetched before the response starts so that errors such as a missing
+    table are still reported with a proper status code.
+    """
+    if fmt not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported stream format: {fmt}")
+    if fmt in ARROW_FORMATS and pa is None:
+        raise HTTPException(status_code=406, detail=f"{fmt} output requires pyarrow on the server.")
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = ([], [])
+    return StreamingResponse(_encode_batches(first, batches, fmt), media_type=STREAM_MEDIA_TYPES[fmt])
+
+
+def records_from_items(items: List[Dict[str, Any]]) -> Tuple[List[str], List[tuple]]:
+    """Align JSON objects on the union of their keys; missing keys become NULL."""
+    columns: List[str] = []
+    seen = set()
+    for item in items:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail="Every item must be a JSON object.")
+        for key in item:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+    return columns, [tuple(item.get(column) for column in columns) for item in items]
+
+
+def parse_bulk_payload(content_type: str, body: bytes) -> Tuple[List[str], List[tuple], bool]:
+    """
+    Decode a bulk ingestion body into (columns, records, text_format).
+
+    Accepts a JSON array of objects (or {"items": [...]}), NDJSON, or CSV with a header line.
+    text_format is True for CSV, whose values are strings for Postgres to parse.
+    """
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    try:
+        # UnicodeDecodeError is a ValueError: a body that is not UTF-8 is a 400 like any malformed one
+        text_body = body.decode("utf-8")
+        if media_type == "text/csv":
+            reader = csv.reader(io.StringIO(text_body))
+            columns = next(reader, [])
+            return columns, [tuple(row) for row in reader if row], True
+        if media_type in ("application/x-ndjson", "application/ndjson"):
+            items = [loads(line) for line in text_body.splitlines() if line.strip()]
+        elif media_type == "application/json":
+            items = loads(text_body)
+            if isinstance(items, dict):
+                items = items.get("items", [])
+        else:
+            raise HTTPException(status_code=415, detail=f"Unsupported content type: {media_type}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {media_type} body: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a list of items.")
+    columns, records = records_from_items(items)
+    return columns, records, False
@@ -0,0 +1,300 @@
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+
+import docker
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import SQLAlchemyError
+
+from adminUtils import MAIN_DB_HOST, MAIN_DB_NAME, MAIN_DB_PASSWORD, MAIN_DB_USER
+from container_pool import WarmContainerPool, quote_literal, wait_until_ready, warm_pool
+from executors import run_blocking
+from metrics import container_lifecycle
+from models import quote_identifier, validate_identifier
+from schemas import UserCreate
+
+# "container" (one Postgres container per tenant), "database" (a database per tenant on a shared
+# cluster) or "schema" (a schema per tenant in one shared database, selected through search_path)
+TENANCY_MODE = os.getenv("TENANCY_MODE", "container")
+
+# Shared cluster used by the "database" and "schema" modes; defaults to the main database server
+SHARED_CLUSTER_HOST = os.getenv("SHARED_CLUSTER_HOST", MAIN_DB_HOST or "db")
+SHARED_CLUSTER_PORT = int(os.getenv("SHARED_CLUSTER_PORT", "5432"))
+SHARED_CLUSTER_ADMIN_USER = os.getenv("SHARED_CLUSTER_ADMIN_USER", MAIN_DB_USER or "postgres")
+SHARED_CLUSTER_ADMIN_PASSWORD = os.getenv("SHARED_CLUSTER_ADMIN_PASSWORD", MAIN_DB_PASSWORD or "")
+# Database holding every tenant schema in "schema" mode
+SHARED_SCHEMA_DATABASE = os.getenv("SHARED_SCHEMA_DATABASE", "tenants")
+# Comma-separated databases on the shared cluster that tenant roles must not connect to; every role
+# may connect to a database through PUBLIC's default CONNECT privilege until it is revoked
+SHARED_CLUSTER_PROTECTED_DATABASES = [
+    name for name in os.getenv("SHARED_CLUSTER_PROTECTED_DATABASES", f"postgres,template1,{MAIN_DB_NAME or ''}").split(",")
+    if name
+]
+
+SHARED_CONTAINER_ID = "shared"
+
+# Quotes database names taken from configuration, which need not be plain identifiers (e.g. "multi-tenant-db")
+_quote_database = postgresql.dialect().identifier_preparer.quote
+
+
+class ContainerTenancy:
+    """Today's behaviour: every tenant gets its own Postgres container (claimed from the warm pool)."""
+
+    mode = "container"
+
+    def __init__(self, pool: WarmContainerPool = warm_pool):
+        self.pool = pool
+
+    async def start(self):
+        await self.pool.start()
+
+    async def stop(self):
+        await self.pool.stop()
+
+    async def provision(self, user: UserCreate) -> Dict[str, Any]:
+        container, container_hostname, port = await self.pool.claim(user)
+        return {
+            "container_id": container.id,
+            "hostname": container_hostname,
+            "port": port,
+            "tenancy_mode": self.mode,
+            "database_name": user.username,
+            "schema_name": None,
+        }
+
+    async def wait_ready(self, tenant: Dict[str, Any], timeout: float):
+        """Wait, with exponential backoff, until the tenant's container accepts connections."""
+        with container_lifecycle.time("wait_ready"):
+            container = await run_blocking(self.pool.client.containers.get, tenant["hostname"])
+            await wait_until_ready(container, timeout)
+
+    def _deprovision(self, endpoint: Dict[str, Any]):
+        container_name = f"postgres_{endpoint['username']}"
+        try:
+            self.pool.client.containers.get(container_name).remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        self.pool.ports.release(container_name)
+
+    async def deprovision(self, endpoint: Dict[str, Any]):
+        """Remove a tenant's container together with its data."""
+        with container_lifecycle.time("deprovision"):
+            await run_blocking(self._deprovision, endpoint)
+
+
+class _SharedClusterTenancy(ABC):
+    """Common plumbing for tenants that live on one shared Postgres cluster."""
+
+    mode = None
+
+    def __init__(self, host: str = SHARED_CLUSTER_HOST, port: int = SHARED_CLUSTER_PORT,
+                 admin_user: str = SHARED_CLUSTER_ADMIN_USER, admin_password: str = SHARED_CLUSTER_ADMIN_PASSWORD,
+                 protected_databases: Sequence[str] = SHARED_CLUSTER_PROTECTED_DATABASES):
+        self.host = host
+        self.port = port
+        self.admin_user = admin_user
+        self.admin_password = admin_password
+        self.protected_databases = list(protected_databases)
+        self._databases_protected = False
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def admin_engine(self, database: str = "postgres"):
+        """Autocommit engine for the cluster superuser; CREATE DATABASE cannot run in a transaction."""
+        with self._lock:
+            if database not in self._engines:
+                url = URL.create("postgresql+psycopg2", username=self.admin_user, password=self.admin_password,
+                                 host=self.host, port=self.port, database=database)
+                self._engines[database] = create_engine(url, isolation_level="AUTOCOMMIT", pool_size=2, max_overflow=2)
+            return self._engines[database]
+
+    def run_admin(self, statements, database: str = "postgres"):
+        with self.admin_engine(database).connect() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+
+    def existing_databases(self, names: Sequence[str]) -> List[str]:
+        with self.admin_engine().connect() as conn:
+            rows = conn.execute(text("SELECT datname FROM pg_database WHERE datname = ANY(:names)"), {"names": list(names)})
+            return [row[0] for row in rows]
+
+    def protect_databases(self):
+        """
+        Revoke PUBLIC's CONNECT on the cluster's non-tenant databases, once per backend.
+
+        Revoking CONNECT from a single tenant role would not help: the role keeps it through PUBLIC.
+        Owners and superusers still connect after the revoke.
+        """
+        if self._databases_protected:
+            return
+        existing = self.existing_databases(self.protected_databases)
+        self.run_admin([f"REVOKE CONNECT ON DATABASE {_quote_database(name)} FROM PUBLIC" for name in existing])
+        self._databases_protected = True
+
+    def role_exists(self, username: str) -> bool:
+        with self.admin_engine().connect() as conn:
+            return conn.execute(text("SELECT 1 FROM pg_roles WHERE rolname = :name"), {"name": username}).first() is not None
+
+    def create_role(self, user: UserCreate):
+        if self.role_exists(user.username):
+            raise ValueError(f"Role {user.username} already exists on the shared cluster")
+        self.run_admin([f"CREATE ROLE {quote_identifier(user.username)} LOGIN PASSWORD {quote_literal(user.password)}"])
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        for engine in self._engines.values():
+            engine.dispose()
+
+    @abstractmethod
+    def _provision(self, user: UserCreate) -> Dict[str, Any]:
+        """Create the tenant's role and database or schema; runs in a worker thread."""
+
+    async def wait_ready(self, tenant: Dict[str, Any], timeout: float):
+        # The shared cluster is already serving; the new database or schema is usable at once
+        pass
+
+    async def provision(self, user: UserCreate) -> Dict[str, Any]:
+        try:
+            validate_identifier(user.username)
+            await run_blocking(self.protect_databases)
+            return await run_blocking(self._provision, user)
+        except (ValueError, SQLAlchemyError) as e:
+            logging.error(f"Failed to provision tenant {user.username} in {self.mode} mode: {e}")
+            raise
+
+    def terminate_sessions(self, username: str):
+        """Close the tenant's remaining server sessions so its database or role can be dropped."""
+        with self.admin_engine().connect() as conn:
+            conn.execute(text("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE usename = :name"),
+                         {"name": username})
+
+    @abstractmethod
+    def _deprovision(self, endpoint: Dict[str, Any]):
+        """Drop the tenant's database or schema and its role; runs in a worker thread."""
+
+    async def deprovision(self, endpoint: Dict[str, Any]):
+        """Drop a tenant's database or schema and its role from the shared cluster."""
+        validate_identifier(endpoint["username"])
+        await run_blocking(self._deprovision, endpoint)
+
+
+class SharedDatabaseTenancy(_SharedClusterTenancy):
+    """A database per tenant on a shared cluster; tenants are isolated by database ownership."""
+
+    mode = "database"
+
+    def _provision(self, user: UserCreate) -> Dict[str, Any]:
+        username = user.username
+        role = quote_identifier(username)
+        self.create_role(user)
+        self.run_admin([
+            f"CREATE DATABASE {role} OWNER {role}",
+            # Other tenants' roles must not be able to connect to this database
+            f"REVOKE ALL ON DATABASE {role} FROM PUBLIC",
+        ])
+        return {
+            "container_id": SHARED_CONTAINER_ID,
+            "hostname": self.host,
+            "port": self.port,
+            "tenancy_mode": self.mode,
+            "database_name": username,
+            "schema_name": None,
+        }
+
+    def _deprovision(self, endpoint: Dict[str, Any]):
+        username = endpoint["username"]
+        role = quote_identifier(username)
+        self.terminate_sessions(username)
+        self.run_admin([
+            f"DROP DATABASE IF EXISTS {role}",
+            f"DROP ROLE IF EXISTS {role}",
+        ])
+
+
+class SchemaTenancy(_SharedClusterTenancy):
+    """A schema per tenant in one shared database; the role's search_path points at its schema."""
+
+    mode = "schema"
+
+    def __init__(self, database: str = SHARED_SCHEMA_DATABASE, **kwargs):
+        super().__init__(**kwargs)
+        self.database = database
+        self._database_ready = False
+
+    def _ensure_database(self):
+        if self._database_ready:
+            return
+        if not self.existing_databases([self.database]):
+            database = _quote_database(self.database)
+            self.run_admin([
+                f"CREATE DATABASE {database}",
+                f"REVOKE ALL ON DATABASE {database} FROM PUBLIC",
+            ])
+        # Tenants create their tables in their own schema, never in public
+        self.run_admin(["REVOKE ALL ON SCHEMA public FROM PUBLIC"], database=self.database)
+        self._database_ready = True
+
+    def _provision(self, user: UserCreate) -> Dict[str, Any]:
+        username = user.username
+        role = quote_identifier(username)
+        database = _quote_database(self.database)
+        self._ensure_database()
+        self.create_role(user)
+        self.run_admin([f"GRANT CONNECT ON DATABASE {database} TO {role}"])
+        self.run_admin([
+            f"CREATE SCHEMA {role} AUTHORIZATION {role}",
+            f"ALTER ROLE {role} IN DATABASE {database} SET search_path = {role}",
+        ], database=self.database)
+        return {
+            "container_id": SHARED_CONTAINER_ID,
+            "hostname": self.host,
+            "port": self.port,
+            "tenancy_mode": self.mode,
+            "database_name": self.database,
+            "schema_name": username,
+        }
+
+    def _deprovision(self, endpoint: Dict[str, Any]):
+        username = endpoint["username"]
+        role = quote_identifier(username)
+        database = _quote_database(self.database)
+        self.terminate_sessions(username)
+        self.run_admin([
+            f"DROP SCHEMA IF EXISTS {role} CASCADE",
+            # Drops the role's remaining privileges (CONNECT on the shared database) so it can be removed
+            f"DROP OWNED BY {role}",
+        ], database=self.database)
+        self.run_admin([f"REVOKE ALL ON DATABASE {database} FROM {role}", f"DROP ROLE IF EXISTS {role}"])
+
+
+_TENANCY_BACKENDS = {
+    "container": ContainerTenancy,
+    "database": SharedDatabaseTenancy,
+    "schema": SchemaTenancy,
+}
+
+def create_tenancy(mode: str = TENANCY_MODE):
+    """Instantiate the tenancy backend used for new registrations."""
+    if mode not in _TENANCY_BACKENDS:
+        raise ValueError(f"Unsupported tenancy mode: {mode}")
+    logging.info(f"New tenants are provisioned in '{mode}' mode")
+    return _TENANCY_BACKENDS[mode]()
+
+tenancy = create_tenancy()
+
+_other_backends = {}
+
+def tenancy_for(mode: str):
+    """Backend managing tenants stored with the given tenancy_mode, which may predate the configured mode."""
+    if mode == tenancy.mode:
+        return tenancy
+    if mode not in _other_backends:
+        _other_backends[mode] = create_tenancy(mode)
+    return _other_backends[mode]
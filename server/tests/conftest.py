@@ -0,0 +1,14 @@
+"""Shared setup for the server tests: import path and a harmless main database URL."""
+import os
+import sys
+
+# Tests run from server/ or the repository root but import the flat server modules
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+# The server modules build their main-DB engine at import time; nothing connects to it
+os.environ.setdefault("MAIN_DB_HOST", "localhost")
+os.environ.setdefault("MAIN_DB_NAME", "test")
+os.environ.setdefault("MAIN_DB_USER", "test")
+os.environ.setdefault("MAIN_DB_PASSWORD", "test")
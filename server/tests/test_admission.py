@@ -0,0 +1,39 @@
+"""A tenant's scheduler slot is held until its response body has been sent, streamed or not."""
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+import main
+from scheduler import TenantScheduler
+
+
+def test_slot_held_until_stream_finishes(monkeypatch):
+    scheduler = TenantScheduler(max_concurrency=4, tenant_concurrency=1, tenant_queue=0, rate=1000, burst=1000)
+    monkeypatch.setattr(main, "scheduler", scheduler)
+    running_during_stream = []
+
+    app = FastAPI()
+    app.middleware("http")(main.admit_tenant_request)
+
+    @app.get("/db/users/{username}/export")
+    async def export(username: str):
+        async def rows():
+            for i in range(3):
+                await asyncio.sleep(0)
+                running_during_stream.append(scheduler.running)
+                yield f"{i}\n"
+        return StreamingResponse(rows())
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.get("/db/users/alice/export")
+            second = await client.get("/db/users/alice/export")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.text == second.text == "0\n1\n2\n"
+    assert running_during_stream == [1] * 6
+    assert scheduler.running == 0
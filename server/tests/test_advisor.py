@@ -0,0 +1,59 @@
+"""Index recommendations come from profiled predicates on big, sequentially scanned tables."""
+import asyncio
+
+from advisor import TABLE_STATS_QUERY, IndexAdvisor, extract_predicates, index_ddl, index_name
+from catalog import TenantCatalog
+from profiler import QueryProfiler
+from query_engine import QueryResult
+
+COLUMNS = {"orders": ["id", "customer_id", "status", "created_at"], "customers": ["id", "region"]}
+
+
+def test_extract_predicates():
+    query = ("SELECT * FROM orders o JOIN customers c ON c.id = o.customer_id "
+             "WHERE o.status = ? AND created_at >= ? AND c.region IN (...) ORDER BY o.id LIMIT ?")
+    assert extract_predicates(query, COLUMNS) == [("orders", ["status"], ["created_at"]), ("customers", ["region"], [])]
+    assert extract_predicates('UPDATE "orders" SET status = ? WHERE customer_id = ?', COLUMNS) == [
+        ("orders", ["customer_id"], [])]
+    assert extract_predicates("SELECT * FROM unknown WHERE a = ?", COLUMNS) == []
+
+
+def test_index_names_fit_postgres_limit():
+    assert index_name("orders", ["status"]) == "ix_orders_status"
+    assert len(index_name("orders", ["a_very_long_column_name"] * 4)) == 63
+    assert index_ddl("Order", ["status"]) == 'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_Order_status" ON "Order" (status)'
+
+
+class FakeCatalog:
+    async def get(self, username):
+        return TenantCatalog({table: [{"name": column} for column in columns] for table, columns in COLUMNS.items()})
+
+
+async def fake_query(username, sql_query):
+    if sql_query == TABLE_STATS_QUERY:
+        return QueryResult(rows=[("orders", 40, 400000, 2, 10000), ("customers", 9, 90, 0, 100)])
+    # Existing indexes: the primary keys and one led by orders.customer_id
+    return QueryResult(rows=[("orders", "orders_pkey", "id"), ("customers", "customers_pkey", "id"),
+                             ("orders", "ix_orders_customer_id_created_at", "customer_id,created_at")])
+
+
+def test_recommend_skips_small_tables_and_served_predicates():
+    profiler = QueryProfiler(enabled=True, slow_ms=1000)
+    for _ in range(3):
+        profiler.record("alice", "SELECT * FROM orders WHERE status = 'open' AND created_at > '2024-01-01'", 50.0)
+    profiler.record("alice", "SELECT * FROM orders WHERE status = 'open'", 20.0)
+    profiler.record("alice", "SELECT * FROM orders WHERE customer_id = 7", 30.0)
+    profiler.record("alice", "SELECT * FROM orders WHERE id = 7", 30.0)
+    profiler.record("alice", "SELECT * FROM customers WHERE region = 'eu'", 30.0)
+    advisor = IndexAdvisor(profiler=profiler, query=fake_query, catalog=FakeCatalog(), min_table_rows=1000)
+
+    advice = asyncio.run(advisor.recommend("alice"))
+    assert [(r["table"], r["columns"]) for r in advice["recommendations"]] == [("orders", ["status", "created_at"])]
+    assert advice["recommendations"][0]["calls"] == 3
+    skipped = {(entry["table"], tuple(entry["columns"])): entry["reason"] for entry in advice["skipped"]}
+    assert skipped == {
+        ("orders", ("status",)): "served by a higher-ranked recommendation",
+        ("orders", ("customer_id",)): "served by an existing index",
+        ("customers", ("region",)): "table has fewer than 1000 rows",
+    }
+    assert [entry["table"] for entry in advice["sequentially_scanned_tables"]] == ["orders"]
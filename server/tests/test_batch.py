@@ -0,0 +1,139 @@
+"""
+Batches and scripts must run inside the request's transaction.
+
+LazyBeginEngine behaves like SQLAlchemy's asyncpg adapter: BEGIN goes out with the first cursor
+execute, and SQL handed straight to the driver before that runs in its own implicit transaction
+and commits. With TEST_DATABASE_URL (a Postgres database the tests may create tables in) the same
+checks also run against the real driver.
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.exc import SQLAlchemyError
+
+from batch import plan_batch, run_batch
+from query_engine import PooledBackend
+from routing import TenantRoutingCache
+from schemas import BatchOperation
+
+SCRIPT = "INSERT INTO items (id) VALUES (1); INSERT INTO items (id) VALUES (2)"
+FAILING = "INSERT INTO missing_table (id) VALUES (3)"
+
+
+class LazyBeginConnection:
+    def __init__(self, engine):
+        self.engine = engine
+        self.begun = False
+        self.pending = 0
+
+    def _write(self, statement: str):
+        if "missing_table" in statement:
+            raise SQLAlchemyError('relation "missing_table" does not exist')
+        rows = statement.upper().count("INSERT INTO")
+        if self.begun:
+            self.pending += rows
+        else:
+            self.engine.rows += rows
+
+    async def exec_driver_sql(self, statement, parameters=None):
+        self.begun = True
+        self._write(statement)
+        return SimpleNamespace(returns_rows=False, rowcount=1)
+
+    async def execute(self, statement, parameters=None):
+        return await self.exec_driver_sql(str(statement), parameters)
+
+    async def get_raw_connection(self):
+        connection = self
+
+        class Driver:
+            async def execute(self, script):
+                connection.engine.scripts_outside_transaction += not connection.begun
+                connection._write(script)
+
+        return SimpleNamespace(driver_connection=Driver())
+
+
+class LazyBeginEngine:
+    """Counts committed rows of a table; rows written inside a rolled back transaction are dropped."""
+
+    def __init__(self):
+        self.rows = 0
+        self.scripts_outside_transaction = 0
+
+    def begin(self):
+        engine = self
+
+        class Transaction:
+            async def __aenter__(self):
+                self.conn = LazyBeginConnection(engine)
+                return self.conn
+
+            async def __aexit__(self, exc_type, *exc):
+                if exc_type is None:
+                    engine.rows += self.conn.pending
+                return False
+
+        return Transaction()
+
+
+def backend_for(engine):
+    endpoint = {"username": "tenant", "password": "secret", "container_hostname": "postgres_tenant",
+                "container_port": 5432}
+    return PooledBackend(routes=TenantRoutingCache(loader=lambda username: endpoint),
+                         engine_lookup=lambda key, url: engine)
+
+
+def script_then_failure():
+    return plan_batch([BatchOperation(op="sql", sql=SCRIPT), BatchOperation(op="sql", sql=FAILING)])
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_script_rolled_back_with_failing_step(pipeline):
+    engine = LazyBeginEngine()
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(run_batch("tenant", script_then_failure(), pipeline=pipeline, backend=backend_for(engine)))
+    assert raised.value.status_code == 400
+    assert engine.scripts_outside_transaction == 0
+    assert engine.rows == 0
+
+
+def test_script_committed_with_batch():
+    engine = LazyBeginEngine()
+    steps = plan_batch([BatchOperation(op="sql", sql=SCRIPT)])
+    asyncio.run(run_batch("tenant", steps, backend=backend_for(engine)))
+    assert engine.rows == 2
+
+
+def test_pooled_backend_script_runs_in_transaction():
+    engine = LazyBeginEngine()
+    asyncio.run(backend_for(engine).execute("tenant", SCRIPT))
+    assert engine.scripts_outside_transaction == 0
+    assert engine.rows == 2
+
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL is not set")
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_script_rolled_back_on_postgres(pipeline):
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    async def check():
+        engine = create_async_engine(make_url(os.environ["TEST_DATABASE_URL"]).set(drivername="postgresql+asyncpg"))
+        try:
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql("DROP TABLE IF EXISTS items")
+                await conn.exec_driver_sql("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+            with pytest.raises(HTTPException):
+                await run_batch("tenant", script_then_failure(), pipeline=pipeline, backend=backend_for(engine))
+            async with engine.connect() as conn:
+                assert (await conn.exec_driver_sql("SELECT count(*) FROM items")).scalar() == 0
+        finally:
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql("DROP TABLE IF EXISTS items")
+            await engine.dispose()
+
+    asyncio.run(check())
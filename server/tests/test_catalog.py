@@ -0,0 +1,88 @@
+"""Tenant catalogs are read once, and a catalog read that races with DDL is never cached."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from catalog import CatalogCache, is_ddl
+from query_engine import QueryResult
+
+
+class FakeCatalogSource:
+    """Answers CATALOG_QUERY from a dict of table -> columns; `gate` holds reads until it is set."""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.reads = 0
+        self.gate = None
+
+    async def __call__(self, username, sql_query):
+        self.reads += 1
+        rows = [(table, column, "integer", column == "id") for table, columns in self.tables.items() for column in columns]
+        if self.gate is not None:
+            await self.gate.wait()
+        return QueryResult(columns=["relname", "attname", "format_type", "attnotnull"], rows=rows, returns_rows=True)
+
+
+def test_concurrent_lookups_share_one_read():
+    source = FakeCatalogSource({"orders": ["id", "total"]})
+    cache = CatalogCache(query=source)
+
+    async def run():
+        return await asyncio.gather(*(cache.list_tables("alice") for _ in range(5)))
+
+    assert asyncio.run(run()) == [["orders"]] * 5
+    assert source.reads == 1
+
+
+def test_invalidation_during_load_is_not_cached():
+    source = FakeCatalogSource({"orders": ["id"]})
+    cache = CatalogCache(query=source)
+
+    async def run():
+        source.gate = asyncio.Event()
+        stale = asyncio.ensure_future(cache.get("alice"))
+        await asyncio.sleep(0)
+        # DDL lands while the catalog is being read
+        source.tables["customers"] = ["id", "name"]
+        cache.invalidate("alice")
+        source.gate.set()
+        await stale
+        source.gate = None
+        return await cache.list_tables("alice")
+
+    assert asyncio.run(run()) == ["customers", "orders"]
+    assert source.reads == 2
+
+
+def test_require_table_and_columns():
+    source = FakeCatalogSource({"orders": ["id", "total"]})
+    cache = CatalogCache(query=source)
+
+    async def run():
+        await cache.validate_columns("alice", "orders", ["id", "total"])
+        with pytest.raises(HTTPException) as unknown_column:
+            await cache.validate_columns("alice", "orders", ["id", "missing"])
+        with pytest.raises(HTTPException) as unknown_table:
+            await cache.require_table("alice", "nope")
+        return unknown_column.value.status_code, unknown_table.value.status_code
+
+    assert asyncio.run(run()) == (400, 404)
+
+
+def test_least_recent_tenant_evicted():
+    source = FakeCatalogSource({"orders": ["id"]})
+    cache = CatalogCache(max_tenants=2, query=source)
+
+    async def run():
+        for username in ("alice", "bob", "alice", "carol", "alice"):
+            await cache.get(username)
+
+    asyncio.run(run())
+    assert list(cache._catalogs) == ["carol", "alice"] and cache.evictions == 1
+    assert source.reads == 3
+
+
+def test_is_ddl():
+    assert is_ddl("create table t (id int)") and is_ddl("ALTER TABLE t ADD c int")
+    assert not is_ddl("SELECT created_at FROM t")
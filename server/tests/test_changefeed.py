@@ -0,0 +1,108 @@
+"""Change feed watermarks: every change below the horizon is read exactly once, however the reads are paged."""
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+from catalog import TenantCatalog
+from changefeed import ChangeFeed, changes_query, parse_watermark
+from models import CHANGE_FLOOR_TABLE, CHANGE_LOG_TABLE
+from query_engine import QueryResult
+
+# (txid, row_id) log entries: 10 inserts 1-3, 11 updates 2 and inserts 4, 12 deletes 3 and
+# updates 1; 13 updates 4 again but is still running, so it is at the horizon and not read yet
+LOG = [(10, 1), (10, 2), (10, 3), (11, 2), (11, 4), (12, 3), (12, 1), (13, 4)]
+ROWS = [(1, "a2"), (2, "b2"), (4, "d")]
+
+
+def tenant_database():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"CREATE TABLE {CHANGE_LOG_TABLE} (txid INTEGER, table_name TEXT, row_id INTEGER)")
+    conn.executemany(f"INSERT INTO {CHANGE_LOG_TABLE} VALUES (?, 'items', ?)", LOG)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO items VALUES (?, ?)", ROWS)
+    return conn
+
+
+class FakeTenant:
+    """Runs the feed's change queries on sqlite and answers HORIZON_QUERY with a fixed snapshot."""
+
+    def __init__(self, horizon=13, floor=10, complete=True):
+        self.conn = tenant_database()
+        self.horizon = (horizon, floor, complete)
+
+    async def __call__(self, username, sql_query):
+        if CHANGE_FLOOR_TABLE in sql_query:
+            return QueryResult(rows=[self.horizon], returns_rows=True)
+        cursor = self.conn.execute(sql_query)
+        return QueryResult(columns=[d[0] for d in cursor.description], rows=cursor.fetchall(), returns_rows=True)
+
+
+class FakeCatalog:
+    async def require_table(self, username, table_name):
+        return TenantCatalog({"items": [{"name": "id"}, {"name": "name"}], CHANGE_FLOOR_TABLE: []})
+
+
+def feed(**horizon):
+    return ChangeFeed(query=FakeTenant(**horizon), catalog=FakeCatalog())
+
+
+def read_all(changefeed, since=None, limit=None):
+    """Follow has_more to the end; returns the (txid, id, deleted) of every row and the final watermark."""
+    seen = []
+
+    async def run():
+        watermark, has_more = since, True
+        while has_more:
+            result, watermark, has_more = await changefeed.read("alice", "items", since=watermark, limit=limit)
+            seen.extend((row[0], row[2], bool(row[1])) for row in result.rows)
+        return watermark
+
+    return seen, asyncio.run(run())
+
+
+def test_changes_fold_to_last_transaction_below_horizon():
+    conn = tenant_database()
+    rows = conn.execute(changes_query("items", ["name"], (9, None), 13, 100)).fetchall()
+    assert rows == [(11, 0, 2, "b2"), (11, 0, 4, "d"), (12, 0, 1, "a2"), (12, 1, 3, None)]
+    assert conn.execute(changes_query("items", ["name"], (11, None), 13, 100)).fetchall() == rows[2:]
+    assert conn.execute(changes_query("items", ["name"], (11, 2), 13, 100)).fetchall() == rows[1:]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 100])
+def test_paged_reads_see_each_change_once(limit):
+    seen, watermark = read_all(feed(), limit=limit)
+    assert seen == [(11, 2, False), (11, 4, False), (12, 1, False), (12, 3, True)]
+    assert watermark == "12"
+
+
+def test_page_ending_inside_a_transaction():
+    async def run():
+        return await feed().read("alice", "items", since="11", limit=1)
+
+    result, watermark, has_more = asyncio.run(run())
+    assert (watermark, has_more) == ("12:1", True)
+    assert parse_watermark(watermark) == (12, 1)
+    assert read_all(feed(), since=watermark)[0] == [(12, 3, True)]
+
+
+def test_caught_up_watermark_stays_put():
+    assert read_all(feed(), since="12") == ([], "12")
+
+
+@pytest.mark.parametrize("since, complete", [("5", True), (None, False)])
+def test_refresh_required_below_floor(since, complete):
+    changefeed = feed(complete=complete)
+    with pytest.raises(HTTPException) as raised:
+        read_all(changefeed, since=since)
+    assert raised.value.status_code == 410
+    # Changes that land during the full read are sent again rather than lost
+    assert raised.value.detail["watermark"] == "12"
+    assert changefeed.refreshes_required == 1
+
+
+def test_invalid_watermark_is_400():
+    with pytest.raises(HTTPException) as raised:
+        read_all(feed(), since="12:x")
+    assert raised.value.status_code == 400
@@ -0,0 +1,89 @@
+"""
+The tenant pool registry reuses and bounds engines, and tenant connections keep their
+statement_timeout whatever happens to their first transaction.
+
+With TEST_DATABASE_URL the timeout is also read back from Postgres after a rolled back checkout.
+"""
+import asyncio
+import os
+
+import pytest
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import TenantPoolRegistry
+from profiler import QueryProfiler
+
+
+def recording_registry(calls, **kwargs):
+    def engine_factory(database_url, **options):
+        calls.append(options)
+        return create_async_engine(database_url, **options)
+
+    return TenantPoolRegistry(engine_factory=engine_factory, profiler=QueryProfiler(enabled=False), **kwargs)
+
+
+def url(username):
+    return f"postgresql+asyncpg://{username}:pw@host/{username}"
+
+
+def test_engine_reused_until_endpoint_changes():
+    calls = []
+    registry = recording_registry(calls)
+    engine = registry.get_engine("alice", url("alice"))
+    assert registry.get_engine("alice", url("alice")) is engine
+    moved = registry.get_engine("alice", "postgresql+asyncpg://alice:pw@otherhost/alice")
+    assert moved is not engine and len(calls) == 2
+    assert registry.stats()["hits"] == 1 and registry.stats()["evictions"] == 0
+
+
+def test_connection_budget_evicts_least_recently_used():
+    registry = recording_registry([], max_connections=4, min_pool_size=1, max_pool_size=1)
+    for username in ("alice", "bob", "alice", "carol"):
+        registry.get_engine(username, url(username))
+    assert list(registry._entries) == ["alice", "carol"]
+    stats = registry.stats()
+    assert stats["reserved_connections"] == 4 and stats["evictions"] == 1
+
+
+def test_idle_engines_evicted():
+    registry = recording_registry([], idle_seconds=60)
+    registry.get_engine("alice", url("alice"))
+    registry.get_engine("bob", url("bob"))
+    registry._entries["alice"].last_used -= 120
+    assert registry.evict_idle() == 1 and list(registry._entries) == ["bob"]
+    assert registry.evict("bob") and not registry.evict("bob")
+
+
+def test_statement_timeout_sent_at_connect():
+    calls = []
+    registry = recording_registry(calls, statement_timeout_ms=1500)
+    registry.get_engine(("host", 5432, "alice"), "postgresql+asyncpg://alice:pw@host/alice")
+    assert calls[0]["connect_args"] == {"server_settings": {"statement_timeout": "1500"}}
+
+
+def test_statement_timeout_disabled():
+    calls = []
+    registry = recording_registry(calls, statement_timeout_ms=0)
+    registry.get_engine(("host", 5432, "alice"), "postgresql+asyncpg://alice:pw@host/alice")
+    assert "connect_args" not in calls[0]
+
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL is not set")
+def test_statement_timeout_survives_rollback_on_postgres():
+    url = make_url(os.environ["TEST_DATABASE_URL"]).set(drivername="postgresql+asyncpg")
+    registry = TenantPoolRegistry(statement_timeout_ms=1500, min_pool_size=1, max_pool_size=1)
+
+    async def check():
+        engine = registry.get_engine(("test",), url)
+        try:
+            # The first transaction on the connection is rolled back, as reset-on-return does
+            async with engine.connect() as conn:
+                await conn.exec_driver_sql("SELECT 1")
+                await conn.rollback()
+            async with engine.connect() as conn:
+                return (await conn.exec_driver_sql("SHOW statement_timeout")).scalar()
+        finally:
+            await registry.dispose_all()
+
+    assert asyncio.run(check()) == "1500ms"
@@ -0,0 +1,82 @@
+"""Merging, aggregating and schema comparison of per-tenant fan-out results."""
+import pytest
+from fastapi import HTTPException
+
+from fanout import FanOut, aggregate_rows, merge_results, schema_drift
+
+
+def ok(tenant, columns, rows):
+    return {"tenant": tenant, "status": "ok", "columns": columns, "rows": rows}
+
+
+def test_merge_aligns_columns_and_skips_failures():
+    columns, rows = merge_results([
+        ok("alice", ["table_name", "total_bytes"], [("orders", 100)]),
+        {"tenant": "bob", "status": "timeout", "error": "Timed out"},
+        ok("carol", ["total_bytes", "note"], [(5, "x")]),
+    ])
+    assert columns == ["tenant", "table_name", "total_bytes", "note"]
+    assert rows == [("alice", "orders", 100, None), ("carol", None, 5, "x")]
+
+
+ROW_COUNTS = (["tenant", "table_name", "row_estimate"],
+              [("alice", "orders", 10), ("alice", "users", 3), ("bob", "orders", 30), ("carol", "orders", None)])
+
+
+@pytest.mark.parametrize("how, expected", [
+    ("sum", [("orders", 40, 3), ("users", 3, 1)]),
+    ("min", [("orders", 10, 3), ("users", 3, 1)]),
+    ("max", [("orders", 30, 3), ("users", 3, 1)]),
+    ("avg", [("orders", 20, 3), ("users", 3, 1)]),
+])
+def test_aggregate_groups_on_text_columns(how, expected):
+    aggregated = aggregate_rows(*ROW_COUNTS, how)
+    assert aggregated == {"columns": ["table_name", f"{how}_row_estimate", "tenants"], "rows": expected}
+
+
+def test_aggregate_without_groups_and_bad_arguments():
+    sizes = (["tenant", "total_bytes"], [("alice", 100), ("bob", 300)])
+    assert aggregate_rows(*sizes, "avg") == {"columns": ["avg_total_bytes", "tenants"], "rows": [(200, 2)]}
+    with pytest.raises(ValueError):
+        aggregate_rows(*ROW_COUNTS, "median")
+    with pytest.raises(ValueError):
+        aggregate_rows(*ROW_COUNTS, "sum", group_by=["tenant_id"])
+
+
+def schema_result(tenant, tables):
+    rows = [(table, column, column_type, not_null) for table, columns in tables.items()
+            for column, column_type, not_null in columns]
+    return ok(tenant, ["relname", "attname", "format_type", "attnotnull"], rows)
+
+
+ORDERS = [("id", "integer", True), ("total", "numeric", False)]
+
+
+def test_schema_drift_reports_variants_and_missing_tables():
+    drift = schema_drift([
+        schema_result("alice", {"orders": ORDERS, "_change_log": [("txid", "bigint", True)]}),
+        schema_result("bob", {"orders": ORDERS}),
+        schema_result("carol", {"orders": [("id", "integer", True), ("total", "text", False), ("note", "text", False)],
+                                "users": [("id", "integer", True)]}),
+        {"tenant": "dave", "status": "error", "error": "connection refused"},
+    ])
+    assert drift["tenants"] == 3 and drift["consistent_tables"] == 0
+    orders, users = drift["drift"]
+    assert orders["table"] == "orders" and orders["missing_in"] == 0
+    assert [column["name"] for column in orders["reference_columns"]] == ["id", "total"]
+    assert orders["variants"] == [{"tenants": 1, "sample_tenants": ["carol"], "missing_columns": [],
+                                   "extra_columns": ["note"], "changed_columns": ["total"]}]
+    assert users["table"] == "users" and users["variants"] == []
+    assert users["sample_missing_in"] == ["alice", "bob"]
+
+
+def test_schema_drift_consistent():
+    drift = schema_drift([schema_result("alice", {"orders": ORDERS}), schema_result("bob", {"orders": ORDERS})])
+    assert drift == {"tenants": 2, "consistent_tables": 1, "drift": []}
+
+
+@pytest.mark.parametrize("sql", ["DELETE FROM orders", "SELECT 1; DROP TABLE orders"])
+def test_statement_must_be_one_read(sql):
+    with pytest.raises(HTTPException) as raised:
+        FanOut().statement(sql=sql)
+    assert raised.value.status_code == 400
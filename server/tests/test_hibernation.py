@@ -0,0 +1,61 @@
+"""Hibernation must never stop a tenant's container under a request for it."""
+import asyncio
+import time
+
+from benchmarks.fakes import FakeDockerClient
+from database import TenantPoolRegistry
+from hibernation import HibernationScheduler
+
+TENANT = "alice"
+
+
+def scheduler_with_idle_tenant(api_latency: float = 0.0):
+    client = FakeDockerClient(api_latency=api_latency)
+    container = client.containers.add(f"postgres_{TENANT}")
+    scheduler = HibernationScheduler(idle_seconds=60, check_interval=3600, wake_timeout=5, docker_client=client,
+                                     pools=TenantPoolRegistry())
+    scheduler.last_access[TENANT] = time.monotonic() - 120
+    return scheduler, container
+
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def test_request_during_hibernation_waits_and_wakes():
+    scheduler, container = scheduler_with_idle_tenant(api_latency=0.02)
+
+    async def run():
+        hibernating = asyncio.ensure_future(scheduler.hibernate(TENANT))
+        await until(lambda: TENANT in scheduler._hibernating)
+        await scheduler.touch(TENANT)
+        return await hibernating
+
+    assert asyncio.run(run()) is True
+    assert scheduler.wakes == 1
+    assert container.status == "running" and TENANT not in scheduler.hibernated
+
+
+def test_tenant_touched_after_sweep_is_skipped():
+    scheduler, container = scheduler_with_idle_tenant(api_latency=0.02)
+
+    async def run():
+        hibernating = asyncio.ensure_future(scheduler.hibernate(TENANT))
+        # Lands while the container is looked up, after the sweep found the tenant idle
+        await asyncio.sleep(0.005)
+        await scheduler.touch(TENANT)
+        return await hibernating
+
+    assert asyncio.run(run()) is False
+    assert container.status == "running" and scheduler.hibernations_skipped == 1
+
+
+def test_tenant_with_request_in_flight_is_skipped():
+    scheduler, container = scheduler_with_idle_tenant()
+    scheduler.begin(TENANT)
+    assert asyncio.run(scheduler.hibernate_idle()) == 0
+    assert container.status == "running"
+    scheduler.end(TENANT)
+    assert asyncio.run(scheduler.hibernate_idle()) == 1
+    assert container.status == "exited" and TENANT in scheduler.hibernated
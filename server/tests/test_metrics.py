@@ -0,0 +1,59 @@
+"""Prometheus rendering, bounded tenant labels, and per-route timing with a Server-Timing header."""
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+import metrics
+from metrics import MetricsRegistry, RequestMetricsMiddleware, span
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("op_seconds", "Operation time.", ("op",), buckets=(0.1, 1.0))
+    counter = registry.counter("ops_total", "Operations.", ("op",))
+    for seconds in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(seconds, 'say "hi"')
+        counter.inc('say "hi"')
+    assert registry.render().splitlines() == [
+        "# HELP op_seconds Operation time.",
+        "# TYPE op_seconds histogram",
+        'op_seconds_bucket{op="say \\"hi\\"",le="0.1"} 1',
+        'op_seconds_bucket{op="say \\"hi\\"",le="1.0"} 3',
+        'op_seconds_bucket{op="say \\"hi\\"",le="+Inf"} 4',
+        'op_seconds_sum{op="say \\"hi\\""} 4.25',
+        'op_seconds_count{op="say \\"hi\\""} 4',
+        "# HELP ops_total Operations.",
+        "# TYPE ops_total counter",
+        'ops_total{op="say \\"hi\\""} 4',
+    ]
+    assert histogram.snapshot('say "hi"') == {"count": 4, "sum": 4.25}
+
+
+def test_tenant_labels_are_capped(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MAX_TENANTS", 2)
+    registry = MetricsRegistry()
+    assert [registry.tenant_label(name) for name in ("alice", "bob", "carol", "alice")] == ["alice", "bob", "_other", "alice"]
+
+
+def test_request_timed_per_route_template():
+    app = FastAPI()
+
+    @app.get("/users/{username}/tables")
+    async def tables(username: str):
+        with span("execute"):
+            await asyncio.sleep(0)
+        return []
+
+    app.add_middleware(RequestMetricsMiddleware, app_name="test", tenant_of=lambda path: path.split("/")[2])
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/users/alice/tables")
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.headers["server-timing"].startswith("execute;dur=")
+    assert metrics.http_requests._values[("test", "GET", "/users/{username}/tables", "200")] >= 1
+    assert metrics.tenant_latency.snapshot(metrics.registry.tenant_label("alice"))["count"] >= 1
@@ -0,0 +1,18 @@
+"""SQL built for tenant tables must name them the way create_table_in_db created them."""
+import sqlite3
+
+from models import full_scan_query, keyset_page_query
+
+
+def test_mixed_case_and_reserved_names_are_quoted():
+    assert keyset_page_query("Orders", limit=10, after_id=5) == 'SELECT * FROM "Orders" WHERE id > 5 ORDER BY id LIMIT 10'
+    assert full_scan_query("order") == 'SELECT * FROM "order" ORDER BY id'
+    assert full_scan_query("orders") == "SELECT * FROM orders ORDER BY id"
+
+
+def test_reserved_word_table_can_be_paged():
+    conn = sqlite3.connect(":memory:")
+    conn.execute('CREATE TABLE "order" (id INTEGER PRIMARY KEY, item TEXT)')
+    conn.executemany('INSERT INTO "order" (id, item) VALUES (?, ?)', [(1, "a"), (2, "b"), (3, "c")])
+    assert conn.execute(keyset_page_query("order", limit=2, after_id=1)).fetchall() == [(2, "b"), (3, "c")]
+    assert len(conn.execute(full_scan_query("order")).fetchall()) == 3
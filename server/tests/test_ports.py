@@ -0,0 +1,23 @@
+"""An owner holds at most one port, so releasing it always returns everything it took."""
+import pytest
+
+from ports import PortAllocator
+
+
+def test_allocate_twice_returns_the_held_port():
+    allocator = PortAllocator(start=20000, end=20009)
+    port = allocator.allocate("postgres_alice")
+    assert allocator.allocate("postgres_alice") == port
+    assert allocator.release("postgres_alice") == port
+    assert allocator.release("postgres_alice") is None
+    assert len({allocator.allocate(f"c{i}") for i in range(10)}) == 10
+
+
+def test_rename_onto_an_owner_with_a_port_is_refused():
+    allocator = PortAllocator(start=20000, end=20009)
+    warm = allocator.allocate("postgres_warm_1")
+    held = allocator.allocate("postgres_alice")
+    with pytest.raises(RuntimeError):
+        allocator.rename("postgres_warm_1", "postgres_alice")
+    assert allocator.release("postgres_alice") == held
+    assert allocator.release("postgres_warm_1") == warm
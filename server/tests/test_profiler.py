@@ -0,0 +1,61 @@
+"""Sampled plans of slow statements re-run only SELECTs, and only inside a read-only transaction."""
+import asyncio
+import json
+from types import SimpleNamespace
+
+from profiler import QueryProfiler
+
+PLAN = [{"Plan": {"Node Type": "Seq Scan", "Relation Name": "orders", "Total Cost": 18.5, "Plan Rows": 850,
+                  "Actual Rows": 12, "Rows Removed by Filter": 838, "Shared Hit Blocks": 9, "Shared Read Blocks": 1},
+         "Planning Time": 0.1, "Execution Time": 4.2}]
+
+
+class RecordingConnection:
+    def __init__(self, statements):
+        self.statements = statements
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execution_options(self, **options):
+        return self
+
+    async def begin(self):
+        return SimpleNamespace(rollback=self._rollback)
+
+    async def _rollback(self):
+        pass
+
+    async def exec_driver_sql(self, statement, parameters=()):
+        self.statements.append(statement)
+        return SimpleNamespace(scalar=lambda: json.dumps(PLAN))
+
+
+def explain(query):
+    statements = []
+    engine = SimpleNamespace(connect=lambda: RecordingConnection(statements))
+    profiler = QueryProfiler(enabled=True, slow_ms=0, explain_sample_rate=1)
+
+    async def run():
+        fingerprint_id = profiler.record("tenant", query, 5.0)
+        profiler._maybe_explain(engine, "tenant", fingerprint_id, query, None)
+        await asyncio.gather(*profiler._explain_tasks)
+
+    asyncio.run(run())
+    return statements, profiler.top(1)[0]["plan"]
+
+
+def test_slow_select_is_analyzed_read_only():
+    query = "SELECT * FROM orders WHERE status = 'open'"
+    statements, plan = explain(query)
+    assert statements == ["SET TRANSACTION READ ONLY", f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}"]
+    assert plan["seq_scans"] == ["orders"] and plan["actual_rows"] == 12 and plan["plan_rows"] == 850
+    assert plan["rows_removed_by_filter"] == 838 and plan["execution_ms"] == 4.2
+
+
+def test_data_modifying_with_is_not_explained():
+    statements, plan = explain("WITH moved AS (DELETE FROM orders RETURNING *) SELECT count(*) FROM moved")
+    assert statements == [] and plan is None
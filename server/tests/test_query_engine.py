@@ -0,0 +1,36 @@
+"""A slow tenant's statements must not hold up other tenants on the pooled async engine."""
+import asyncio
+import time
+
+from benchmarks.fakes import FakeAsyncEngine, fake_endpoint
+from query_engine import PooledBackend
+from routing import TenantRoutingCache
+
+
+def backend_with_slow_tenant(slow_latency: float):
+    engines = {}
+
+    def engine_lookup(key, url):
+        if key not in engines:
+            engines[key] = FakeAsyncEngine(latency=slow_latency if key[0] == "postgres_slow" else 0.0)
+        return engines[key]
+
+    return PooledBackend(routes=TenantRoutingCache(loader=fake_endpoint), engine_lookup=engine_lookup)
+
+
+def test_fast_tenant_not_blocked_by_slow_tenant():
+    backend = backend_with_slow_tenant(0.5)
+
+    async def run():
+        slow = asyncio.ensure_future(backend.execute("slow", "SELECT pg_sleep(0.5)"))
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        fast = await backend.execute("fast", "SELECT 1")
+        elapsed = time.perf_counter() - start
+        finished_first = not slow.done()
+        await slow
+        return fast, elapsed, finished_first
+
+    fast, elapsed, finished_first = asyncio.run(run())
+    assert fast.rows == [(1,)] and fast.returns_rows
+    assert finished_first and elapsed < 0.25
@@ -0,0 +1,86 @@
+"""Cached table reads answer 304 on a matching ETag and never outlive a write to their table."""
+import asyncio
+from types import SimpleNamespace
+
+from result_cache import ResultCache, cached_json_response, etag_matches
+
+
+def request(if_none_match=None):
+    return SimpleNamespace(headers={"if-none-match": if_none_match} if if_none_match else {})
+
+
+class Reader:
+    """Produces the table's current rows, counting the reads that reach the database."""
+
+    def __init__(self, rows, during_read=None):
+        self.rows = rows
+        self.during_read = during_read
+        self.reads = 0
+
+    async def __call__(self):
+        self.reads += 1
+        if self.during_read is not None:
+            self.during_read()
+        return list(self.rows)
+
+
+def read(cache, reader, if_none_match=None, table_name="orders", params=("limit", 10)):
+    return asyncio.run(cached_json_response(request(if_none_match), "alice", table_name, params, reader, cache=cache))
+
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('W/"a"', '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b"', '"a"')
+    assert not etag_matches(None, '"a"')
+
+
+def test_hit_and_not_modified():
+    cache = ResultCache(max_bytes=2 ** 20, max_entry_bytes=2 ** 20, ttl=60)
+    reader = Reader([{"id": 1}])
+    first = read(cache, reader)
+    second = read(cache, reader)
+    assert (first.headers["X-Cache"], second.headers["X-Cache"]) == ("MISS", "HIT")
+    assert first.body == second.body and reader.reads == 1
+    revalidated = read(cache, reader, if_none_match=first.headers["ETag"])
+    assert revalidated.status_code == 304 and revalidated.body == b""
+    assert cache.stats()["not_modified"] == 1
+
+
+def test_write_invalidates_table_and_changes_etag():
+    cache = ResultCache(max_bytes=2 ** 20, max_entry_bytes=2 ** 20, ttl=60)
+    reader = Reader([{"id": 1}])
+    before = read(cache, reader)
+    other = read(cache, Reader([{"id": 9}]), table_name="customers")
+    reader.rows.append({"id": 2})
+    cache.invalidate_table("alice", "orders")
+    after = read(cache, reader, if_none_match=before.headers["ETag"])
+    assert after.status_code == 200 and after.headers["X-Cache"] == "MISS"
+    assert after.headers["ETag"] != before.headers["ETag"] and reader.reads == 2
+    # Other tables of the tenant keep their entries; raw SQL drops them all
+    assert read(cache, Reader([]), table_name="customers").headers["ETag"] == other.headers["ETag"]
+    cache.invalidate_tenant("alice")
+    assert read(cache, reader).headers["X-Cache"] == "MISS"
+
+
+def test_read_racing_a_write_is_not_cached():
+    cache = ResultCache(max_bytes=2 ** 20, max_entry_bytes=2 ** 20, ttl=60)
+    reader = Reader([{"id": 1}], during_read=lambda: cache.invalidate_table("alice", "orders"))
+    read(cache, reader)
+    reader.during_read = None
+    assert read(cache, reader).headers["X-Cache"] == "MISS" and reader.reads == 2
+    assert read(cache, reader).headers["X-Cache"] == "HIT"
+
+
+def test_budget_evicts_least_recent_and_skips_large_bodies():
+    rows = [{"id": 1, "name": "x" * 100}]
+    size = len(read(ResultCache(max_bytes=0), Reader(rows)).body)
+    cache = ResultCache(max_bytes=2 * size, max_entry_bytes=size, ttl=60)
+    for page in range(3):
+        read(cache, Reader(rows), params=("page", page))
+    assert cache.stats()["entries"] == 2 and cache.evictions == 1
+    assert read(cache, Reader(rows), params=("page", 0)).headers["X-Cache"] == "MISS"
+    read(cache, Reader(rows * 2), params=("big",))
+    assert ("alice", "orders", ("big",)) not in cache._entries and cache.bytes <= 2 * size
@@ -0,0 +1,60 @@
+"""Tenant routing lookups are served from memory, shared between concurrent misses, and expire."""
+import asyncio
+import threading
+
+from routing import TenantRoutingCache
+
+ENDPOINTS = {"alice": {"username": "alice", "host": "postgres_alice", "port": 5432}}
+
+
+class Loader:
+    """Stands in for the users-table read; counts calls and can hold them until released."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, username):
+        self.calls += 1
+        self.release.wait(5)
+        return ENDPOINTS.get(username)
+
+
+def test_concurrent_misses_share_one_read():
+    loader = Loader()
+    cache = TenantRoutingCache(loader=loader, ttl=60)
+
+    async def run():
+        loader.release.clear()
+        lookups = asyncio.gather(*(cache.get("alice") for _ in range(10)))
+        await asyncio.sleep(0.01)
+        loader.release.set()
+        return await lookups
+
+    assert asyncio.run(run()) == [ENDPOINTS["alice"]] * 10
+    assert loader.calls == 1
+    assert asyncio.run(cache.get("alice")) == ENDPOINTS["alice"] and cache.hits == 1
+
+
+def test_unknown_tenant_remembered_briefly():
+    loader = Loader()
+    cache = TenantRoutingCache(loader=loader, ttl=60, negative_ttl=60)
+
+    async def run():
+        return [await cache.get("mallory") for _ in range(3)]
+
+    assert asyncio.run(run()) == [None] * 3 and loader.calls == 1
+    cache._entries["mallory"] = (None, 0)
+    assert asyncio.run(cache.get("mallory")) is None
+    assert loader.calls == 2 and cache.expirations == 1
+
+
+def test_invalidate_and_warm():
+    loader = Loader()
+    cache = TenantRoutingCache(loader=loader, ttl=60, bulk_loader=lambda: dict(ENDPOINTS))
+    asyncio.run(cache.warm())
+    assert asyncio.run(cache.get("alice")) == ENDPOINTS["alice"] and loader.calls == 0
+    cache.invalidate("alice")
+    assert asyncio.run(cache.get("alice")) == ENDPOINTS["alice"] and loader.calls == 1
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,113 @@
+"""Admission control: fair, weighted sharing of freed slots, 429/503 refusals, and pruning of idle tenants."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from scheduler import TenantScheduler
+
+
+def grant_order(scheduler, waiting):
+    """Queue `waiting` (username per request, in arrival order) behind one running request, then record grants."""
+    order = []
+
+    async def request(username):
+        await scheduler.acquire(username)
+        order.append(username)
+
+    async def run():
+        await scheduler.acquire("holder")
+        tasks = []
+        for username in waiting:
+            tasks.append(asyncio.ensure_future(request(username)))
+            await asyncio.sleep(0)
+        scheduler.release("holder")
+        for granted in range(1, len(waiting) + 1):
+            while len(order) < granted:
+                await asyncio.sleep(0)
+            scheduler.release(order[-1])
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    return order
+
+
+def test_deep_queue_does_not_starve_other_tenants():
+    scheduler = TenantScheduler(max_concurrency=1, tenant_concurrency=1, tenant_queue=8, rate=1000, burst=1000)
+    order = grant_order(scheduler, ["heavy"] * 4 + ["light"] * 2)
+    assert order == ["heavy", "light", "heavy", "light", "heavy", "heavy"]
+    assert scheduler.running == 0
+
+
+def test_weight_grants_several_slots_per_turn():
+    scheduler = TenantScheduler(max_concurrency=1, tenant_concurrency=1, tenant_queue=8, rate=1000, burst=1000)
+    scheduler.set_weight("gold", 2)
+    order = grant_order(scheduler, ["gold"] * 4 + ["basic"] * 2)
+    assert order == ["gold", "gold", "basic", "gold", "gold", "basic"]
+
+
+def test_rate_limit_and_full_queue_are_429():
+    scheduler = TenantScheduler(max_concurrency=1, tenant_concurrency=1, tenant_queue=0, rate=0.001, burst=2)
+
+    async def run():
+        await scheduler.acquire("alice")
+        with pytest.raises(HTTPException) as queue_full:
+            await scheduler.acquire("alice")
+        with pytest.raises(HTTPException) as rate_limited:
+            await scheduler.acquire("alice")
+        return queue_full.value, rate_limited.value
+
+    queue_full, rate_limited = asyncio.run(run())
+    assert queue_full.status_code == rate_limited.status_code == 429
+    assert "queued" in queue_full.detail and "Rate limit" in rate_limited.detail
+    assert int(rate_limited.headers["Retry-After"]) >= 1
+
+
+def test_queue_timeout_is_503():
+    scheduler = TenantScheduler(max_concurrency=1, tenant_concurrency=1, tenant_queue=1, rate=1000, burst=1000,
+                                queue_timeout=0.01)
+
+    async def run():
+        await scheduler.acquire("alice")
+        with pytest.raises(HTTPException) as timed_out:
+            await scheduler.acquire("bob")
+        scheduler.release("alice")
+        return timed_out.value
+
+    assert asyncio.run(run()).status_code == 503
+    assert scheduler.running == 0 and scheduler.timeouts == 1
+
+
+def test_cancelled_waiter_then_prune():
+    scheduler = TenantScheduler(max_concurrency=1, tenant_concurrency=1, tenant_queue=4, rate=1000, burst=1000)
+
+    async def run():
+        await scheduler.acquire("alice")
+        waiting = asyncio.ensure_future(scheduler.acquire("bob"))
+        await asyncio.sleep(0)
+        assert "bob" in scheduler._ready
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        # A minute later bob is idle with a full bucket, but still in the ready ring
+        scheduler._tenants["bob"].bucket.updated -= 60
+        scheduler._last_prune = 0
+        scheduler._prune()
+        assert "bob" not in scheduler._tenants and "bob" not in scheduler._ready
+        scheduler.release("alice")
+        await scheduler.acquire("bob")
+        scheduler.release("bob")
+
+    asyncio.run(run())
+    assert scheduler.running == 0
+
+
+def test_dispatch_skips_tenant_pruned_while_ready():
+    scheduler = TenantScheduler(max_concurrency=1, tenant_concurrency=1, tenant_queue=4, rate=1000, burst=1000)
+    scheduler._ready["ghost"] = 1
+
+    async def run():
+        await scheduler.acquire("alice")
+        scheduler.release("alice")
+
+    asyncio.run(run())
+    assert scheduler.running == 0 and "ghost" not in scheduler._ready
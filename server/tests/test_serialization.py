@@ -0,0 +1,134 @@
+"""Encoders for the JSON layouts and export formats, bulk body parsing, and exports whose column types show up late."""
+import asyncio
+import datetime
+import decimal
+import io
+import json
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi import HTTPException
+
+import serialization
+from serialization import dumps, encode_arrow, encode_parquet, encode_rows, parse_bulk_payload, stream_response
+
+COLUMNS = ["id", "value"]
+
+
+def test_dumps_driver_values():
+    row = {"price": decimal.Decimal("10.10"), "at": datetime.datetime(2024, 5, 1, 12, 30),
+           "day": datetime.date(2024, 5, 1), "id": uuid.UUID(int=1), "blob": b"\x00\xff",
+           "wait": datetime.timedelta(minutes=1, seconds=30), "tags": ["a"]}
+    assert json.loads(dumps(row)) == {"price": "10.10", "at": "2024-05-01T12:30:00", "day": "2024-05-01",
+                                      "id": "00000000-0000-0000-0000-000000000001", "blob": "00ff",
+                                      "wait": 90.0, "tags": ["a"]}
+
+
+def test_json_layouts():
+    columns, rows = ["id", "name", "note"], [(1, "a", None), (2, "b", None)]
+    assert encode_rows(columns, rows) == [{"id": 1, "name": "a", "note": None}, {"id": 2, "name": "b", "note": None}]
+    described = [{"name": "id", "type": "integer"}, {"name": "name", "type": "string"}, {"name": "note", "type": "null"}]
+    assert encode_rows(columns, rows, "rows") == {"columns": described, "rows": [[1, "a", None], [2, "b", None]]}
+    assert encode_rows(columns, rows, "columns") == {
+        "columns": described, "data": {"id": [1, 2], "name": ["a", "b"], "note": [None, None]}}
+    with pytest.raises(HTTPException) as raised:
+        encode_rows(columns, rows, "xml")
+    assert raised.value.status_code == 400
+
+
+def test_arrow_and_parquet_round_trip():
+    columns, rows = ["id", "name", "mixed"], [(1, "a", 1), (2, None, "two")]
+    expected = {"id": [1, 2], "name": ["a", None], "mixed": ["1", "two"]}
+    assert pa.ipc.open_stream(encode_arrow(columns, rows)).read_all().to_pydict() == expected
+    assert pq.read_table(io.BytesIO(encode_parquet(columns, rows))).to_pydict() == expected
+
+
+@pytest.mark.parametrize("content_type, body", [
+    ("application/json", b'[{"id": 1, "name": "a"}, {"id": 2, "note": "x"}]'),
+    ("application/json", b'{"items": [{"id": 1, "name": "a"}, {"id": 2, "note": "x"}]}'),
+    ("application/x-ndjson; charset=utf-8", b'{"id": 1, "name": "a"}\n\n{"id": 2, "note": "x"}\n'),
+])
+def test_bulk_json_bodies(content_type, body):
+    assert parse_bulk_payload(content_type, body) == (["id", "name", "note"], [(1, "a", None), (2, None, "x")], False)
+
+
+def test_bulk_csv_body_stays_text():
+    assert parse_bulk_payload("text/csv", b"id,name\n1,a\n\n2,b\n") == (["id", "name"], [("1", "a"), ("2", "b")], True)
+
+
+@pytest.mark.parametrize("content_type, body, status", [
+    ("application/xml", b"<items/>", 415),
+    ("application/json", b"[{", 400),
+    ("application/json", b'"items"', 400),
+])
+def test_bulk_body_refused(content_type, body, status):
+    with pytest.raises(HTTPException) as raised:
+        parse_bulk_payload(content_type, body)
+    assert raised.value.status_code == status
+
+
+@pytest.mark.parametrize("content_type", ["application/json", "application/x-ndjson", "text/csv"])
+def test_bulk_body_not_utf8_is_400(content_type):
+    with pytest.raises(HTTPException) as raised:
+        parse_bulk_payload(content_type, b'[{"name": "caf\xe9"}]')
+    assert raised.value.status_code == 400
+
+
+async def iterate(batches):
+    for batch in batches:
+        yield COLUMNS, batch
+
+
+def export(batches, fmt):
+    async def run():
+        response = await stream_response(iterate(batches), fmt)
+        # StreamingResponse encodes the CSV encoder's str chunks itself
+        return b"".join([chunk.encode() if isinstance(chunk, str) else chunk async for chunk in response.body_iterator])
+    return asyncio.run(run())
+
+
+def test_text_streams():
+    batches = [[(1, "a,b")], [(2, None)]]
+    assert export(batches, "csv") == 'id,value\r\n1,"a,b"\r\n2,\r\n'.encode()
+    assert export(batches, "ndjson") == b'{"id":1,"value":"a,b"}\n{"id":2,"value":null}\n'
+
+
+def test_unknown_stream_format_is_400():
+    with pytest.raises(HTTPException) as raised:
+        export([[(1, 2)]], "xml")
+    assert raised.value.status_code == 400
+
+
+def read_table(body, fmt):
+    if fmt == "arrow":
+        return pa.ipc.open_stream(body).read_all()
+    return pq.read_table(io.BytesIO(body))
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_null_first_column_takes_later_type(fmt):
+    table = read_table(export([[(1, None)], [(2, 5)], [(3, None)]], fmt), fmt)
+    assert table.schema.field("value").type == pa.int64()
+    assert table.to_pydict() == {"id": [1, 2, 3], "value": [None, 5, None]}
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_text_fallback_in_one_batch(fmt):
+    # Mixed types in the first batch make its column text; later integers are written as text too
+    table = read_table(export([[(1, "x"), (2, 3)], [(3, 4)]], fmt), fmt)
+    assert table.to_pydict() == {"id": [1, 2, 3], "value": ["x", "3", "4"]}
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_column_null_past_buffer_is_text(fmt, monkeypatch):
+    monkeypatch.setattr(serialization, "ARROW_SCHEMA_BUFFER_ROWS", 2)
+    table = read_table(export([[(1, None)], [(2, None)], [(3, 7)]], fmt), fmt)
+    assert table.to_pydict() == {"id": [1, 2, 3], "value": [None, None, "7"]}
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_all_null_column(fmt):
+    table = read_table(export([[(1, None)], [(2, None)]], fmt), fmt)
+    assert table.to_pydict() == {"id": [1, 2], "value": [None, None]}
@@ -0,0 +1,204 @@
+"""
+Tenants on a shared cluster must not reach each other's data or the cluster's other databases.
+
+FakeCluster applies the provisioning statements the way Postgres does for the privileges that
+matter here: unquoted names fold to lower case, every role may connect to a database through
+PUBLIC until that is revoked, and a schema is usable only by its owner unless granted. With
+TEST_DATABASE_URL (a superuser URL on a disposable cluster) the connection checks also run
+against real Postgres.
+"""
+import asyncio
+import os
+import re
+import uuid
+
+import pytest
+from sqlalchemy.exc import SQLAlchemyError
+
+from schemas import UserCreate
+from tenancy import SchemaTenancy, SharedDatabaseTenancy
+
+ADMIN = "postgres"
+MAIN_DATABASE = "multi-tenant-db"
+
+
+def unquote(name: str) -> str:
+    if name.startswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name.lower()
+
+
+NAME = r'("(?:[^"]|"")+"|[A-Za-z_][A-Za-z0-9_]*)'
+STATEMENTS = [
+    ("create_role", re.compile(rf"CREATE ROLE {NAME} LOGIN")),
+    ("create_database", re.compile(rf"CREATE DATABASE {NAME}(?: OWNER {NAME})?$")),
+    ("revoke_database", re.compile(rf"REVOKE (?:ALL|CONNECT) ON DATABASE {NAME} FROM {NAME}$")),
+    ("grant_database", re.compile(rf"GRANT CONNECT ON DATABASE {NAME} TO {NAME}$")),
+    ("create_schema", re.compile(rf"CREATE SCHEMA {NAME} AUTHORIZATION {NAME}$")),
+    ("revoke_schema", re.compile(rf"REVOKE ALL ON SCHEMA {NAME} FROM PUBLIC$")),
+    ("drop_schema", re.compile(rf"DROP SCHEMA IF EXISTS {NAME} CASCADE$")),
+    ("drop_database", re.compile(rf"DROP DATABASE IF EXISTS {NAME}$")),
+    ("drop_role", re.compile(rf"DROP ROLE IF EXISTS {NAME}$")),
+    ("ignored", re.compile(r"(ALTER ROLE|DROP OWNED BY) ")),
+]
+
+
+class FakeCluster:
+    def __init__(self):
+        self.roles = {ADMIN}
+        # database -> owner, roles granted CONNECT, whether PUBLIC may connect
+        self.databases = {}
+        # (database, schema) -> owner, or None for a schema any role may use
+        self.schemas = {}
+        for name in ("postgres", "template1", MAIN_DATABASE):
+            self._create_database(name, ADMIN)
+
+    def _create_database(self, name, owner):
+        self.databases[name] = {"owner": owner, "grants": set(), "public": True}
+        self.schemas[(name, "public")] = None
+
+    def execute(self, statement: str, database: str):
+        for kind, pattern in STATEMENTS:
+            match = pattern.match(statement)
+            if match:
+                break
+        else:
+            raise AssertionError(f"Unexpected admin statement: {statement}")
+        names = [unquote(name) for name in match.groups() if name is not None]
+        if kind == "create_role":
+            self.roles.add(names[0])
+        elif kind == "create_database":
+            owner = names[1] if len(names) > 1 else ADMIN
+            assert owner in self.roles, f"role {owner} does not exist"
+            self._create_database(names[0], owner)
+        elif kind == "revoke_database":
+            if statement.endswith(" PUBLIC"):
+                self.databases[names[0]]["public"] = False
+            else:
+                self.databases[names[0]]["grants"].discard(names[1])
+        elif kind == "grant_database":
+            assert names[1] in self.roles, f"role {names[1]} does not exist"
+            self.databases[names[0]]["grants"].add(names[1])
+        elif kind == "create_schema":
+            assert names[1] in self.roles, f"role {names[1]} does not exist"
+            self.schemas[(database, names[0])] = names[1]
+        elif kind == "revoke_schema":
+            self.schemas[(database, names[0])] = ADMIN
+        elif kind == "drop_schema":
+            self.schemas.pop((database, names[0]), None)
+        elif kind == "drop_database":
+            self.databases.pop(names[0], None)
+        elif kind == "drop_role":
+            self.roles.discard(names[0])
+
+    def can_connect(self, role: str, database: str) -> bool:
+        privileges = self.databases[database]
+        return role in self.roles and (privileges["public"] or role == privileges["owner"] or role in privileges["grants"])
+
+    def can_use_schema(self, role: str, database: str, schema: str) -> bool:
+        owner = self.schemas[(database, schema)]
+        return self.can_connect(role, database) and owner in (None, role)
+
+
+class FakeClusterMixin:
+    def __init__(self, cluster: FakeCluster, **kwargs):
+        super().__init__(protected_databases=["postgres", "template1", MAIN_DATABASE, "missing"], **kwargs)
+        self.cluster = cluster
+
+    def run_admin(self, statements, database: str = "postgres"):
+        for statement in statements:
+            self.cluster.execute(statement, database)
+
+    def existing_databases(self, names):
+        return [name for name in names if name in self.cluster.databases]
+
+    def role_exists(self, username: str) -> bool:
+        return username in self.cluster.roles
+
+    def terminate_sessions(self, username: str):
+        pass
+
+
+class FakeSharedDatabaseTenancy(FakeClusterMixin, SharedDatabaseTenancy):
+    pass
+
+
+class FakeSchemaTenancy(FakeClusterMixin, SchemaTenancy):
+    pass
+
+
+TENANTS = [UserCreate(username="Alice", password="alice_secret"), UserCreate(username="bob", password="bob_secret")]
+
+
+def provision(backend):
+    async def run():
+        return [await backend.provision(user) for user in TENANTS]
+    return asyncio.run(run())
+
+
+def test_database_tenants_connect_only_to_their_database():
+    cluster = FakeCluster()
+    tenants = provision(FakeSharedDatabaseTenancy(cluster))
+    assert [tenant["database_name"] for tenant in tenants] == ["Alice", "bob"]
+    for user in TENANTS:
+        reachable = {name for name in cluster.databases if cluster.can_connect(user.username, name)}
+        assert reachable == {user.username}
+    assert cluster.can_connect(ADMIN, MAIN_DATABASE)
+
+
+def test_schema_tenants_use_only_their_schema():
+    cluster = FakeCluster()
+    tenants = provision(FakeSchemaTenancy(cluster, database="tenants"))
+    assert [tenant["schema_name"] for tenant in tenants] == ["Alice", "bob"]
+    for user in TENANTS:
+        reachable = {name for name in cluster.databases if cluster.can_connect(user.username, name)}
+        assert reachable == {"tenants"}
+        usable = {schema for database, schema in cluster.schemas
+                  if database == "tenants" and cluster.can_use_schema(user.username, database, schema)}
+        assert usable == {user.username}
+
+
+def test_deprovision_removes_tenant():
+    cluster = FakeCluster()
+    backend = FakeSharedDatabaseTenancy(cluster)
+    provision(backend)
+    asyncio.run(backend.deprovision({"username": "Alice"}))
+    assert "Alice" not in cluster.roles and "Alice" not in cluster.databases
+    assert "bob" in cluster.roles
+
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL is not set")
+def test_database_tenants_refused_on_postgres():
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import make_url
+
+    admin_url = make_url(os.environ["TEST_DATABASE_URL"]).set(drivername="postgresql+psycopg2")
+    backend = SharedDatabaseTenancy(host=admin_url.host, port=admin_url.port or 5432, admin_user=admin_url.username,
+                                    admin_password=admin_url.password, protected_databases=[admin_url.database])
+    suffix = uuid.uuid4().hex[:8]
+    users = [UserCreate(username=f"Tenant_{suffix}_{i}", password=f"pw_{suffix}_{i}") for i in range(2)]
+
+    def refused(user, database):
+        engine = create_engine(admin_url.set(username=user.username, password=user.password, database=database))
+        try:
+            with engine.connect():
+                return False
+        except SQLAlchemyError:
+            return True
+        finally:
+            engine.dispose()
+
+    async def run():
+        for user in users:
+            await backend.provision(user)
+
+    try:
+        asyncio.run(run())
+        assert not refused(users[0], users[0].username)
+        assert refused(users[0], users[1].username)
+        assert refused(users[0], admin_url.database)
+    finally:
+        for user in users:
+            asyncio.run(backend.deprovision({"username": user.username}))
+        backend.run_admin([f"GRANT CONNECT ON DATABASE \"{admin_url.database}\" TO PUBLIC"])
+        asyncio.run(backend.stop())
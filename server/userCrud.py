@@ -1,17 +1,24 @@
-from sqlalchemy.orm import Session
-from models import create_table_in_db, insert_item, get_items, update_item, delete_item
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
 
-def create_table(session: Session, table_name: str, columns: dict):
-    return create_table_in_db(session, table_name, columns)
+async def create_table(session: AsyncSession, table_name: str, columns: dict):
+    return await models.create_table_in_db(session, table_name, columns)
 
-def insert_item(session: Session, table_name: str, item: dict):
-    insert_item(session, table_name, item)
+async def insert_item(session: AsyncSession, table_name: str, item: dict):
+    await models.insert_item(session, table_name, item)
 
-def get_items(session: Session, table_name: str):
-    return get_items(session, table_name)
+async def bulk_insert_items(session: AsyncSession, table_name: str, columns: list, records: list, upsert: bool = False,
+                            text_format: bool = False):
+    return await models.bulk_insert_items(session, table_name, columns, records, upsert=upsert, text_format=text_format)
 
-def update_item(session: Session, table_name: str, item_id: int, item: dict):
-    update_item(session, table_name, item_id, item)
+async def get_items(session: AsyncSession, table_name: str, limit: int = None, after_id: int = None):
+    return await models.get_items(session, table_name, limit, after_id)
 
-def delete_item(session: Session, table_name: str, item_id: int):
-    delete_item(session, table_name, item_id)
+def stream_items(session: AsyncSession, table_name: str):
+    return models.stream_items(session, table_name)
+
+async def update_item(session: AsyncSession, table_name: str, item_id: int, item: dict):
+    await models.update_item(session, table_name, item_id, item)
+
+async def delete_item(session: AsyncSession, table_name: str, item_id: int):
+    await models.delete_item(session, table_name, item_id)
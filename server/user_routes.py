@@ -1,25 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from database import DATABASE_POOLS, get_session
-from userCrud import create_table, insert_item, get_items, update_item, delete_item
+from fastapi import APIRouter, HTTPException, Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from query_engine import get_tenant_sessionmaker
+from catalog import catalog_cache
+from result_cache import cached_json_response, result_cache
+from typing import Optional
+from userCrud import create_table, insert_item, bulk_insert_items, get_items, stream_items, update_item, delete_item
+from models import full_scan_query, page_size
+from serialization import TypedJSONResponse, parse_bulk_payload, stream_response
 from schemas import TableCreate, ItemCreate, ItemUpdate
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import text
 
-router = APIRouter()
+router = APIRouter(default_response_class=TypedJSONResponse)
 
-def get_db_session(username: str) -> Session:
-    # Fetch the database URL for the username
-    if username in DATABASE_POOLS:
-        database_url = DATABASE_POOLS[username]["database_url"]
-    else:
-        raise HTTPException(status_code=404, detail=f"Database for user '{username}' not found.")
-    
-    return get_session(username, database_url)
+async def get_db_session(username: str) -> AsyncSession:
+    # Fetch the database endpoint for the username from the main users table
+    SessionLocal = await get_tenant_sessionmaker(username)
+    async with SessionLocal() as session:
+        yield session
 
 
 @router.get("/{username}/test_connection")
-def test_connection(username: str, session: Session = Depends(get_db_session)):
+async def test_connection(username: str, session: AsyncSession = Depends(get_db_session)):
     """
     Test the connectivity to the user's database by executing a simple query.
 
@@ -31,54 +33,116 @@ def test_connection(username: str, session: Session = Depends(get_db_session)):
     """
     try:
         # Execute a simple query to test the connection
-        result = session.execute(text("SELECT 1"))
+        result = await session.execute(text("SELECT 1"))
         # Commit if the connection is successful
-        session.commit()
+        await session.commit()
         return {"message": f"Connection to database for user '{username}' is successful."}
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
     
 @router.post("/{username}/create_table")
-def create_table_endpoint(username: str, table: TableCreate, db: Session = Depends(get_db_session)):
+async def create_table_endpoint(username: str, table: TableCreate, db: AsyncSession = Depends(get_db_session)):
     try:
-        create_table(db, table.table_name, table.columns)
+        await create_table(db, table.table_name, table.columns)
         return {"message": f"Table {table.table_name} created successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        catalog_cache.invalidate(username)
+        result_cache.invalidate_table(username, table.table_name)
 
 @router.post("/{username}/insert_item")
-def insert_item_endpoint(username: str, table_name: str, item: ItemCreate, db: Session = Depends(get_db_session)):
+async def insert_item_endpoint(username: str, table_name: str, item: ItemCreate, db: AsyncSession = Depends(get_db_session)):
+    await catalog_cache.validate_columns(username, table_name, item.item.keys())
     try:
-        insert_item(db, table_name, item.item)
+        await insert_item(db, table_name, item.item)
         return {"message": f"Item inserted successfully into table '{table_name}'"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        result_cache.invalidate_table(username, table_name)
 
 @router.get("/{username}/get_items")
-def get_items_endpoint(username: str, table_name: str, db: Session = Depends(get_db_session)):
+async def get_items_endpoint(request: Request, username: str, table_name: str, limit: Optional[int] = None,
+                             after_id: Optional[int] = None, db: AsyncSession = Depends(get_db_session)):
+    await catalog_cache.require_table(username, table_name)
+
+    async def read_items():
+        try:
+            items = await get_items(db, table_name, limit, after_id)
+            next_after_id = items[-1].get("id") if len(items) == page_size(limit) else None
+            return {"items": items, "next_after_id": next_after_id}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return await cached_json_response(request, username, table_name, ("items", limit, after_id), read_items)
+
+@router.get("/{username}/stream_items")
+async def stream_items_endpoint(username: str, table_name: str, format: str = "ndjson"):
     try:
-        items = get_items(db, table_name)
-        return {"items": items}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        full_scan_query(table_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await catalog_cache.require_table(username, table_name)
+    # The stream owns its session: a request-scoped one would be closed before the body is sent
+    SessionLocal = await get_tenant_sessionmaker(username)
+
+    async def batches():
+        try:
+            async with SessionLocal() as session:
+                async for batch in stream_items(session, table_name):
+                    yield batch
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await stream_response(batches(), format)
+
+@router.post("/{username}/bulk_insert")
+async def bulk_insert_endpoint(username: str, table_name: str, request: Request, upsert: bool = False,
+                               db: AsyncSession = Depends(get_db_session)):
+    """
+    Insert many items in one request from a JSON array, NDJSON or CSV body.
+
+    Parameters:
+    - table_name: The table to load.
+    - upsert: Update rows whose 'id' already exists instead of failing the chunk.
+
+    Returns:
+    - Rows inserted, chunks committed and the errors of any failed chunks.
+    """
+    columns, records, text_format = parse_bulk_payload(request.headers.get("content-type"), await request.body())
+    await catalog_cache.validate_columns(username, table_name, columns)
+    try:
+        report = await bulk_insert_items(db, table_name, columns, records, upsert=upsert, text_format=text_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        result_cache.invalidate_table(username, table_name)
+    return {"message": f"{report['inserted']} of {len(records)} items inserted into table '{table_name}'", **report}
 
 @router.put("/{username}/update_item/{item_id}")
-def update_item_endpoint(username: str, table_name: str, item_id: int, item: ItemUpdate, db: Session = Depends(get_db_session)):
+async def update_item_endpoint(username: str, table_name: str, item_id: int, item: ItemUpdate, db: AsyncSession = Depends(get_db_session)):
+    await catalog_cache.validate_columns(username, table_name, item.item.keys())
     try:
-        update_item(db, table_name, item_id, item.item)
+        await update_item(db, table_name, item_id, item.item)
         return {"message": f"Item with ID {item_id} updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        result_cache.invalidate_table(username, table_name)
 
 @router.delete("/{username}/delete_item/{item_id}")
-def delete_item_endpoint(username: str, table_name: str, item_id: int, db: Session = Depends(get_db_session)):
+async def delete_item_endpoint(username: str, table_name: str, item_id: int, db: AsyncSession = Depends(get_db_session)):
+    await catalog_cache.require_table(username, table_name)
     try:
-        delete_item(db, table_name, item_id)
+        await delete_item(db, table_name, item_id)
         return {"message": f"Item with ID {item_id} deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        result_cache.invalidate_table(username, table_name)
 
 @router.get("/test")
-def test_endpoint():
+async def test_endpoint():
     return {"message": "Test endpoint is working"}